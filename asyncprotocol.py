@@ -0,0 +1,512 @@
+import asyncio
+import logging
+import socket
+import time
+from packet import RxPacket, RxPFlags, RxPOption, RxPacketFormatException
+from checksum import DEFAULT_CHECKSUM, DEFAULT_CHECKSUM_PREFERENCE, get_checksum, choose_checksum
+from congestion import get_congestion_control, DEFAULT_CONGESTION_CONTROL
+from connection import RxPConnectionState
+from rtt import RxPRTTEstimator
+from buffers import RxPRingBuffer
+from handshake import RxPHalfOpenTable
+from logs import get_logger
+
+'''
+RxP on asyncio
+One event loop drives the socket and every connection on it, timers are loop.call_later handles.
+Speaks the same wire protocol as RxP/RxPConnection so either side can be the threaded implementation
+
+    rxp = AsyncRxP()
+    connection = await rxp.open_connection("127.0.0.1", 0, "127.0.0.1", 50001)
+    connection.write(b'get file|SEPARATOR|')
+    await connection.drain()
+    data = await connection.read(512)
+'''
+class AsyncRxP(asyncio.DatagramProtocol):
+    def __init__(self, loglevel=logging.DEBUG, checksums=DEFAULT_CHECKSUM_PREFERENCE, congestion_control=DEFAULT_CONGESTION_CONTROL):
+        self.logger = get_logger("AsyncSocket", loglevel)
+        self.loglevel = loglevel
+        self.congestion_control = congestion_control
+        # the largest datagram we read
+        self.BUFFER_SIZE = 512
+        # how long to wait for the other side during the handshake before resending
+        self.HANDSHAKE_TIMEOUT = 1.0
+        self.transport = None
+        self.loop = None
+        self.ip = None
+        self.port = None
+        # checksum algorithms we accept, in order of preference
+        self.checksums = [get_checksum(checksum) for checksum in checksums]
+        # checksum algorithm negotiated with each peer, keyed by (ip, port)
+        self.peer_checksums = {}
+        # established connections, keyed by (ip, port) of the other side
+        self.connections = {}
+        # server side half open connections, (our sequence, their sequence, SYN/ACK packet),
+        # a handshake that times out stops resending its SYN/ACK
+        self.initiating_connections = RxPHalfOpenTable(on_evict=self.__forget_half_open)
+        # open_connection calls waiting for their SYN/ACK
+        self.connecting = {}
+        self.packet_sequence_number = 0
+        # called with every connection a server accepts
+        self.client_connected_cb = None
+
+    """Bind the datagram endpoint"""
+    async def listen(self, ip, port):
+        self.loop = asyncio.get_running_loop()
+        await self.loop.create_datagram_endpoint(lambda: self, local_addr=(ip, port))
+        self.ip, self.port = self.transport.get_extra_info('sockname')[:2]
+        self.logger.info("Listening @ IP: %s, Port: %s", self.ip, self.port)
+
+    """Accept connections, client_connected_cb(connection) is called for each, it may be a coroutine function"""
+    async def start_server(self, client_connected_cb, ip, port):
+        self.client_connected_cb = client_connected_cb
+        await self.listen(ip, port)
+        return self
+
+    """Connect to a server, returns the established AsyncRxPConnection"""
+    async def open_connection(self, sourceip, sourceport, destinationip, destport, window_size=64):
+        if self.transport is None:
+            await self.listen(sourceip, sourceport)
+        key = (socket.gethostbyname(destinationip), destport)
+        synack = self.loop.create_future()
+        self.connecting[key] = synack
+        sequence = self.__get_next_packet_sequence_number()
+        syn_packet = RxPacket(RxPFlags.SYN, sequence, sourceport=self.port, destport=destport,
+            data=RxPacket.pack_options({RxPOption.CHECKSUM: bytes([checksum.ID for checksum in self.checksums])}))
+        timeout = self.HANDSHAKE_TIMEOUT
+        try:
+            while not synack.done():
+                self.logger.debug("Sending SYN Packet")
+                self.send_packet(syn_packet, key)
+                try:
+                    await asyncio.wait_for(asyncio.shield(synack), timeout)
+                except asyncio.TimeoutError:
+                    timeout *= 2
+        finally:
+            del self.connecting[key]
+        packet = synack.result()
+        self.__send_handshake_ack(key, packet)
+        connection = AsyncRxPConnection(self, key, sequence, packet.sequence, window_size)
+        self.connections[key] = connection
+        return connection
+
+    def close(self):
+        for connection in list(self.connections.values()):
+            connection.destroy()
+        if self.transport is not None:
+            self.transport.close()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        try:
+            packet = RxPacket.deserialize(data)
+        except RxPacketFormatException as e:
+            self.logger.error("Malformed Packet Detected, dropping packet: %s", e)
+            return
+        key = (addr[0], addr[1])
+        packet.sourceip, packet.sourceport = key
+        if not RxPacket.verify_checksum(data, packet, self.checksum_for(key, packet)):
+            self.logger.error("Corrupt Packet Detected, dropping packet %s", packet)
+            return
+        connection = self.connections.get(key)
+        if packet.flags & RxPFlags.SYN:
+            self.__handle_handshake(key, packet, connection)
+        elif connection is not None:
+            connection.handle_packet(packet)
+        elif key in self.initiating_connections:
+            self.__establish(key, packet)
+
+    def error_received(self, exc):
+        self.logger.debug("Socket error: %s", exc)
+
+    """SYN and SYN/ACK packets"""
+    def __handle_handshake(self, key, packet, connection):
+        if packet.flags & RxPFlags.ACK:
+            waiting = self.connecting.get(key)
+            if waiting is not None and not waiting.done():
+                chosen = RxPacket.unpack_options(packet.data).get(RxPOption.CHECKSUM, b'')
+                if chosen and chosen[0] in {checksum.ID for checksum in self.checksums}:
+                    self.peer_checksums[key] = get_checksum(chosen[0])
+                waiting.set_result(packet)
+            elif connection is not None:
+                # our ACK of the SYN/ACK was lost
+                self.__send_handshake_ack(key, packet)
+        elif connection is None and key not in self.initiating_connections and self.client_connected_cb is not None:
+            offered = RxPacket.unpack_options(packet.data).get(RxPOption.CHECKSUM, b'')
+            checksum = choose_checksum(offered, self.checksums)
+            sequence = self.__get_next_packet_sequence_number()
+            synack_packet = RxPacket(RxPFlags.SYN | RxPFlags.ACK, sequence, ack=packet.sequence, sourceport=self.port, destport=key[1],
+                data=RxPacket.pack_options({RxPOption.CHECKSUM: bytes([checksum.ID])}))
+            self.initiating_connections.add(key, (sequence, packet.sequence, synack_packet))
+            self.logger.debug("Sending SYNACK packet, checksum: %s", checksum)
+            self.__send_synack(key, synack_packet, self.HANDSHAKE_TIMEOUT)
+            # everything after the SYN/ACK is protected by the chosen checksum
+            self.peer_checksums[key] = checksum
+
+    """Send the SYN/ACK and keep resending it with backoff until the handshake completes"""
+    def __send_synack(self, key, synack_packet, timeout):
+        entry = self.initiating_connections.get(key)
+        if entry is None or entry[2] is not synack_packet:
+            return
+        self.send_packet(synack_packet, key)
+        self.loop.call_later(timeout, self.__send_synack, key, synack_packet, timeout * 2)
+
+    """The ACK of our SYN/ACK, or any later packet if that ACK was lost, establishes the connection"""
+    def __establish(self, key, packet):
+        entry = self.initiating_connections.pop(key)
+        if entry is None:
+            return
+        sequence, peer_sequence, synack_packet = entry
+        connection = AsyncRxPConnection(self, key, sequence, peer_sequence)
+        self.connections[key] = connection
+        self.logger.debug("Connection established with %s:%s", *key)
+        if packet.flags & (RxPFlags.DATA | RxPFlags.FIN):
+            connection.handle_packet(packet)
+        result = self.client_connected_cb(connection)
+        if asyncio.iscoroutine(result):
+            self.loop.create_task(result)
+
+    def __forget_half_open(self, key, entry):
+        self.logger.debug("Forgetting half open connection %s:%s", *key)
+        self.peer_checksums.pop(key, None)
+
+    def __send_handshake_ack(self, key, packet):
+        self.send_packet(RxPacket(RxPFlags.ACK, None, ack=packet.sequence, sourceport=self.port, destport=key[1]), key)
+
+    def __get_next_packet_sequence_number(self):
+        self.packet_sequence_number += 1
+        return self.packet_sequence_number
+
+    '''Checksum algorithm protecting a packet to or from a peer, SYN packets always use the default'''
+    def checksum_for(self, key, packet):
+        if packet.flags & RxPFlags.SYN:
+            return DEFAULT_CHECKSUM
+        return self.peer_checksums.get(key, DEFAULT_CHECKSUM)
+
+    def send_packet(self, packet, key):
+        packet.sent_time = time.monotonic()
+        packet.transmissions += 1
+        self.transport.sendto(RxPacket.serialize(packet, self.checksum_for(key, packet)), key)
+
+    def forget(self, key):
+        self.connections.pop(key, None)
+        self.peer_checksums.pop(key, None)
+
+
+'''
+A connection on an AsyncRxP endpoint, with a StreamReader/StreamWriter style API
+The sender and receiver logic is the same as RxPConnection: a window limited by congestion control
+and the peer's receive window, cumulative ACKs with SACK blocks, and sequenced FINs
+'''
+class AsyncRxPConnection:
+    def __init__(self, rxp, key, sequence, ack, window_size=64):
+        self.rxp = rxp
+        self.loop = rxp.loop
+        self.logger = get_logger("AsyncConnection", rxp.loglevel, "%s:%s" % key)
+        self.destinationip, self.destinationport = key
+        self.key = key
+        self.state = RxPConnectionState.ESTABLISHED
+        # largest data a single packet can carry
+        self.MAX_SEGMENT_SIZE = rxp.BUFFER_SIZE - RxPacket.HEADER_SIZE
+        # drain() returns once less than this is waiting to be packetized
+        self.WRITE_BUFFER_LIMIT = 64 * 1024
+        self.DUPLICATE_ACK_THRESHOLD = 3
+        self.ACK_EVERY = 16
+        self.DELAYED_ACK_TIMEOUT = 0.05
+        self.CLOSE_TIMEOUT = 10.0
+        # sending side
+        self.window_size = window_size
+        self.send_buffer = bytearray()
+        self.last_seq = sequence
+        self.send_unacked = sequence + 1
+        # packets sent and not acknowledged, in sequence order
+        self.unacked = {}
+        self.congestion = get_congestion_control(rxp.congestion_control)
+        self.rtt_estimator = RxPRTTEstimator()
+        self.retransmit_timer = None
+        self.duplicate_acks = (None, None, 0)
+        self.recovery_point = None
+        self.peer_window = None
+        self.drain_waiters = []
+        self.fin_sequence = None
+        self.close_requested = False
+        self.close_timer = None
+        # receiving side
+        self.RECEIVE_BUFFER_SIZE = 64 * 1024
+        self.receive_buffer = RxPRingBuffer(self.RECEIVE_BUFFER_SIZE)
+        self.receive_next = ack + 1
+        self.out_of_order = {}
+        self.unacked_received = 0
+        self.delayed_ack_timer = None
+        self.advertised_window = self.__receive_window()
+        self.read_waiter = None
+        # the other side sent its FIN, read returns b'' once the buffer is empty
+        self.eof = False
+        self.closed = self.loop.create_future()
+
+    """Read up to n bytes, b'' at the end of the stream"""
+    async def read(self, n=-1):
+        while len(self.receive_buffer) == 0:
+            if self.eof or self.state is RxPConnectionState.CLOSED:
+                return b''
+            self.read_waiter = self.loop.create_future()
+            await self.read_waiter
+        data = self.receive_buffer.read(len(self.receive_buffer) if n < 0 else n)
+        self.__send_window_update()
+        return bytes(data)
+
+    """Read exactly n bytes"""
+    async def readexactly(self, n):
+        data = bytearray()
+        while len(data) < n:
+            chunk = await self.read(n - len(data))
+            if not chunk:
+                raise asyncio.IncompleteReadError(bytes(data), n)
+            data.extend(chunk)
+        return bytes(data)
+
+    """Queue data to be sent"""
+    def write(self, data):
+        if self.close_requested or self.state is not RxPConnectionState.ESTABLISHED and self.state is not RxPConnectionState.CLOSE_WAIT:
+            raise ConnectionError("Connection state is not established it is: %s" % self.state)
+        self.send_buffer.extend(data)
+        self.__fill_send_window()
+
+    """Wait until the write buffer has room again"""
+    async def drain(self):
+        while len(self.send_buffer) > self.WRITE_BUFFER_LIMIT and self.state is not RxPConnectionState.CLOSED:
+            waiter = self.loop.create_future()
+            self.drain_waiters.append(waiter)
+            await waiter
+        if self.state is RxPConnectionState.CLOSED and self.send_buffer:
+            raise ConnectionResetError("Connection closed with data unsent")
+
+    """Close once everything written has been sent"""
+    def close(self):
+        self.close_requested = True
+        self.__maybe_send_fin()
+
+    async def wait_closed(self):
+        await self.closed
+
+    def is_closing(self):
+        return self.close_requested or self.state is not RxPConnectionState.ESTABLISHED
+
+    def destroy(self):
+        if self.state is RxPConnectionState.CLOSED and self.closed.done():
+            return
+        self.logger.debug("Destroying Connection")
+        self.state = RxPConnectionState.CLOSED
+        for timer in (self.retransmit_timer, self.delayed_ack_timer, self.close_timer):
+            if timer is not None:
+                timer.cancel()
+        self.rxp.forget(self.key)
+        self.__wake_reader()
+        self.__wake_drainers()
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def handle_packet(self, packet):
+        if self.state is RxPConnectionState.CLOSED:
+            return
+        if packet.flags & RxPFlags.ACK:
+            self.__handle_ack_packet(packet)
+        elif packet.flags & (RxPFlags.FIN | RxPFlags.DATA):
+            self.__handle_sequenced_packet(packet)
+
+    # sending
+
+    def effective_window(self):
+        window = min(self.congestion.window(), self.window_size)
+        if self.peer_window is not None:
+            window = min(window, self.peer_window)
+        return max(1, window)
+
+    def __fill_send_window(self):
+        window = self.effective_window()
+        while self.send_buffer and self.last_seq + 1 < self.send_unacked + window:
+            data = bytes(self.send_buffer[:self.MAX_SEGMENT_SIZE])
+            del self.send_buffer[:self.MAX_SEGMENT_SIZE]
+            self.last_seq += 1
+            push = not self.send_buffer or self.last_seq + 1 >= self.send_unacked + window
+            flags = RxPFlags.DATA | RxPFlags.PSH if push else RxPFlags.DATA
+            self.__send_sequenced(RxPacket(flags, self.last_seq, sourceport=self.rxp.port, destport=self.destinationport, data=data))
+        if len(self.send_buffer) <= self.WRITE_BUFFER_LIMIT:
+            self.__wake_drainers()
+        self.__maybe_send_fin()
+
+    def __maybe_send_fin(self):
+        if not self.close_requested or self.send_buffer or self.fin_sequence is not None:
+            return
+        if self.state is RxPConnectionState.ESTABLISHED:
+            self.state = RxPConnectionState.FIN_WAIT_1
+        elif self.state is RxPConnectionState.CLOSE_WAIT:
+            self.state = RxPConnectionState.LAST_ACK
+        else:
+            return
+        self.last_seq += 1
+        self.fin_sequence = self.last_seq
+        self.logger.debug("Sending FIN packet to close connection")
+        self.__send_sequenced(RxPacket(RxPFlags.FIN, self.fin_sequence, sourceport=self.rxp.port, destport=self.destinationport))
+        self.__arm_close_timer()
+
+    def __send_sequenced(self, packet):
+        self.unacked[packet.sequence] = packet
+        self.rxp.send_packet(packet, self.key)
+        if self.retransmit_timer is None:
+            self.__arm_retransmit_timer()
+
+    def __arm_retransmit_timer(self):
+        if self.retransmit_timer is not None:
+            self.retransmit_timer.cancel()
+            self.retransmit_timer = None
+        if self.unacked:
+            self.retransmit_timer = self.loop.call_later(self.rtt_estimator.rto, self.__handle_retransmit_timeout)
+
+    def __handle_retransmit_timeout(self):
+        self.retransmit_timer = None
+        if not self.unacked or self.state is RxPConnectionState.CLOSED:
+            return
+        self.rtt_estimator.backoff()
+        if self.peer_window != 0:
+            self.congestion.on_timeout()
+        self.recovery_point = next(reversed(self.unacked))
+        self.rxp.send_packet(self.unacked[next(iter(self.unacked))], self.key)
+        self.__arm_retransmit_timer()
+
+    def __handle_ack_packet(self, packet):
+        ack = packet.ack
+        window = packet.window
+        self.peer_window = window
+        acked = 0
+        acked_packet = None
+        for sequence in list(self.unacked):
+            if sequence > ack:
+                break
+            acked_packet = self.unacked.pop(sequence)
+            acked += 1
+        for sequence in RxPacket.sacked(self.unacked, RxPacket.unpack_sack(packet.data)):
+            del self.unacked[sequence]
+            acked += 1
+        if ack + 1 > self.send_unacked:
+            self.send_unacked = min(ack + 1, self.last_seq + 1)
+        last_ack, last_window, duplicates = self.duplicate_acks
+        if acked_packet is not None:
+            # Karn's rule
+            if acked_packet.sequence == ack and acked_packet.transmissions == 1:
+                self.rtt_estimator.sample(time.monotonic() - acked_packet.sent_time)
+            self.duplicate_acks = (ack, window, 0)
+            if self.recovery_point is not None and ack < self.recovery_point and self.unacked:
+                self.rxp.send_packet(self.unacked[next(iter(self.unacked))], self.key)
+            else:
+                self.recovery_point = None
+            self.__arm_retransmit_timer()
+        elif ack == last_ack and window == last_window and self.unacked:
+            duplicates += 1
+            self.duplicate_acks = (ack, window, duplicates)
+            if duplicates == self.DUPLICATE_ACK_THRESHOLD and self.recovery_point is None:
+                self.recovery_point = next(reversed(self.unacked))
+                self.congestion.on_loss()
+                self.rxp.send_packet(self.unacked[next(iter(self.unacked))], self.key)
+        else:
+            self.duplicate_acks = (ack, window, 0)
+        if acked:
+            self.congestion.on_ack(acked, self.rtt_estimator.srtt)
+        if self.fin_sequence is not None and ack >= self.fin_sequence:
+            if self.state is RxPConnectionState.FIN_WAIT_1:
+                self.state = RxPConnectionState.FIN_WAIT_2
+                self.__arm_close_timer()
+            elif self.state in (RxPConnectionState.CLOSING, RxPConnectionState.LAST_ACK):
+                self.destroy()
+                return
+        self.__fill_send_window()
+
+    def __arm_close_timer(self):
+        if self.close_timer is not None:
+            self.close_timer.cancel()
+        self.close_timer = self.loop.call_later(self.CLOSE_TIMEOUT, self.destroy)
+
+    def __wake_drainers(self):
+        waiters, self.drain_waiters = self.drain_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    # receiving
+
+    def __handle_sequenced_packet(self, packet):
+        if packet.stream:
+            # streams are never offered in the handshake, a peer opening one anyway is refused
+            self.logger.debug("Refusing packet %s of stream %s, streams are not supported", packet.sequence, packet.stream)
+            return
+        if packet.sequence < self.receive_next:
+            self.__send_ack()
+        elif packet.sequence > self.receive_next:
+            if packet.sequence < self.receive_next + self.__receive_window():
+                if packet.data is not None:
+                    packet.data = bytes(packet.data)
+                self.out_of_order[packet.sequence] = packet
+            self.__send_ack()
+        elif packet.data is not None and len(packet.data) > self.receive_buffer.free():
+            self.__send_ack()
+        else:
+            filled_gap = len(self.out_of_order) > 0
+            push = packet.flags & RxPFlags.PSH
+            self.__deliver(packet)
+            while self.receive_next in self.out_of_order:
+                next_packet = self.out_of_order.pop(self.receive_next)
+                push = push or next_packet.flags & RxPFlags.PSH
+                self.__deliver(next_packet)
+            self.unacked_received += 1
+            if filled_gap or push or self.eof or self.unacked_received >= self.ACK_EVERY:
+                self.__send_ack()
+            elif self.delayed_ack_timer is None:
+                self.delayed_ack_timer = self.loop.call_later(self.DELAYED_ACK_TIMEOUT, self.__send_ack)
+            self.__wake_reader()
+
+    def __deliver(self, packet):
+        self.receive_next = packet.sequence + 1
+        if packet.flags & RxPFlags.DATA:
+            self.receive_buffer.write(packet.data)
+        elif packet.flags & RxPFlags.FIN:
+            self.logger.debug("Recieved FIN")
+            self.eof = True
+            if self.state is RxPConnectionState.ESTABLISHED:
+                self.state = RxPConnectionState.CLOSE_WAIT
+            elif self.state is RxPConnectionState.FIN_WAIT_1:
+                self.state = RxPConnectionState.CLOSING
+            elif self.state is RxPConnectionState.FIN_WAIT_2:
+                self.__send_ack()
+                self.destroy()
+
+    def __send_ack(self):
+        if self.delayed_ack_timer is not None:
+            self.delayed_ack_timer.cancel()
+            self.delayed_ack_timer = None
+        self.unacked_received = 0
+        if self.rxp.transport is None:
+            return
+        self.advertised_window = self.__receive_window()
+        sack_blocks = []
+        for sequence in sorted(self.out_of_order):
+            if sack_blocks and sack_blocks[-1][1] == sequence - 1:
+                sack_blocks[-1] = (sack_blocks[-1][0], sequence)
+            elif len(sack_blocks) < RxPacket.MAX_SACK_BLOCKS:
+                sack_blocks.append((sequence, sequence))
+        self.rxp.send_packet(RxPacket(RxPFlags.ACK, None, ack=self.receive_next - 1, sourceport=self.rxp.port, destport=self.destinationport,
+            data=RxPacket.pack_sack(sack_blocks) if sack_blocks else None, window=self.advertised_window), self.key)
+
+    def __receive_window(self):
+        return min(0xFFFF, self.receive_buffer.free() // self.MAX_SEGMENT_SIZE)
+
+    def __send_window_update(self):
+        window = self.__receive_window()
+        maximum = self.RECEIVE_BUFFER_SIZE // self.MAX_SEGMENT_SIZE
+        if self.state is not RxPConnectionState.CLOSED and ((self.advertised_window == 0 and window > 0) or window - self.advertised_window >= max(1, maximum // 4)):
+            self.__send_ack()
+
+    def __wake_reader(self):
+        if self.read_waiter is not None and not self.read_waiter.done():
+            self.read_waiter.set_result(None)
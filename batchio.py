@@ -0,0 +1,267 @@
+import ctypes
+import ctypes.util
+import errno
+from logs import get_logger
+import socket
+import struct
+import sys
+
+'''
+Batched datagram I/O for a UDP socket
+Sending takes a list of datagrams, each a list of buffers and an address, and hands them to the kernel together.
+Receiving returns every datagram already waiting, up to the batch size, after one blocking wait.
+
+sendmmsg/recvmmsg are called through ctypes on Linux when kernel_batching is asked for.
+Filling in their structures from Python costs more than the system calls it saves on loopback,
+see python benchmark.py io, so by default a datagram is one sendto, its buffers joined,
+and the receive side drains the socket with non-blocking recvfrom calls.
+Only sendmmsg saves system calls, batching tells callers whether holding datagrams back to send them together is worth it
+'''
+
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0x40)
+# recvmmsg flag, block for the first datagram only
+MSG_WAITFORONE = 0x10000
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_IOVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+class _SockAddrIn(ctypes.Structure):
+    _fields_ = [
+        ('sin_family', ctypes.c_ushort),
+        ('sin_port', ctypes.c_uint16),
+        ('sin_addr', ctypes.c_uint8 * 4),
+        ('sin_zero', ctypes.c_uint8 * 8)]
+
+
+"""The C buffer behind any object supporting the buffer protocol, readonly ones included"""
+class _PyBuffer(ctypes.Structure):
+    _fields_ = [
+        ('buf', ctypes.c_void_p),
+        ('obj', ctypes.c_void_p),
+        ('len', ctypes.c_ssize_t),
+        ('itemsize', ctypes.c_ssize_t),
+        ('readonly', ctypes.c_int),
+        ('ndim', ctypes.c_int),
+        ('format', ctypes.c_char_p),
+        ('shape', ctypes.c_void_p),
+        ('strides', ctypes.c_void_p),
+        ('suboffsets', ctypes.c_void_p),
+        ('internal', ctypes.c_void_p)]
+
+_get_buffer = ctypes.pythonapi.PyObject_GetBuffer
+_get_buffer.argtypes = [ctypes.py_object, ctypes.POINTER(_PyBuffer), ctypes.c_int]
+_release_buffer = ctypes.pythonapi.PyBuffer_Release
+_release_buffer.argtypes = [ctypes.POINTER(_PyBuffer)]
+
+
+"""libc when it has sendmmsg and recvmmsg, None everywhere else"""
+def _load_libc():
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+
+class RxPDatagramIO:
+    SEND_METHODS = ('sendmmsg', 'sendmsg', 'sendto')
+    RECEIVE_METHODS = ('recvmmsg', 'recvmsg_into', 'recvfrom')
+
+    def __init__(self, sock, buffer_size, batch_size=64, send_method=None, receive_method=None, kernel_batching=False):
+        self.logger = get_logger("DatagramIO")
+        self.sock = sock
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.kernel_batching = kernel_batching and _libc is not None and getattr(sock, 'family', None) == socket.AF_INET and hasattr(sock, 'fileno')
+        # sendmsg saves joining the buffers but is slower than sendto for datagrams this size
+        self.send_method = send_method or self.__best(self.SEND_METHODS if self.kernel_batching else ('sendto',))
+        self.receive_method = receive_method or self.__best(self.RECEIVE_METHODS if self.kernel_batching else ('recvfrom',))
+        # real sockets are drained without blocking once the first datagram is in
+        self.drain = hasattr(sock, 'fileno')
+        if self.send_method not in self.SEND_METHODS or self.receive_method not in self.RECEIVE_METHODS:
+            raise ValueError("Unknown I/O methods: %s, %s" % (self.send_method, self.receive_method))
+        if not self.kernel_batching and 'mmsg' in self.send_method + self.receive_method:
+            raise ValueError("sendmmsg and recvmmsg need kernel_batching on an IPv4 socket under Linux")
+        # whether datagrams sent together share system calls
+        self.batching = self.send_method == 'sendmmsg'
+        # sockaddr structures for the peers we send to, keyed by (ip, port)
+        self.addresses = {}
+        # where datagrams are received into, a slot of buffer_size bytes per datagram of a batch
+        self.arena = bytearray(buffer_size * batch_size)
+        self.arena_view = memoryview(self.arena)
+        if self.receive_method == 'recvmmsg':
+            self.receive_headers = (_MMsgHdr * batch_size)()
+            self.receive_iovecs = (_IOVec * batch_size)()
+            self.receive_names = (_SockAddrIn * batch_size)()
+            for index in range(batch_size):
+                header = self.receive_headers[index].msg_hdr
+                header.msg_name = ctypes.addressof(self.receive_names[index])
+                header.msg_iov = ctypes.pointer(self.receive_iovecs[index])
+                header.msg_iovlen = 1
+                header.msg_namelen = ctypes.sizeof(_SockAddrIn)
+            memory = (ctypes.c_char * len(self.arena)).from_buffer(self.arena)
+            for index in range(batch_size):
+                self.receive_iovecs[index].iov_base = ctypes.addressof(memory) + index * buffer_size
+                self.receive_iovecs[index].iov_len = buffer_size
+            # the headers and addresses are read and reset through plain views, much cheaper than ctypes fields
+            self.header_view = memoryview((ctypes.c_char * ctypes.sizeof(self.receive_headers)).from_buffer(self.receive_headers)).cast('B')
+            self.name_view = memoryview((ctypes.c_char * ctypes.sizeof(self.receive_names)).from_buffer(self.receive_names)).cast('B')
+            # peer addresses by their raw port and IP bytes
+            self.peers = {}
+
+    """The first method of the list this socket supports"""
+    def __best(self, methods):
+        for method in methods:
+            if method in ('sendmmsg', 'recvmmsg'):
+                if self.kernel_batching:
+                    return method
+            elif hasattr(self.sock, method):
+                return method
+        return methods[-1]
+
+    """Send datagrams, a list of (buffers, address)"""
+    def send(self, datagrams):
+        if self.send_method == 'sendmmsg' and len(datagrams) > 1:
+            self.__sendmmsg(datagrams)
+        elif self.send_method == 'sendto':
+            for buffers, address in datagrams:
+                self.sock.sendto(buffers[0] if len(buffers) == 1 else b''.join(buffers), address)
+        else:
+            for buffers, address in datagrams:
+                if len(buffers) == 1:
+                    self.sock.sendto(buffers[0], address)
+                else:
+                    self.sock.sendmsg(buffers, [], 0, address)
+
+    """
+    Wait for datagrams and return all that are waiting, a list of (data, address)
+    recvmmsg and recvmsg_into receive into one preallocated buffer and copy datagrams out at their actual size
+    """
+    def receive(self):
+        # with a timeout set Python waits for every receive, even non-blocking ones
+        drain = self.drain and self.sock.gettimeout() is None
+        if self.receive_method == 'recvfrom':
+            datagrams = [self.sock.recvfrom(self.buffer_size)]
+            while drain and len(datagrams) < self.batch_size:
+                try:
+                    datagrams.append(self.sock.recvfrom(self.buffer_size, MSG_DONTWAIT))
+                except (BlockingIOError, InterruptedError):
+                    break
+            return datagrams
+        if self.receive_method == 'recvmmsg' and drain:
+            return self.__recvmmsg()
+        view = self.arena_view
+        datagrams = []
+        flags = 0
+        while len(datagrams) < self.batch_size:
+            buffer = view[len(datagrams) * self.buffer_size:(len(datagrams) + 1) * self.buffer_size]
+            try:
+                count, ancillary, message_flags, address = self.sock.recvmsg_into([buffer], 0, flags)
+            except (BlockingIOError, InterruptedError):
+                break
+            datagrams.append((bytes(buffer[:count]), address))
+            if not drain:
+                break
+            # only the first datagram is waited for
+            flags = MSG_DONTWAIT
+        return datagrams
+
+    def __sockaddr(self, address):
+        sockaddr = self.addresses.get(address)
+        if sockaddr is None:
+            sockaddr = _SockAddrIn()
+            sockaddr.sin_family = socket.AF_INET
+            sockaddr.sin_port = socket.htons(address[1])
+            sockaddr.sin_addr[:] = socket.inet_aton(socket.gethostbyname(address[0]))
+            self.addresses[address] = sockaddr
+        return sockaddr
+
+    def __sendmmsg(self, datagrams):
+        for start in range(0, len(datagrams), self.batch_size):
+            batch = datagrams[start:start + self.batch_size]
+            headers = (_MMsgHdr * len(batch))()
+            # the buffers are pinned until the call returns, the iovecs point straight into them
+            pinned = []
+            iovec_arrays = []
+            try:
+                for index, (buffers, address) in enumerate(batch):
+                    iovecs = (_IOVec * len(buffers))()
+                    for position, buffer in enumerate(buffers):
+                        view = _PyBuffer()
+                        if _get_buffer(buffer, ctypes.byref(view), 0) != 0:
+                            raise BufferError("Can not send %s" % type(buffer))
+                        pinned.append(view)
+                        iovecs[position].iov_base = view.buf
+                        iovecs[position].iov_len = view.len
+                    iovec_arrays.append(iovecs)
+                    sockaddr = self.__sockaddr(address)
+                    header = headers[index].msg_hdr
+                    header.msg_name = ctypes.addressof(sockaddr)
+                    header.msg_namelen = ctypes.sizeof(sockaddr)
+                    header.msg_iov = iovecs
+                    header.msg_iovlen = len(buffers)
+                sent = 0
+                while sent < len(batch):
+                    result = _libc.sendmmsg(self.sock.fileno(), ctypes.cast(ctypes.byref(headers, sent * ctypes.sizeof(_MMsgHdr)), ctypes.POINTER(_MMsgHdr)), len(batch) - sent, 0)
+                    if result < 0:
+                        error = ctypes.get_errno()
+                        if error == errno.EINTR:
+                            continue
+                        raise OSError(error, "sendmmsg: %s" % errno.errorcode.get(error, error))
+                    sent += result
+            finally:
+                for view in pinned:
+                    _release_buffer(ctypes.byref(view))
+
+    def __recvmmsg(self):
+        while True:
+            count = _libc.recvmmsg(self.sock.fileno(), self.receive_headers, self.batch_size, MSG_WAITFORONE, None)
+            if count >= 0:
+                break
+            error = ctypes.get_errno()
+            if error == errno.EINTR:
+                continue
+            if error in (errno.EAGAIN, errno.EWOULDBLOCK):
+                count = 0
+                break
+            raise OSError(error, "recvmmsg: %s" % errno.errorcode.get(error, error))
+        view = self.arena_view
+        header_size = ctypes.sizeof(_MMsgHdr)
+        length_offset = _MMsgHdr.msg_len.offset
+        # the kernel overwrote the address lengths of the slots it used
+        namelen_offset = _MMsgHdr.msg_hdr.offset + _MsgHdr.msg_namelen.offset
+        name_size = ctypes.sizeof(_SockAddrIn)
+        datagrams = []
+        for index in range(count):
+            name = bytes(self.name_view[index * name_size + 2:index * name_size + 8])
+            address = self.peers.get(name)
+            if address is None:
+                address = self.peers[name] = (socket.inet_ntoa(name[2:]), struct.unpack('!H', name[:2])[0])
+            length = struct.unpack_from('I', self.header_view, index * header_size + length_offset)[0]
+            struct.pack_into('I', self.header_view, index * header_size + namelen_offset, name_size)
+            start = index * self.buffer_size
+            datagrams.append((bytes(view[start:start + length]), address))
+        return datagrams
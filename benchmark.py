@@ -0,0 +1,324 @@
+import argparse
+import gc
+import hashlib
+import json
+import logging
+import resource
+import socket
+import time
+import timeit
+from threading import Thread
+from packet import RxPacket, RxPFlags, PACKET_POOL
+from checksum import RxPChecksums
+from communicator import RxPCommunicator
+from connection import RxPConnection, poll
+from dispatch import RxPPacketDispatcher
+from buffers import RxPRingBuffer
+from batchio import RxPDatagramIO
+from protocol import RxP
+
+
+'''
+Benchmarks for the RxP transport
+Run with: python benchmark.py <benchmark> [options]
+Results are printed as JSON so they can be compared between commits
+'''
+
+
+"""The checksum packets used before checksums were pluggable, MD5 over string formatted fields"""
+def legacy_md5_checksum(packet):
+    m = hashlib.md5()
+    for name in RxPFlags.names(packet.flags):
+        m.update(name.encode('utf-8'))
+    if packet.sequence:
+        m.update(str(packet.sequence).encode('utf-8'))
+    if packet.ack:
+        m.update(str(packet.ack).encode('utf-8'))
+    if packet.data:
+        m.update(packet.data)
+    if packet.sourceip:
+        m.update(packet.sourceip.encode('utf-8'))
+    if packet.sourceport:
+        m.update(str(packet.sourceport).encode('utf-8'))
+    if packet.destinationip:
+        m.update(packet.destinationip.encode('utf-8'))
+    if packet.destport:
+        m.update(str(packet.destport).encode('utf-8'))
+    return m.digest()
+
+
+"""Time every checksum algorithm on a full size DATA packet, on both the send and receive path"""
+def bench_checksum(args):
+    payload = bytes(range(256)) * (args.payload // 256 + 1)
+    packet = RxPacket(RxPFlags.DATA, 1000, ack=999, data=payload[:args.payload], sourceip="127.0.0.1", destinationip="127.0.0.1", sourceport=50000, destport=50001)
+    results = {'payload': args.payload, 'iterations': args.iterations, 'usec_per_packet': {}}
+    timer = timeit.Timer(lambda: legacy_md5_checksum(packet))
+    results['usec_per_packet']['legacy-md5'] = timer.timeit(args.iterations) / args.iterations * 1e6
+    for key, algorithm in RxPChecksums.items():
+        if not isinstance(key, str):
+            continue
+        datagram = RxPacket.serialize(packet, algorithm)
+        received = RxPacket.deserialize(datagram)
+        timer = timeit.Timer(lambda: RxPacket.verify_checksum(datagram, received, algorithm))
+        results['usec_per_packet'][key] = timer.timeit(args.iterations) / args.iterations * 1e6
+    return results
+
+
+"""
+Receive side packet handling, DATA packets handed to connections the way the socket reader does
+spawn starts a thread per packet like RxPConnection.run used to, thread gives each connection a thread,
+inline handles packets on the submitting thread and pool on --workers worker threads.
+ACKs go out over a real UDP socket to a sink nobody reads
+"""
+def bench_dispatch(args):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(("127.0.0.1", 0))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    communicator = RxPCommunicator(sock, logging.WARNING)
+    payload = bytes(args.payload)
+    results = {'payload': args.payload, 'packets': args.iterations, 'connections': args.connections, 'workers': args.workers, 'packets_per_sec': {}}
+    for mode in ('spawn', 'thread', 'inline', 'pool'):
+        dispatcher = None
+        if mode == 'inline':
+            dispatcher = RxPPacketDispatcher(0)
+        elif mode == 'pool':
+            dispatcher = RxPPacketDispatcher(args.workers)
+        packets_each = args.iterations // args.connections
+        connections = []
+        for index in range(args.connections):
+            connection = RxPConnection("bench %s" % index, "127.0.0.1", sock.getsockname()[1], "127.0.0.1", sink.getsockname()[1],
+                0, 0, communicator, logging.WARNING, dispatcher=dispatcher)
+            # room for everything so nothing is dropped however the packets are reordered
+            connection.receive_buffer = RxPRingBuffer(len(payload) * (packets_each + 1))
+            # every connection has its own address so the pool spreads them over the workers
+            connection.destinationport += index
+            connections.append(connection)
+        spawned = []
+        start = time.perf_counter()
+        for connection in connections:
+            if mode == 'thread':
+                connection.start()
+            else:
+                connection.establish()
+        for sequence in range(1, packets_each + 1):
+            for connection in connections:
+                # a packet of its own for every delivery from the pool like the socket reader,
+                # handle_packet releases it back to the pool once the connection is done with it
+                packet = PACKET_POOL.acquire(RxPFlags.DATA, sequence, data=payload)
+                if mode == 'spawn':
+                    thread = Thread(target=connection.handle_packet, args=(packet,))
+                    thread.daemon = True
+                    thread.start()
+                    spawned.append(thread)
+                else:
+                    connection.deliver_packet(packet)
+        for thread in spawned:
+            thread.join()
+        if dispatcher is not None:
+            dispatcher.close()
+        while any(connection.receive_next <= packets_each for connection in connections):
+            time.sleep(0.0001)
+        elapsed = time.perf_counter() - start
+        results['packets_per_sec'][mode] = packets_each * len(connections) / elapsed
+        for connection in connections:
+            connection.destroy()
+    communicator.close()
+    sock.close()
+    sink.close()
+    return results
+
+
+"""
+Datagram throughput over loopback for each way of sending and receiving,
+one system call per datagram against batches of --batch datagrams
+"""
+def bench_io(args):
+    buffer_size = args.payload + RxPacket.HEADER_SIZE
+    datagram = bytes(buffer_size)
+    results = {'payload': args.payload, 'datagrams': args.iterations, 'batch': args.batch, 'datagrams_per_sec': {}, 'received': {}}
+    combinations = [('sendto', 'recvfrom'), ('sendmsg', 'recvfrom'), ('sendmsg', 'recvmsg_into'), ('sendmmsg', 'recvmmsg')]
+    for send_method, receive_method in combinations:
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        receiver.bind(("127.0.0.1", 0))
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            kernel_batching = send_method == 'sendmmsg'
+            sending = RxPDatagramIO(sender, buffer_size, args.batch, send_method=send_method, kernel_batching=kernel_batching)
+            receiving = RxPDatagramIO(receiver, buffer_size, args.batch, receive_method=receive_method, kernel_batching=kernel_batching)
+        except ValueError:
+            # not supported on this platform
+            continue
+        received = [0]
+        def receive():
+            # one byte markers after the data end the run even when datagrams were dropped
+            while received[0] < args.iterations:
+                datagrams = receiving.receive()
+                received[0] += sum(1 for data, address in datagrams if len(data) > 1)
+                if any(len(data) == 1 for data, address in datagrams):
+                    return
+        reader = Thread(target=receive)
+        reader.daemon = True
+        start = time.perf_counter()
+        reader.start()
+        address = receiver.getsockname()
+        batch = [([datagram], address)] * args.batch
+        for sent in range(0, args.iterations, args.batch):
+            sending.send(batch[:min(args.batch, args.iterations - sent)])
+        for i in range(10):
+            sender.sendto(b'x', address)
+        reader.join(10)
+        elapsed = time.perf_counter() - start
+        name = "%s/%s" % (send_method, receive_method)
+        results['datagrams_per_sec'][name] = args.iterations / elapsed
+        results['received'][name] = received[0]
+        sender.close()
+        receiver.close()
+    return results
+
+
+"""The value below which the fraction of sorted values fall"""
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+"""
+One cell of the transport matrix: count clients connect to one server over loopback,
+each sends size bytes with the given window and the server reads it all.
+Packet and retransmit counts come from the communicators' stats, latency is timed by wrapping
+their send and receive, from the first transmission of a DATA packet to its first arrival
+"""
+def run_transport(window, size, count, timeout):
+    server = RxP(logging.CRITICAL)
+    server.listen("127.0.0.1", 0)
+    clients = [RxP(logging.CRITICAL) for i in range(count)]
+    first_sent = {}
+    latencies = []
+    for client in clients:
+        def timed_send(packet, send_packet=client.communicator.send_packet):
+            if packet.flags & RxPFlags.DATA and not packet.transmissions:
+                first_sent[(packet.sourceport, packet.sequence)] = time.monotonic()
+            return send_packet(packet)
+        client.communicator.send_packet = timed_send
+    receive_packets = server.communicator.receive_packets
+    def timed_receive():
+        packets = receive_packets()
+        now = time.monotonic()
+        for packet in packets:
+            if packet.flags & RxPFlags.DATA:
+                sent = first_sent.pop((packet.sourceport, packet.sequence), None)
+                if sent is not None:
+                    latencies.append(now - sent)
+        return packets
+    server.communicator.receive_packets = timed_receive
+    accepted = []
+    acceptor = Thread(target=lambda: accepted.extend(server.accept() for i in range(count)))
+    acceptor.daemon = True
+    acceptor.start()
+    connections = [client.connect("127.0.0.1", 0, "127.0.0.1", server.port, window) for client in clients]
+    acceptor.join(timeout)
+    payload = bytes(range(256)) * (size // 256 + 1)
+    payload = memoryview(payload)[:size]
+    expected = len("bench|SEPARATOR|") + size
+    communicators = [server.communicator] + [client.communicator for client in clients]
+    before = [communicator.stats.snapshot() for communicator in communicators]
+    data_packets = sum(connection.stats.snapshot()['data_packets_sent'] for connection in connections)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    collections = gc.get_stats()[0]['collections']
+    start = time.perf_counter()
+    for connection in connections:
+        connection.send("bench", payload)
+    received = {id(connection): 0 for connection in accepted}
+    deadline = start + timeout
+    open_connections = list(accepted)
+    while open_connections and sum(received.values()) < expected * count and time.perf_counter() < deadline:
+        for connection in poll(open_connections, max(0.0, deadline - time.perf_counter())):
+            data = connection.receive(expected)
+            if data is None:
+                open_connections.remove(connection)
+            else:
+                received[id(connection)] += len(data)
+    elapsed = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    collections = gc.get_stats()[0]['collections'] - collections
+    cpu = (after.ru_utime - usage.ru_utime) + (after.ru_stime - usage.ru_stime)
+    counters = {'packets_sent': 0, 'retransmits': 0}
+    for communicator, snapshot in zip(communicators, before):
+        for name in counters:
+            counters[name] += communicator.stats.snapshot()[name] - snapshot[name]
+    data_packets = sum(connection.stats.snapshot()['data_packets_sent'] for connection in connections) - data_packets
+    for connection in connections:
+        connection.close()
+    # the sockets, their readers, dispatchers and timers must not carry over into the next cell
+    for rxp in [server] + clients:
+        rxp.close()
+    latencies.sort()
+    megabytes = size * count / 1e6
+    return {
+        'window': window,
+        'size': size,
+        'connections': count,
+        'completed': sum(received.values()) == expected * count,
+        'seconds': elapsed,
+        'goodput_mbps': megabytes * 8 / elapsed,
+        'packets_per_sec': counters['packets_sent'] / elapsed,
+        'latency_p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'latency_p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'cpu_sec_per_mb': cpu / megabytes,
+        'retransmit_ratio': counters['retransmits'] / max(1, data_packets),
+        # youngest generation garbage collections per thousand packets sent, a measure of allocation churn
+        'gc_per_kpacket': collections * 1000 / max(1, counters['packets_sent']),
+        # peak of the whole process so far, kilobytes on Linux
+        'peak_rss_kb': after.ru_maxrss,
+    }
+
+
+"""RxP connect/accept pairs over loopback across a matrix of window sizes, transfer sizes and connection counts"""
+def bench_transport(args):
+    results = {'cells': []}
+    for window in args.windows:
+        for size in args.sizes:
+            for count in args.connection_counts:
+                results['cells'].append(run_transport(window, size, count, args.timeout))
+    return results
+
+
+"""Comma separated integers for the matrix options"""
+def integers(text):
+    return [int(value) for value in text.split(',')]
+
+
+BENCHMARKS = {
+    'checksum': bench_checksum,
+    'dispatch': bench_dispatch,
+    'io': bench_io,
+    'transport': bench_transport,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RxP benchmarks")
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--payload', type=int, default=512 - RxPacket.HEADER_SIZE, help="payload bytes per packet")
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--connections', type=int, default=4, help="connections packets are spread over")
+    parser.add_argument('--workers', type=int, default=4, help="worker threads of the dispatcher")
+    parser.add_argument('--batch', type=int, default=64, help="datagrams per batched system call")
+    parser.add_argument('--windows', type=integers, default=[8, 64], help="send window sizes of the transport matrix")
+    parser.add_argument('--sizes', type=integers, default=[100000, 1000000], help="bytes each connection sends")
+    parser.add_argument('--connection-counts', type=integers, default=[1, 4], help="connections at the same time")
+    parser.add_argument('--timeout', type=float, default=60, help="seconds a transport cell may take")
+    parser.add_argument('--output', help="write the JSON results to this file as well")
+    args = parser.parse_args(argv)
+    results = BENCHMARKS[args.benchmark](args)
+    text = json.dumps({args.benchmark: results}, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(text + "\n")
+
+
+if __name__ == '__main__':
+    main()
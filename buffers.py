@@ -0,0 +1,45 @@
+'''
+Fixed capacity byte ring buffer
+Writes and reads copy only the bytes moved, the storage is allocated once
+'''
+class RxPRingBuffer:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        # index of the first byte held
+        self.start = 0
+        # number of bytes held
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    """Bytes that can still be written"""
+    def free(self):
+        return self.capacity - self.size
+
+    """Append as much of data as fits, returns the number of bytes written"""
+    def write(self, data):
+        data = memoryview(data)
+        count = min(len(data), self.free())
+        end = (self.start + self.size) % self.capacity
+        first = min(count, self.capacity - end)
+        self.view[end:end + first] = data[:first]
+        if count > first:
+            self.view[0:count - first] = data[first:count]
+        self.size += count
+        return count
+
+    """Remove and return up to count bytes from the front"""
+    def read(self, count):
+        count = min(count, self.size)
+        first = min(count, self.capacity - self.start)
+        data = bytearray(self.view[self.start:self.start + first])
+        if count > first:
+            data.extend(self.view[0:count - first])
+        self.start = (self.start + count) % self.capacity
+        self.size -= count
+        if self.size == 0:
+            self.start = 0
+        return data
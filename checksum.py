@@ -0,0 +1,140 @@
+import hashlib
+import zlib
+
+try:
+    # optional hardware accelerated CRC32C implementation
+    import crc32c as _crc32c
+except ImportError:
+    _crc32c = None
+
+'''
+Checksum algorithms that can protect a packet.
+Every algorithm works over the serialized header and the payload bytes,
+the header is passed without the checksum field.
+Each algorithm has a one byte ID, which is what is exchanged during the handshake
+'''
+class RxPChecksum:
+    ID = None
+    NAME = None
+
+    """Return the checksum of header followed by data as an unsigned 32 bit integer"""
+    def compute(self, header, data):
+        raise NotImplementedError()
+
+    def __str__(self):
+        return self.NAME
+
+
+"""RFC 1071 Internet checksum, the 16 bit ones' complement of the ones' complement sum"""
+class RxPInternetChecksum(RxPChecksum):
+    ID = 1
+    NAME = 'inet'
+
+    def compute(self, header, data):
+        # 2^16 is 1 modulo 0xFFFF so the sum of all 16 bit words folds down to the
+        # value of the whole buffer modulo 0xFFFF, which lets int.from_bytes do the loop.
+        # The header is always an even number of bytes so data stays word aligned
+        total = int.from_bytes(header, 'big') % 0xFFFF
+        if data:
+            value = int.from_bytes(data, 'big')
+            # an odd trailing byte is padded with a zero byte
+            if len(data) % 2:
+                value <<= 8
+            total += value % 0xFFFF
+        return 0xFFFF - (total % 0xFFFF)
+
+
+"""CRC32C (Castagnoli), uses the crc32c module when installed"""
+class RxPCRC32CChecksum(RxPChecksum):
+    ID = 2
+    NAME = 'crc32c'
+    POLYNOMIAL = 0x82F63B78
+
+    def __init__(self):
+        self.table = []
+        for i in range(256):
+            crc = i
+            for _ in range(8):
+                crc = (crc >> 1) ^ self.POLYNOMIAL if crc & 1 else crc >> 1
+            self.table.append(crc)
+
+    def compute(self, header, data):
+        if _crc32c is not None:
+            crc = _crc32c.crc32c(header)
+            if data:
+                crc = _crc32c.crc32c(data, crc)
+            return crc
+        crc = 0xFFFFFFFF
+        table = self.table
+        for buffer in (header, data or b''):
+            for byte in bytes(buffer):
+                crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+        return crc ^ 0xFFFFFFFF
+
+
+"""CRC32 (IEEE) from zlib"""
+class RxPCRC32Checksum(RxPChecksum):
+    ID = 3
+    NAME = 'crc32'
+
+    def compute(self, header, data):
+        crc = zlib.crc32(header)
+        if data:
+            crc = zlib.crc32(data, crc)
+        return crc
+
+
+"""MD5 truncated to 32 bits, what packets were protected with before the checksum could be negotiated"""
+class RxPMD5Checksum(RxPChecksum):
+    ID = 4
+    NAME = 'md5'
+
+    def compute(self, header, data):
+        m = hashlib.md5(header)
+        if data:
+            m.update(data)
+        return int.from_bytes(m.digest()[:4], 'big')
+
+
+"""No checksum at all, for loopback or links that already checksum (offload)"""
+class RxPNoChecksum(RxPChecksum):
+    ID = 0
+    NAME = 'none'
+
+    def compute(self, header, data):
+        return 0
+
+
+'''All the known checksum algorithms, by ID and by name'''
+RxPChecksums = {}
+for _algorithm in (RxPInternetChecksum(), RxPCRC32CChecksum(), RxPCRC32Checksum(), RxPMD5Checksum(), RxPNoChecksum()):
+    RxPChecksums[_algorithm.ID] = _algorithm
+    RxPChecksums[_algorithm.NAME] = _algorithm
+
+'''Algorithm protecting SYN packets and packets from peers we have not negotiated with'''
+DEFAULT_CHECKSUM = RxPChecksums['inet']
+
+'''
+Algorithms offered in the handshake unless told otherwise, in order of preference
+CRC32C is only offered with the crc32c module, the table fallback is far too slow for every packet
+'''
+DEFAULT_CHECKSUM_PREFERENCE = ('crc32', 'inet', 'crc32c') if _crc32c is not None else ('crc32', 'inet')
+
+
+"""Look up a checksum algorithm by name or ID"""
+def get_checksum(key):
+    if isinstance(key, RxPChecksum):
+        return key
+    try:
+        return RxPChecksums[key]
+    except KeyError:
+        raise ValueError("Unknown checksum algorithm: %s" % key)
+
+
+"""Pick the first offered checksum ID that is also accepted, the default when there is none"""
+def choose_checksum(offered, accepted):
+    accepted_ids = {checksum.ID for checksum in accepted}
+    for checksum_id in offered:
+        if checksum_id in accepted_ids:
+            return get_checksum(checksum_id)
+    return DEFAULT_CHECKSUM
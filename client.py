@@ -1,127 +1,144 @@
 from protocol import RxP
+from connection import RxPConnectionSendException
 import logging
 import sys
 import threading
-from connection import RxPConnectionState
+from logs import get_logger
+from filesink import RxPFileSink
+from tickets import RxPSessionCache
+from framing import RxPCommand, RxPFrameDecoder, RxPFrameFormatException, FRAME_START, FRAME_DATA, encode_frame, send_message, send_file
 
 class Client:
+    # most bytes taken from the connection at a time
+    RECEIVE_SIZE = 65536
+    # largest file taken from the server
+    MAX_FILE_SIZE = RxPFileSink.MAX_LENGTH
+
     def __init__(self, bindport, destip, destport, loglevel=logging.DEBUG):
-        self.logger = logging.getLogger("Client")
+        self.logger = get_logger("Client", loglevel)
         self.loglevel = loglevel
-        # create console handler and set level to debug
-        self.logger.setLevel(loglevel)
-        # create console handler and set level to debug
-        ch = logging.StreamHandler()
-        ch.setLevel(loglevel)
-        # create formatter
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        # add formatter to ch
-        ch.setFormatter(formatter)
-        # add ch to logger
-        self.logger.addHandler(ch)
         self.bindport = int(bindport)
         self.destip = destip
         self.destport = int(destport)
         self.connection = None
-        
-        self.receive_state = None
-        self.separator_text = b'|SEPARATOR|'
+        # tickets of the server, a reconnect resumes where the last connection left off
+        self.sessions = RxPSessionCache()
         
     
-    def connect(self):
-        socket = RxP(self.loglevel)
-        conn = socket.connect("127.0.0.1", self.bindport, self.destip, self.destport, self.connect_listener)
+    '''
+    Connect to the server, get names a file to ask for in the SYN itself,
+    a server with fast open answers it in the first round trip
+    '''
+    def connect(self, window_size=64, get=None):
+        socket = RxP(self.loglevel, sessions=self.sessions)
+        request = encode_frame(RxPCommand.GET, get, 0) if get is not None else None
+        self.connection = socket.connect("127.0.0.1", self.bindport, self.destip, self.destport, window_size, request)
         self.logger.debug("Connection process started")
-        return conn
+        return self.connection
 
+    '''
+    Ask the server for a file, it arrives as filename_server
+    Every get has a stream of its own, so several files come in at once and a big one does not hold
+    up the others. Returns the thread writing the file, None with a server that does not take streams
+    whose answer comes on the connection itself
+    '''
+    def get(self, filename):
+        if not self.connection.streams_enabled:
+            send_message(self.connection, RxPCommand.GET, filename)
+            return None
+        stream = self.connection.open_stream()
+        send_message(stream, RxPCommand.GET, filename)
+        stream.close()
+        receiver = threading.Thread(target=self.handle_receive_data, args=(stream,))
+        receiver.daemon = True
+        receiver.start()
+        return receiver
 
-    def connect_listener(self, connection):
-        self.connection = connection
+    '''Send a file to the server, it is stored as filename_client'''
+    def post(self, filename):
+        return send_file(self.connection, RxPCommand.FILE, filename + "_client", filename)
 
     def handle_receive_data(self, conn):
         self.logger.debug("Handling Receiving of Data")
-        data = bytearray()
-        filename = None
-        while conn.state is RxPConnectionState.ESTABLISHED:
-            self.logger.debug("Client Receiving Data")
-            data.extend(conn.receive(512))
-            
-            separator = data.find(self.separator_text)
-            
-            self.logger.debug("Client Separator Found : "+str(separator))
-            if separator is not -1:
-                server_command = data[0:separator].decode("utf-8") 
-                self.logger.debug("Client command: "+server_command)
-                command = server_command.split(' ')[0]
-                filename = server_command.split(' ')[1]
-                contents = data[separator+1+len(self.separator_text):]
-                if 'file' in command:
-                    self.logger.debug("Client WRiting bytes to file")
-                    self.receive_state = 'file'
-                    self.__write_bytes_to_file(filename, contents)
-                    data = bytearray()
-            elif self.receive_state == 'file':
-                end_file = data.find(b'|END')
-                if end_file is -1:
-                    self.logger.debug("Client WRiting bytes to file")
-                    self.__write_bytes_to_file(filename, data)
-                    data = bytearray()
-                else:
-                    contents = data[:end_file]
-                    self.__write_bytes_to_file(filename, contents)
-                    self.logger.debug("Ending File Write")
-                    self.receive_state = None
-                    data = bytearray()
-
-            self.logger.debug("Data from Server: "+str(data))
+        decoder = RxPFrameDecoder()
+        output = None
+        try:
+            while True:
+                data = conn.receive(self.RECEIVE_SIZE)
+                if data is None:
+                    # the other side closed and everything it sent was read
+                    break
+                for event, frame, chunk in decoder.feed(data):
+                    if frame.command is not RxPCommand.FILE:
+                        self.logger.debug("Ignoring %s from the server", frame)
+                    elif event == FRAME_START:
+                        self.logger.debug("Client writing %s", frame)
+                        output = RxPFileSink(frame.name, frame.length, max_length=self.MAX_FILE_SIZE)
+                    elif event == FRAME_DATA:
+                        output.write(chunk)
+                    else:
+                        output.close()
+                        output = None
+                        self.logger.debug("Ending File Write of %s", frame)
+        except RxPFrameFormatException as e:
+            self.logger.error("Bad message from the server: %s", e)
+        except OSError as e:
+            # the file can not be written, nothing more the server sends can be taken
+            self.logger.error("Can not store the file from the server: %s", e)
+            conn.close()
+        finally:
+            if output is not None:
+                output.abort()
         self.logger.debug("Ended Client Recieve Data")
 
-    def __write_bytes_to_file(self, filename, data):
-        file = open(filename, "ab")
-        file.write(data)
-        file.close()
 
-
-if len(sys.argv) != 4:
-    print ("""Please provide the following 3 arguments: X A P\n
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print ("""Please provide the following 3 arguments: X A P\n
 X: the port number at which the FxA-client’s UDP socket should bind to (even number). Please remember that this port number should be equal to the server’s port number minus 1. 
 A: the IP address of NetEmu
 P: the UDP port number of NetEmu 
-            """)
-else:
-    print ("Starting client")
-    client = Client( sys.argv[1], sys.argv[2], sys.argv[3], logging.DEBUG)
-    ALIVE = True
-    while ALIVE:
-        user_input = input("What is your wish (command) ?")
-        user_input = user_input.lower()
-        if user_input == 'disconnect':
-            conn.close()
-            ALIVE = False
-            print ("Client End - Goodbye")
-        elif 'window' in user_input:
-            window_size = user_input.split(' ',2)[1]
-            try:
-                window_size = int(window_size)
-                conn.set_window_size(window_size)
-            except ValueError:
-                print ("ERROR window size is not an integer")
-        elif 'connect' in user_input:
-            conn = client.connect()
-            t = threading.Thread(target=client.handle_receive_data, args=(conn,))
-            t.setDaemon(True)
-            t.start()
-        elif 'get' in user_input:
-            file_name = user_input.split(' ',2)[1]
-            conn.send("get "+file_name)
-        elif 'post' in user_input:
-            file_name = user_input.split(' ',2)[1]
-            file_contents = open(file_name, "rb").read()
-            print("Sending following file contents: %s" % file_contents)
-            conn.send("file %s" % (file_name+"_client"), file_contents+b'|END')
+                """)
+    else:
+        print ("Starting client")
+        client = Client( sys.argv[1], sys.argv[2], sys.argv[3], logging.DEBUG)
+        ALIVE = True
+        while ALIVE:
+            user_input = input("What is your wish (command) ?")
+            user_input = user_input.lower()
+            if user_input == 'disconnect':
+                conn.close()
+                ALIVE = False
+                print ("Client End - Goodbye")
+            elif 'window' in user_input:
+                window_size = user_input.split(' ',2)[1]
+                try:
+                    window_size = int(window_size)
+                    conn.set_window_size(window_size)
+                except ValueError:
+                    print ("ERROR window size is not an integer")
+            elif 'connect' in user_input:
+                # connect file asks for the file in the handshake
+                arguments = user_input.split(' ',2)
+                conn = client.connect(get=arguments[1] if len(arguments) > 1 else None)
+                t = threading.Thread(target=client.handle_receive_data, args=(conn,))
+                t.daemon = True
+                t.start()
+            elif 'get' in user_input:
+                file_name = user_input.split(' ',2)[1]
+                try:
+                    client.get(file_name)
+                except RxPConnectionSendException as e:
+                    print ("ERROR the connection is closed: %s" % e)
+            elif 'post' in user_input:
+                file_name = user_input.split(' ',2)[1]
+                try:
+                    print("Sending %s bytes of %s" % (client.post(file_name), file_name))
+                except RxPConnectionSendException as e:
+                    print ("ERROR the connection is closed: %s" % e)
             
             
     
-    print ("Client Should be ended")
+        print ("Client Should be ended")
     
 
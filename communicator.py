@@ -1,39 +1,77 @@
 import logging
+import socket
 import time
-from threading import Timer
+from contextlib import contextmanager
+from threading import RLock, local
 from packet import RxPacket
 from packet import RxPFlags
+from packet import RxPacketFormatException
+from packet import RxPOption
+from packet import PACKET_POOL
+from checksum import DEFAULT_CHECKSUM, DEFAULT_CHECKSUM_PREFERENCE, get_checksum, choose_checksum
+from rtt import RxPRTTEstimator
+from timers import RxPTimerQueue
+from batchio import RxPDatagramIO
+from stats import RxPStats, SOCKET_COUNTERS
+from logs import get_logger, RxPPacketTrace
 from select import select
 
 class RxPCommunicator:
-    def __init__(self,socket, loglevel=logging.DEBUG):
-        self.logger = logging.getLogger("RxPCommunicator")
+    def __init__(self,socket, loglevel=logging.DEBUG, checksums=DEFAULT_CHECKSUM_PREFERENCE, trace=None):
+        self.logger = get_logger("Communicator", loglevel)
         self.loglevel = loglevel
-        # create console handler and set level to debug
-        self.logger.setLevel(loglevel)
-        # create console handler and set level to debug
-        ch = logging.StreamHandler()
-        ch.setLevel(loglevel)
-        # create formatter
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        # add formatter to ch
-        ch.setFormatter(formatter)
-        # add ch to logger
-        self.logger.addHandler(ch)
         # the buffer to read from the 
         self.BUFFER_SIZE = 512
-        # set packet retry delay to 5 seconds
-        self.RETRY_DELAY = 5.0
+        # duplicate ACKs in a row that trigger a fast retransmit
+        self.DUPLICATE_ACK_THRESHOLD = 3
         # packets waiting to be acked, we keep this to check for resend
+        # keyed by the (ip, port) of the peer, then by sequence number in the order they were sent
         self.waiting_to_be_acked={}
-        # keep track of if the RETRY Thread Running 
-        self.RETRY_THREAD = False
+        # guards the per peer retransmission state, it is used from the receive, send and timer threads
+        self.lock = RLock()
+        # round trip time estimate of each peer, keyed by (ip, port)
+        self.rtt_estimators = {}
+        # last cumulative ACK and window from each peer and how many times in a row it was repeated
+        self.duplicate_acks = {}
+        # while recovering from a loss, the highest sequence that was outstanding when it was detected
+        self.recovery_points = {}
+        # the armed retransmission timer of each peer
+        self.retransmit_timers = {}
+        # every retransmission timer of this socket sits in one heap
+        self.timers = RxPTimerQueue()
+        # the socket is being closed, whatever a read still returns is dropped
+        self.closed = False
+        # connections told about losses to their peer, keyed by (ip, port)
+        self.listeners = {}
         # set socket to the passed in socket
         self.sock = socket
+        # sends and receives several datagrams per system call where the socket allows
+        self.io = RxPDatagramIO(socket, self.BUFFER_SIZE)
+        # datagrams held back by an open batch, each thread batches on its own
+        self.batches = local()
         # packet sequence
         self.packet_sequence_number = 0
         # alive status
         self.ALIVE = True
+        # checksum algorithms we accept, in order of preference
+        self.checksums = [get_checksum(checksum) for checksum in checksums]
+        # checksum algorithm negotiated with each peer, keyed by (ip, port)
+        self.peer_checksums = {}
+        # counters for the whole socket and for each peer, keyed by (ip, port)
+        self.stats = RxPStats(SOCKET_COUNTERS)
+        self.peer_stats = {}
+        # binary record of the last packets sent and received, None when not tracing
+        self.trace = None
+        if trace:
+            self.enable_trace(trace)
+
+    """Keep the last capacity packets sent and received in a trace that can be dumped later"""
+    def enable_trace(self, capacity=4096):
+        self.trace = RxPPacketTrace(capacity)
+        return self.trace
+
+    def disable_trace(self):
+        self.trace = None
 
     
     """
@@ -41,14 +79,23 @@ class RxPCommunicator:
     We are going to ACKnowledge that we received the packet by sending the sequence number
     we received as the ACK number
     
-    And tell the client to initialize by ACK our first packet
+    And tell the client to initialize by ACK our first packet, fast_open tells it we took the
+    data its SYN carried, resumed that we took its ticket and streams that it may open streams
     
     This is is a private method
     """
-    def sendCONNECTSYNACK(self, sourceip, sourceport, packet):
-        flags = [RxPFlags.SYN, RxPFlags.ACK]
+    def sendCONNECTSYNACK(self, sourceip, sourceport, packet, fast_open=False, resumed=False, streams=False):
+        flags = RxPFlags.SYN | RxPFlags.ACK
         ack = packet.sequence
-        seq = self.packet_sequence_number
+        seq = self.__get_next_packet_sequence_number()
+        checksum = self.__choose_checksum(packet)
+        options = {RxPOption.CHECKSUM: bytes([checksum.ID])}
+        if fast_open:
+            options[RxPOption.FAST_OPEN] = b''
+        if resumed:
+            options[RxPOption.TICKET] = b''
+        if streams:
+            options[RxPOption.STREAMS] = b''
         synack_packet = RxPacket(
             flags=flags, 
             sequence=seq, 
@@ -56,15 +103,19 @@ class RxPCommunicator:
             sourceip=sourceip, 
             destinationip=packet.sourceip,
             sourceport=sourceport,
-            destport=packet.sourceport)
-        self.logger.debug("Sending SYNACK packet")
+            destport=packet.sourceport,
+            data=RxPacket.pack_options(options))
+        self.logger.debug("Sending SYNACK packet, checksum: %s", checksum)
         self.send_packet(synack_packet)
+        # everything after the SYN/ACK is protected by the chosen checksum
+        self.peer_checksums[(packet.sourceip, packet.sourceport)] = checksum
+        return seq
         
         
         
-    """Send a SYN packet to initiate a connection with the server"""
-    def sendCONNECTSYN(self, sourceip, sourceport, destinationip, destport):
-        flags = [RxPFlags.SYN]
+    """Send a SYN packet to initiate a connection with the server, with fast open data and a resumption ticket when given"""
+    def sendCONNECTSYN(self, sourceip, sourceport, destinationip, destport, data=None, ticket=None):
+        flags = RxPFlags.SYN
         seq = self.__get_next_packet_sequence_number()
         syn_packet = RxPacket(
             flags, 
@@ -72,14 +123,15 @@ class RxPCommunicator:
             sourceip=sourceip, 
             destinationip=destinationip,
             sourceport=sourceport,
-            destport=destport)
+            destport=destport,
+            data=self.__syn_options(data, ticket))
         self.logger.debug("Sending SYN Packet")
         self.send_packet(syn_packet)
         return seq
     
-    '''Send a packet to ACKnowledge a SYNACK or FIN packet'''
-    def sendACK(self, sourceport, sourceip, packet):
-        flags = [RxPFlags.ACK]
+    '''Send a packet to ACKnowledge a SYNACK or FIN packet, window is our receive window'''
+    def sendACK(self, sourceport, sourceip, packet, window=0):
+        flags = RxPFlags.ACK
         ack_packet = RxPacket(
             flags=flags, 
             sequence=None,
@@ -87,42 +139,99 @@ class RxPCommunicator:
             sourceip=sourceip, 
             destinationip=packet.sourceip,
             sourceport=sourceport,
-            destport=packet.sourceport)
+            destport=packet.sourceport,
+            window=window)
         self.logger.debug("Sending ACK packet")
         self.send_packet(ack_packet)
+    
+    """
+    Send a cumulative ACK, acknowledging every packet up to and including ack
+    and the packets in the SACK blocks received out of order after it. With a stream the ACK also
+    tells the other side it may send that stream's data up to limit
+    """
+    def sendSACK(self, sourceip, sourceport, destinationip, destport, ack, sack_blocks=(), window=0, stream=0, limit=0):
+        flags = RxPFlags.ACK
+        # nothing keeps an ACK once it is sent, it goes straight back to the pool
+        ack_packet = PACKET_POOL.acquire(
+            flags=flags, 
+            sequence=None,
+            ack=ack,
+            sourceip=sourceip, 
+            destinationip=destinationip,
+            sourceport=sourceport,
+            destport=destport,
+            data=RxPacket.pack_sack(sack_blocks) if sack_blocks else None,
+            window=window,
+            stream=stream,
+            offset=limit)
+        self.logger.debug("Sending ACK packet ack: %s SACK: %s window: %s", ack, sack_blocks, window)
+        self.send_packet(ack_packet)
+        PACKET_POOL.release(ack_packet)
         
-    """Send a SYN packet to initiate a connection with the server"""
-    def sendCONNECTFIN(self, sourceip, sourceport, destinationip, destport):
-        flags = [RxPFlags.FIN]
-        seq = self.__get_next_packet_sequence_number()
+    """Send a FIN packet to close a connection, the FIN takes a sequence number in the connection like data"""
+    def sendCONNECTFIN(self, sourceip, sourceport, destinationip, destport, sequence=None, data=None):
+        flags = RxPFlags.FIN
+        seq = sequence if sequence is not None else self.__get_next_packet_sequence_number()
         fin_packet = RxPacket(
             flags, 
             seq, 
             sourceip=sourceip, 
             destinationip=destinationip,
             sourceport=sourceport,
-            destport=destport)
+            destport=destport,
+            data=data)
         self.logger.debug("Sending FIN Packet")
         self.send_packet(fin_packet)
         return seq
         
         
-    """Send a SYN packet to initiate a connection with the server"""
-    def sendDATA(self, sourceip, sourceport, destinationip, destport, data_in_bytes):
-        flags = [RxPFlags.DATA]
-        seq = self.__get_next_packet_sequence_number()
-        data_packet = RxPacket(
+    """
+    Send a DATA packet, push asks the receiver to ACK straight away
+    Data of an opened stream goes with the stream and its offset in it, fin ends the stream
+    """
+    def sendDATA(self, sourceip, sourceport, destinationip, destport, data_in_bytes, sequence=None, push=False, stream=0, offset=0, fin=False):
+        flags = RxPFlags.DATA | RxPFlags.PSH if push else RxPFlags.DATA
+        if fin:
+            flags |= RxPFlags.FIN
+        seq = sequence if sequence is not None else self.__get_next_packet_sequence_number()
+        # released back to the pool once it is acked
+        data_packet = PACKET_POOL.acquire(
             flags, 
             seq, 
             sourceip=sourceip, 
             destinationip=destinationip,
             sourceport=sourceport,
             destport=destport,
-            data=data_in_bytes)
-        self.logger.debug("Sending DATA Packet")
+            data=data_in_bytes,
+            stream=stream,
+            offset=offset)
         self.send_packet(data_packet)
         return seq
     
+    '''Options we send in our SYN, followed by the fast open data when there is any'''
+    def __syn_options(self, data=None, ticket=None):
+        options = {RxPOption.CHECKSUM: bytes([checksum.ID for checksum in self.checksums]), RxPOption.STREAMS: b''}
+        if ticket:
+            options[RxPOption.TICKET] = ticket
+        if data:
+            return RxPacket.pack_fast_open(options, data)
+        return RxPacket.pack_options(options)
+    
+    '''Most bytes of application data a SYN can carry next to its options'''
+    def fast_open_size(self, ticket=None):
+        return self.BUFFER_SIZE - RxPacket.HEADER_SIZE - len(self.__syn_options(b'x', ticket)) + 1
+    
+    '''Pick the first checksum the client offered in its SYN that we also accept'''
+    def __choose_checksum(self, syn_packet):
+        offered = RxPacket.unpack_options(syn_packet.data).get(RxPOption.CHECKSUM, b'')
+        return choose_checksum(offered, self.checksums)
+    
+    '''Checksum algorithm protecting a packet to or from a peer, SYN packets always use the default'''
+    def checksum_for(self, ip, port, packet):
+        if packet.flags & RxPFlags.SYN:
+            return DEFAULT_CHECKSUM
+        return self.peer_checksums.get((ip, port), DEFAULT_CHECKSUM)
+    
     def __get_next_packet_sequence_number(self):
         self.packet_sequence_number += 1
         return self.packet_sequence_number
@@ -131,58 +240,282 @@ class RxPCommunicator:
         self.listeners[key] = listener
         
     def remove_listener(self, key):
-        del self.listeners[key]
+        self.listeners.pop(key, None)
+        self.peer_stats.pop(key, None)
+    
+    '''Tell the connection to a peer it lost a packet, never called while holding our lock'''
+    def __notify_loss(self, peer, timeout):
+        listener = self.listeners.get(peer)
+        if listener is not None:
+            listener.handle_packet_loss(timeout)
+    
+    '''
+    Packets sent by this thread inside the with block go out together when it ends,
+    batches nest and only the outermost one sends.
+    Without kernel batching holding them back saves no system calls, so they go out as they are sent
+    '''
+    @contextmanager
+    def batch(self):
+        if not self.io.batching:
+            yield
+            return
+        outermost = getattr(self.batches, 'pending', None) is None
+        if outermost:
+            self.batches.pending = []
+        try:
+            yield
+        finally:
+            if outermost:
+                pending, self.batches.pending = self.batches.pending, None
+                if pending:
+                    self.io.send(pending)
+    
+    '''Wait for datagrams and return the packets of all that arrived, corrupt and malformed ones are dropped'''
+    def receive_packets(self):
+        packets = []
+        datagrams = self.io.receive()
+        if self.closed:
+            # the read was woken up by the socket shutting down
+            return packets
+        for data, addr in datagrams:
+            packet = self.__process_datagram(data, addr)
+            if packet is not None:
+                packets.append(packet)
+        return packets
     
     def receive_packet(self):
         data,addr = self.sock.recvfrom(self.BUFFER_SIZE)
-        packet = RxPacket.deserialize(data)
-        self.logger.debug("Received packet: %s" % str(packet))
+        return self.__process_datagram(data, addr)
+    
+    def __process_datagram(self, data, addr):
+        peer = (addr[0], addr[1]) if isinstance(addr, tuple) else None
+        self.__count(peer, 'packets_received')
+        self.__count(peer, 'bytes_received', len(data))
+        try:
+            packet = RxPacket.deserialize(data)
+        except RxPacketFormatException as e:
+            self.logger.error("Malformed Packet Detected, dropping packet: %s", e)
+            self.__count(peer, 'malformed_drops')
+            return None
+        # IPs are not carried on the wire, the reply goes back to whoever sent the datagram
+        if peer is not None:
+            packet.sourceip, packet.sourceport = peer
+        if self.trace is not None:
+            self.trace.record(RxPPacketTrace.RECEIVED, packet)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Received packet: %s", packet)
         '''Check if we have a non corrupt packet'''
-        if packet.checksum != RxPacket.calculate_checksum(packet):
+        if not RxPacket.verify_checksum(data, packet, self.checksum_for(packet.sourceip, packet.sourceport, packet)):
             self.logger.error("Corrupt Packet Detected, dropping packet %s", packet)
+            self.__count(peer, 'corrupt_drops')
+            PACKET_POOL.release(packet)
             return None
         
-        # if packet contains an ACK, remove a waiting to be ACK'ed packet from the unacked list
-        if RxPFlags.ACK in packet.flags:
-            self.logger.debug("Waiting To be acked going to remove %s, these are the current keys: %s" % (packet.ack, self.waiting_to_be_acked.keys()))
-            del self.waiting_to_be_acked[packet.ack]
+        # the SYN/ACK tells us which checksum the server picked from the ones we offered
+        if (packet.flags & (RxPFlags.SYN | RxPFlags.ACK)) == RxPFlags.SYN | RxPFlags.ACK:
+            chosen = RxPacket.unpack_options(packet.data).get(RxPOption.CHECKSUM, b'')
+            if chosen and chosen[0] in {checksum.ID for checksum in self.checksums}:
+                self.peer_checksums[(packet.sourceip, packet.sourceport)] = get_checksum(chosen[0])
+        
+        # if packet contains an ACK, remove the ACK'ed packets from the unacked list
+        if packet.flags & RxPFlags.ACK:
+            sack_blocks = [] if packet.flags & RxPFlags.SYN else RxPacket.unpack_sack(packet.data)
+            self.__remove_acked(packet.sourceip, packet.sourceport, packet.ack, sack_blocks, packet.window)
         
         return packet
     
+    '''
+    Remove the packets a cumulative ACK and its SACK blocks acknowledge from the unacked list,
+    measure the round trip time and detect losses from duplicate ACKs
+    '''
+    def __remove_acked(self, ip, port, ack, sack_blocks, window=0):
+        peer = (ip, port)
+        loss_detected = False
+        with self.lock:
+            waiting = self.waiting_to_be_acked.get(peer)
+            if not waiting:
+                return
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Waiting To be acked going to remove up to %s and %s, these are the current keys: %s", ack, sack_blocks, list(waiting))
+            # packets are kept in the order they were sent so the cumulative part stops at the first newer one
+            acked_packet = None
+            for sequence in list(waiting):
+                if sequence > ack:
+                    break
+                if acked_packet is not None:
+                    PACKET_POOL.release(acked_packet)
+                acked_packet = waiting.pop(sequence)
+            for sequence in RxPacket.sacked(waiting, sack_blocks):
+                PACKET_POOL.release(waiting.pop(sequence))
+            last_ack, last_window, duplicates = self.duplicate_acks.get(peer, (None, None, 0))
+            if acked_packet is not None:
+                # Karn's rule, a retransmitted packet's ACK could be for any of its transmissions
+                if acked_packet.sequence == ack and acked_packet.transmissions == 1:
+                    self.get_rtt_estimator(ip, port).sample(time.monotonic() - acked_packet.sent_time)
+                    self.__count(peer, 'rtt_samples')
+                PACKET_POOL.release(acked_packet)
+                self.duplicate_acks[peer] = (ack, window, 0)
+                recovery_point = self.recovery_points.get(peer)
+                if recovery_point is not None and ack < recovery_point and waiting:
+                    # partial ACK, the next hole was lost in the same window
+                    self.__retransmit(waiting[next(iter(waiting))], "partial ACK")
+                elif recovery_point is not None:
+                    del self.recovery_points[peer]
+                # the oldest outstanding packet gets a fresh timer
+                self.__arm_retransmit_timer(peer, restart=True)
+            elif ack == last_ack and window == last_window and waiting:
+                # an ACK changing the window is a window update, not a sign of loss
+                duplicates += 1
+                self.duplicate_acks[peer] = (ack, window, duplicates)
+                self.__count(peer, 'duplicate_acks')
+                if duplicates == self.DUPLICATE_ACK_THRESHOLD and peer not in self.recovery_points:
+                    self.recovery_points[peer] = next(reversed(waiting))
+                    self.__count(peer, 'fast_retransmits')
+                    self.__retransmit(waiting[next(iter(waiting))], "fast retransmit")
+                    loss_detected = True
+            else:
+                self.duplicate_acks[peer] = (ack, window, 0)
+            if not waiting:
+                self.__forget_waiting(peer)
+        if loss_detected:
+            self.__notify_loss(peer, False)
+    
+    '''Check whether a packet sent to a peer is still waiting to be acked'''
+    def is_waiting_for_ack(self, ip, port, sequence):
+        return sequence in self.waiting_to_be_acked.get((ip, port), {})
+    
+    '''The round trip time estimate for a peer'''
+    def get_rtt_estimator(self, ip, port):
+        with self.lock:
+            return self.rtt_estimators.setdefault((ip, port), RxPRTTEstimator())
+    
     '''Send packet to destination'''
     def send_packet(self, packet):
-        packet.checksum = RxPacket.calculate_checksum(packet)
-        self.logger.debug("Sending packet to %s at port %s: " % (packet.destinationip, packet.destport))
+        checksum = self.checksum_for(packet.destinationip, packet.destport, packet)
+        if self.trace is not None:
+            self.trace.record(RxPPacketTrace.SENT, packet)
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Sending packet to %s at port %s: %s", packet.destinationip, packet.destport, packet)
         # set the packet send time
-        packet.sent_time = time.time()
+        packet.sent_time = time.monotonic()
+        packet.transmissions += 1
         # if the packet needs to be acked then it has to be added to the waiting to be acked list
-        if any(flag in [RxPFlags.SYN, RxPFlags.FIN, RxPFlags.DATA] for flag in packet.flags):
-            self.waiting_to_be_acked[packet.sequence] = packet
-            # if the RETRY Thread is not running, kick it off
-            if not self.RETRY_THREAD:
-                t = Timer(self.RETRY_DELAY, self.resend_unacked_packets)
-                t.setDaemon(True)
-                t.start()
-                self.RETRY_THREAD = True
-        # Send packet over UDP
-        self.sock.sendto(RxPacket.serialize(packet), (packet.destinationip, packet.destport))
-        self.logger.debug("Sent Packet, returning to calling function")
-    
-    # Check every time period to see if there are unacked packets to be sent
-    def resend_unacked_packets(self):
-        if self.waiting_to_be_acked:
-            self.logger.debug("This is how many packets are waiting for acks: %s" % len(self.waiting_to_be_acked.keys()))
-            # loop through the unacked packets and resend them
-            for unacked_packet in self.waiting_to_be_acked:
-                self.logger.debug("This is the sequence of the current unacked packet %s" % unacked_packet)
-                elapsed_time = time.time() - self.waiting_to_be_acked[unacked_packet].sent_time 
-                if elapsed_time > self.RETRY_DELAY:
-                    self.send_packet(self.waiting_to_be_acked[unacked_packet])
-            # tell the retry thread to try again after delay, we have to keep retrying till the acked packets are done
-            t = Timer(self.RETRY_DELAY, self.resend_unacked_packets)
-            t.setDaemon(True)
-            t.start()
-            self.RETRY_THREAD = True
+        if packet.flags & (RxPFlags.SYN | RxPFlags.FIN | RxPFlags.DATA):
+            peer = (packet.destinationip, packet.destport)
+            with self.lock:
+                self.waiting_to_be_acked.setdefault(peer, {})[packet.sequence] = packet
+                self.__arm_retransmit_timer(peer)
+        # Send packet over UDP, the data goes out straight from the sender's buffer
+        buffers = [RxPacket.serialize_header(packet, checksum)]
+        if packet.data:
+            buffers.append(packet.data)
+        peer = (packet.destinationip, packet.destport)
+        self.__count(peer, 'packets_sent')
+        self.__count(peer, 'bytes_sent', RxPacket.header_size(packet) + len(packet.data or b''))
+        pending = getattr(self.batches, 'pending', None)
+        if pending is not None:
+            pending.append((buffers, (packet.destinationip, packet.destport)))
         else:
-            self.logger.debug("There are no packets waiting to be acked, killing RETRY THREAD")
-            self.RETRY_THREAD = False
\ No newline at end of file
+            self.io.send([(buffers, (packet.destinationip, packet.destport))])
+    
+    '''Send a packet that is waiting to be acked again'''
+    def __retransmit(self, packet, reason):
+        self.logger.debug("Retransmitting packet %s (%s)", packet.sequence, reason)
+        self.__count((packet.destinationip, packet.destport), 'retransmits')
+        self.send_packet(packet)
+    
+    '''
+    Each peer has one retransmission timer covering its oldest unacked packet,
+    restart re-arms it from now when an ACK made progress
+    '''
+    def __arm_retransmit_timer(self, peer, restart=False):
+        timer = self.retransmit_timers.get(peer)
+        if timer is not None and not restart:
+            return
+        if timer is not None:
+            timer.cancel()
+        if self.waiting_to_be_acked.get(peer):
+            self.retransmit_timers[peer] = self.timers.schedule(self.get_rtt_estimator(*peer).rto, self.__handle_retransmit_timeout, peer)
+        else:
+            self.retransmit_timers.pop(peer, None)
+    
+    '''The oldest packet to a peer was not acked in time, resend it and back off the timer'''
+    def __handle_retransmit_timeout(self, peer):
+        with self.lock:
+            self.retransmit_timers.pop(peer, None)
+            waiting = self.waiting_to_be_acked.get(peer)
+            if not waiting:
+                return
+            estimator = self.get_rtt_estimator(*peer)
+            estimator.backoff()
+            self.logger.debug("Retransmit timeout for %s:%s, %s", peer[0], peer[1], estimator)
+            # anything still outstanding is treated as lost, partial ACKs walk through the holes
+            self.recovery_points[peer] = next(reversed(waiting))
+            self.__count(peer, 'retransmit_timeouts')
+            self.__retransmit(waiting[next(iter(waiting))], "timeout")
+            self.__arm_retransmit_timer(peer)
+        self.__notify_loss(peer, True)
+    
+    '''Count for the socket, and for the peer when it has a connection'''
+    def __count(self, peer, name, amount=1):
+        self.stats.add(name, amount)
+        if peer in self.listeners:
+            stats = self.peer_stats.get(peer)
+            if stats is None:
+                stats = self.peer_stats.setdefault(peer, RxPStats(SOCKET_COUNTERS))
+            stats.add(name, amount)
+    
+    '''
+    Stop the retransmission timers and wake up a read waiting on the socket, the socket itself
+    is closed by whoever made it
+    '''
+    def close(self):
+        self.closed = True
+        self.timers.close()
+        with self.lock:
+            self.waiting_to_be_acked.clear()
+            self.recovery_points.clear()
+            self.retransmit_timers.clear()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # an unconnected UDP socket says so, the waiting read is woken up all the same
+            pass
+
+    '''Counters of the socket and gauges of its state, a snapshot like TCP_INFO'''
+    def info(self):
+        info = self.stats.snapshot()
+        with self.lock:
+            info['peers'] = len(self.listeners)
+            info['waiting_to_be_acked'] = sum(len(waiting) for waiting in self.waiting_to_be_acked.values())
+        return info
+    
+    '''Counters of the traffic with one peer and its round trip time estimate'''
+    def peer_info(self, ip, port):
+        stats = self.peer_stats.get((ip, port))
+        info = stats.snapshot() if stats is not None else RxPStats(SOCKET_COUNTERS).snapshot()
+        estimator = self.rtt_estimators.get((ip, port))
+        if estimator is not None:
+            info['srtt'] = estimator.srtt
+            info['rttvar'] = estimator.rttvar
+            info['rto'] = estimator.rto
+        with self.lock:
+            info['waiting_to_be_acked'] = len(self.waiting_to_be_acked.get((ip, port), {}))
+        return info
+    
+    '''Drop everything kept about a peer without a connection, like a handshake that never completed'''
+    def forget_peer(self, ip, port):
+        peer = (ip, port)
+        with self.lock:
+            self.__forget_waiting(peer)
+            self.duplicate_acks.pop(peer, None)
+            self.rtt_estimators.pop(peer, None)
+        self.peer_checksums.pop(peer, None)
+        self.peer_stats.pop(peer, None)
+    
+    def __forget_waiting(self, peer):
+        self.waiting_to_be_acked.pop(peer, None)
+        self.recovery_points.pop(peer, None)
+        timer = self.retransmit_timers.pop(peer, None)
+        if timer is not None:
+            timer.cancel()
@@ -0,0 +1,141 @@
+import time
+
+'''
+Congestion control decides how many packets a connection may have in flight (cwnd).
+The connection tells it about ACKs, the communicator about losses.
+Windows are counted in packets
+'''
+class RxPCongestionControl:
+    NAME = None
+    # RFC 6928 initial window
+    INITIAL_WINDOW = 10
+    MINIMUM_WINDOW = 1
+
+    def __init__(self, initial_window=None):
+        self.cwnd = float(initial_window or self.INITIAL_WINDOW)
+        # slow start threshold, slow start until the first loss
+        self.ssthresh = float('inf')
+
+    """The number of packets that may be in flight"""
+    def window(self):
+        return max(self.MINIMUM_WINDOW, int(self.cwnd))
+
+    def in_slow_start(self):
+        return self.cwnd < self.ssthresh
+
+    """acked packets were newly acknowledged, srtt is the smoothed round trip time if known"""
+    def on_ack(self, acked, srtt=None, now=None):
+        raise NotImplementedError()
+
+    """A loss was detected from duplicate ACKs"""
+    def on_loss(self, now=None):
+        raise NotImplementedError()
+
+    """Start from the window an earlier connection to the same peer reached, without slow start"""
+    def resume(self, cwnd, ssthresh):
+        self.cwnd = max(float(self.INITIAL_WINDOW), float(cwnd))
+        self.ssthresh = min(float(ssthresh), self.cwnd)
+
+    """The retransmission timer expired, start over from one packet"""
+    def on_timeout(self, now=None):
+        self.on_loss(now)
+        self.cwnd = float(self.MINIMUM_WINDOW)
+
+    def __str__(self):
+        return "%s cwnd: %.2f, ssthresh: %s" % (self.NAME, self.cwnd, self.ssthresh)
+
+
+"""Reno: slow start, additive increase by one packet per round trip, halve on loss"""
+class RxPRenoCongestionControl(RxPCongestionControl):
+    NAME = 'reno'
+
+    def on_ack(self, acked, srtt=None, now=None):
+        for i in range(acked):
+            if self.in_slow_start():
+                self.cwnd += 1
+            else:
+                self.cwnd += 1.0 / self.cwnd
+
+    def on_loss(self, now=None):
+        self.ssthresh = max(self.cwnd / 2, 2.0)
+        self.cwnd = self.ssthresh
+
+
+'''
+CUBIC (RFC 8312): after a loss the window grows along a cubic curve centred on the
+window where the loss happened, so it is independent of the round trip time
+'''
+class RxPCubicCongestionControl(RxPCongestionControl):
+    NAME = 'cubic'
+    C = 0.4
+    BETA = 0.7
+
+    def __init__(self, initial_window=None):
+        super().__init__(initial_window)
+        # window before the last reduction
+        self.w_max = 0.0
+        # start of the current congestion avoidance epoch
+        self.epoch_start = None
+        self.k = 0.0
+        self.origin = 0.0
+        # window of an equivalent Reno flow, CUBIC is never slower than it
+        self.w_est = 0.0
+
+    def on_ack(self, acked, srtt=None, now=None):
+        now = time.monotonic() if now is None else now
+        for i in range(acked):
+            if self.in_slow_start():
+                self.cwnd += 1
+                continue
+            if self.epoch_start is None:
+                self.epoch_start = now
+                if self.cwnd < self.w_max:
+                    self.k = ((self.w_max - self.cwnd) / self.C) ** (1.0 / 3)
+                    self.origin = self.w_max
+                else:
+                    self.k = 0.0
+                    self.origin = self.cwnd
+                self.w_est = self.cwnd
+            t = now - self.epoch_start + (srtt or 0)
+            target = self.origin + self.C * (t - self.k) ** 3
+            if target > self.cwnd:
+                self.cwnd += (target - self.cwnd) / self.cwnd
+            else:
+                self.cwnd += 0.01 / self.cwnd
+            # TCP friendly region
+            self.w_est += 3 * (1 - self.BETA) / (1 + self.BETA) / self.cwnd
+            if self.w_est > self.cwnd:
+                self.cwnd = self.w_est
+
+    def resume(self, cwnd, ssthresh):
+        super().resume(cwnd, ssthresh)
+        # the curve starts flat at the window we resume with
+        self.w_max = self.cwnd
+        self.epoch_start = None
+
+    def on_loss(self, now=None):
+        self.epoch_start = None
+        # fast convergence, give up bandwidth to newer flows
+        if self.cwnd < self.w_max:
+            self.w_max = self.cwnd * (1 + self.BETA) / 2
+        else:
+            self.w_max = self.cwnd
+        self.cwnd = max(self.cwnd * self.BETA, 2.0)
+        self.ssthresh = self.cwnd
+
+
+'''The congestion control algorithms a connection can use, by name'''
+RxPCongestionControls = {
+    RxPRenoCongestionControl.NAME: RxPRenoCongestionControl,
+    RxPCubicCongestionControl.NAME: RxPCubicCongestionControl,
+}
+
+DEFAULT_CONGESTION_CONTROL = RxPCubicCongestionControl.NAME
+
+
+"""Create the congestion control state for a new connection"""
+def get_congestion_control(name=DEFAULT_CONGESTION_CONTROL):
+    try:
+        return RxPCongestionControls[name]()
+    except KeyError:
+        raise ValueError("Unknown congestion control algorithm: %s" % name)
@@ -1,9 +1,20 @@
 from enum import Enum, unique
 import logging
-from packet import RxPacket,RxPFlags
-from threading import Timer, Thread
+import mmap
+import os
+import time
+from packet import RxPacket,RxPFlags,RxPOption,PACKET_POOL
+from threading import Thread, RLock, Condition, Event
 import traceback
 from select import select
+import queue
+from congestion import get_congestion_control, DEFAULT_CONGESTION_CONTROL
+from buffers import RxPRingBuffer
+from collections import deque
+from stats import RxPStats, CONNECTION_COUNTERS
+from logs import get_logger
+from tickets import RxPSession
+from streams import RxPStream
 
 """ Enum representing the different states a connection can be in"""
 @unique
@@ -17,33 +28,35 @@ class RxPConnectionState(Enum):
     LAST_ACK=8
     CLOSED=5
 
+# nothing more arrives in these states, a receive with the buffer empty is at the end of the stream
+RECEIVE_CLOSED_STATES = frozenset([RxPConnectionState.CLOSE_WAIT, RxPConnectionState.CLOSING,
+    RxPConnectionState.LAST_ACK, RxPConnectionState.CLOSED])
+
 class RxPConnectionSendException(Exception):
     def __init__(self, value):
         self.value = value
     def __str__(self):
         return repr(self.value)
 
+"""Raised by receive when no data arrived in time, or at once for a connection that does not block"""
+class RxPConnectionTimeoutException(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
 """Represents an active connection - a virtual circuit"""
 class RxPConnection(Thread):
-    def __init__(self, name, sourceip, sourceport, destinationip, destinationport, sequence, ack, communicator, loglevel=logging.DEBUG, window_size=1):
+    def __init__(self, name, sourceip, sourceport, destinationip, destinationport, sequence, ack, communicator, loglevel=logging.DEBUG, window_size=64, congestion_control=DEFAULT_CONGESTION_CONTROL, dispatcher=None, initiator=False, streams=False):
         # Initialize Super class
         super().__init__()
+        # the connection only lives as long as the socket reader feeding it
+        self.daemon = True
         # set the name of this process
         self.name = name
         # Initialize Logger
-        self.logger = logging.getLogger("RxPConnection: %s" % self.name)
+        self.logger = get_logger("Connection", loglevel, self.name)
         self.loglevel = loglevel
-        # create console handler and set level to debug
-        self.logger.setLevel(loglevel)
-        # create console handler and set level to debug
-        ch = logging.StreamHandler()
-        ch.setLevel(loglevel)
-        # create formatter
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        # add formatter to ch
-        ch.setFormatter(formatter)
-        # add ch to logger
-        self.logger.addHandler(ch)
         # Source IP and port for the connection
         self.sourceip = sourceip
         self.sourceport = sourceport
@@ -52,203 +65,905 @@ class RxPConnection(Thread):
         self.destinationport = destinationport
         
         self.state = RxPConnectionState.INITIATED
-        '''The sequence number to use for the next packet'''
+        '''The sequence number of the last packet we sent'''
         self.last_seq = sequence
-        '''Last Acknowledgement number'''
+        '''Last Acknowledgement number, the last packet received in order from the other side'''
         self.last_ack = ack
-        '''Set Window Size'''
+        # guards the send window and the receive state, packets are handled on several threads
+        self.lock = RLock()
+        # signalled whenever receive has something to return, data or the end of the stream
+        self.receive_ready = Condition(self.lock)
+        # events of the poll calls watching this connection
+        self.pollers = set()
+        # how long receive waits for data, None waits as long as it takes and 0 never waits
+        self.timeout = None
+        '''Sequence number of the first data packet, the send window ring is indexed relative to it'''
+        self.window_base = sequence + 1
+        '''Oldest sequence number sent that has not been acknowledged'''
+        self.send_unacked = sequence + 1
+        '''Set Window Size, the most packets we ever have in flight'''
         self.set_window_size(window_size)
-        self.logger.debug("Initialzied Send Window to Window Size: %s" % self.send_window)
+        '''Congestion window, how many packets the network lets us have in flight'''
+        self.congestion = get_congestion_control(congestion_control)
+        self.logger.debug("Initialzied Send Window to Window Size: %s", self.send_window)
         self.send_window_data = {}
         self.communicator = communicator
+        # packets from the other side, put here by the socket reader
+        self.packet_queue = queue.Queue()
+        # hands our packets to a worker thread shared with other connections, without one run handles them
+        self.dispatcher = dispatcher
+        # counters of what this connection sent and received, see info
+        self.stats = RxPStats(CONNECTION_COUNTERS)
         # Timeouts for the different states during close
         self.CLOSING_TIMEOUT = 10.0
         self.FIN_WAIT_1_TIMEOUT = 10.0
         self.FIN_WAIT_2_TIMEOUT = 10.0
         self.LAST_ACK_TIMEOUT = 10.0
-        #
-        self.send_buffer_size = 8
+        # sequence number of the FIN we sent
+        self.fin_sequence = None
+        # close was called, the FIN goes once everything sent before it was acknowledged
+        self.close_requested = False
+        # largest data a single packet can carry
+        self.MAX_SEGMENT_SIZE = communicator.BUFFER_SIZE - RxPacket.HEADER_SIZE
+        # data is sent in segments of this many bytes
+        self.send_buffer_size = self.MAX_SEGMENT_SIZE
+        '''The buffer being sent and how far into it we are, packets carry views into it rather than copies'''
         self.data_to_be_sent = None
         self.data_to_be_sent_last_pointer = None
-        #
-        self.receive_buffer = bytearray()
+        # buffers passed to send after the one being sent
+        self.send_queue = deque()
+        # received data waiting for the application, bounded so a slow reader pushes back on the sender
+        self.RECEIVE_BUFFER_SIZE = 64 * 1024
+        self.receive_buffer = RxPRingBuffer(self.RECEIVE_BUFFER_SIZE)
+        '''The receive window in packets we last told the other side about'''
+        self.advertised_window = self.__receive_window()
+        '''The receive window the other side last told us about, None until its first ACK'''
+        self.peer_window = None
+        '''The next sequence number we expect from the other side'''
+        self.receive_next = (ack or 0) + 1
+        '''Packets received ahead of receive_next, keyed by sequence, waiting for the gap to fill'''
+        self.out_of_order = {}
+        # most SACK blocks reported in a single ACK
+        self.MAX_SACK_BLOCKS = RxPacket.MAX_SACK_BLOCKS
+        # in order packets are acknowledged together, at most this many per ACK
+        self.ACK_EVERY = 16
+        # or after this delay when no more packets arrive
+        self.DELAYED_ACK_TIMEOUT = 0.05
+        self.unacked_received = 0
+        self.delayed_ack_timer = None
+        # timers of the close states, on the timer queue of the communicator like every other timer
+        self.close_timers = []
+        # a server issues a resumption ticket in its FIN with this RxPTicketIssuer
+        self.tickets = None
+        # a client is handed the ticket in the FIN of the server, on_ticket(connection, ticket)
+        self.on_ticket = None
+        # both sides offered streams in the handshake, without that neither opens any
+        self.streams_enabled = streams
+        # streams opened in the connection by either side keyed by id, the connection's own is 0
+        self.streams = {}
+        # the side that connected opens odd streams, the side that accepted even ones
+        self.next_stream_id = 1 if initiator else 2
+        # the highest stream the other side opened
+        self.peer_stream_id = 0
+        # most streams the other side may have open at once, each holds a receive buffer
+        self.MAX_STREAMS = 100
+        # streams the other side opened that accept_stream has not returned yet
+        self.accepted_streams = deque()
+        # streams with data waiting to go out, they take turns with the connection's own data
+        self.sending = deque()
+        self.streams_turn = False
+        # the stream whose receive window the next ACK carries
+        self.ack_stream = None
+        # largest data a packet of a stream can carry, its header is longer
+        self.MAX_STREAM_SEGMENT_SIZE = communicator.BUFFER_SIZE - RxPacket.STREAM_HEADER_SIZE
         
+    """Set the connection to an established state, enough on its own when a dispatcher handles our packets"""
+    def establish(self):
+        self.logger.debug("Established Connection: %s", self.name)
+        self.state = RxPConnectionState.ESTABLISHED
+    
     """
-    This method is called to set the connection to an established state
-    and to start off the connection in a separate process
+    Without a dispatcher the connection runs in a separate thread
+    handling the packets from the other side in the order they arrived
     """
     def run(self):
-        self.logger.debug("Started Connection Process: %s" % self.name)
-        self.state = (RxPConnectionState.ESTABLISHED)
+        self.establish()
         while self.state is not RxPConnectionState.CLOSED and self.communicator is not None:
-            self.logger.debug("Running Connection")
-            packet = self.communicator.receive_packet()
-            self.logger.debug("Run Method received packet %s, handing off to packet handler thread" % packet)
-            t = Thread(target=self.__handle_incoming_packets, args=(packet,))
-            t.setDaemon(True)
-            t.start()
-        self.logger.info("Ended Connection Run: %s" % self.name)
-    
-    
-    def __handle_incoming_packets(self, packet):
-        self.logger.debug("Handling incoming packet: %s" % packet)
-        # If it is an ACK packet then remove the acknowledged packet from the send window
-        if RxPFlags.ACK in packet.flags:
+            packet = self.packet_queue.get()
+            if packet is None:
+                continue
+            self.handle_packet(packet)
+        self.logger.info("Ended Connection Run: %s", self.name)
+    
+    
+    """Called from the socket reader with a packet from the other side"""
+    def deliver_packet(self, packet):
+        if self.dispatcher is not None:
+            self.dispatcher.submit(self, packet)
+        else:
+            self.packet_queue.put(packet)
+    
+    """
+    Handle one packet from the other side, packets of a connection are never handled concurrently
+    The packet goes back to the pool afterwards unless it is held out of order
+    """
+    def handle_packet(self, packet):
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("Handling incoming packet: %s", packet)
+        if packet is None or self.state is RxPConnectionState.CLOSED:
+            return
+        # If it is an ACK packet then remove the acknowledged packets from the send window
+        if packet.flags & RxPFlags.ACK:
             self.__handle_ack_packet(packet)
-        elif RxPFlags.FIN in packet.flags:
-            self.__handle_fin_received(packet)
-        elif RxPFlags.DATA in packet.flags:
-            self.logger.debug("Received DATA in connection %s" % packet.sequence)
+        elif packet.flags & (RxPFlags.FIN | RxPFlags.DATA):
+            self.__handle_sequenced_packet(packet)
+            if self.out_of_order.get(packet.sequence) is packet:
+                return
+        PACKET_POOL.release(packet)
+    
+    """
+    DATA and FIN packets are delivered in sequence order
+    packets ahead of a gap wait in the out of order buffer and are reported back with SACK blocks.
+    The data of an opened stream goes to its stream straight away, only its sequence number waits
+    """
+    def __handle_sequenced_packet(self, packet):
+        with self.lock:
+            if self.receive_buffer is None or self.state is RxPConnectionState.CLOSED:
+                return
+            if packet.stream and not self.streams_enabled:
+                # never offered, a peer sending them anyway gets no ACK for them
+                self.logger.debug("Refusing packet %s of stream %s, streams were not negotiated", packet.sequence, packet.stream)
+                return
+            if packet.stream:
+                self.ack_stream = self.streams.get(packet.stream)
+            if packet.sequence < self.receive_next or (packet.stream and packet.sequence in self.out_of_order):
+                self.logger.debug("Received duplicate packet %s", packet.sequence)
+                self.stats.add('duplicates_received')
+                self.__send_ack()
+            elif packet.stream and not self.__take_stream_data(packet):
+                # no room in the stream, the sender finds out from the stream's window in the ACK
+                self.logger.debug("Stream %s full, dropping packet %s", packet.stream, packet.sequence)
+                self.stats.add('receive_buffer_drops')
+                self.__send_ack()
+            elif packet.sequence > self.receive_next:
+                self.logger.debug("Received packet %s out of order, expecting %s", packet.sequence, self.receive_next)
+                self.stats.add('out_of_order_received')
+                if packet.stream:
+                    # its stream has the data already
+                    self.out_of_order[packet.sequence] = None
+                # only packets inside the window we advertised are sure to fit once the gap fills
+                elif packet.sequence < self.receive_next + self.__receive_window():
+                    if packet.data is not None:
+                        # the data is a view into the receive buffer of the communicator, keep our own copy
+                        packet.data = bytes(packet.data)
+                    self.out_of_order[packet.sequence] = packet
+                self.__send_ack()
+            elif not packet.stream and packet.data is not None and len(packet.data) > self.receive_buffer.free():
+                # no room, the sender finds out from the window in the ACK and probes again later
+                self.logger.debug("Receive buffer full, dropping packet %s", packet.sequence)
+                self.stats.add('receive_buffer_drops')
+                self.__send_ack()
+            else:
+                filled_gap = len(self.out_of_order) > 0
+                push = packet.flags & RxPFlags.PSH
+                self.__deliver(packet)
+                while self.receive_next in self.out_of_order:
+                    next_packet = self.out_of_order.pop(self.receive_next)
+                    if next_packet is None:
+                        # a packet of a stream, the stream took it when it arrived
+                        self.last_ack = self.receive_next
+                        self.receive_next += 1
+                        continue
+                    push = push or next_packet.flags & RxPFlags.PSH
+                    self.__deliver(next_packet)
+                    PACKET_POOL.release(next_packet)
+                self.__notify_readable()
+                if self.state is RxPConnectionState.CLOSED:
+                    return
+                self.unacked_received += 1
+                if filled_gap or push or self.unacked_received >= self.ACK_EVERY:
+                    self.__send_ack()
+                else:
+                    self.__schedule_delayed_ack()
+    
+    """Hand an in order packet to the application or the close logic"""
+    def __deliver(self, packet):
+        self.receive_next = packet.sequence + 1
+        self.last_ack = packet.sequence
+        if packet.stream:
+            # taken by its stream when it arrived
+            return
+        if packet.flags & RxPFlags.DATA:
             # append received 
-            self.receive_buffer.extend(packet.data)
-            self.logger.debug("Receive Buffer Size : %s" % len(self.receive_buffer))
-            # send ACKnowledgement
-            self.communicator.sendACK(self.sourceport, self.sourceip, packet)
+            self.receive_buffer.write(packet.data)
+            self.stats.add('data_packets_received')
+            self.stats.add('data_bytes_received', len(packet.data))
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Received DATA %s, Receive Buffer Size : %s", packet.sequence, len(self.receive_buffer))
+        elif packet.flags & RxPFlags.FIN:
+            self.__handle_fin_received(packet)
+    
+    """
+    Acknowledge everything received in order so far, and what is held out of order
+    The ACK carries the receive window of the stream the last packet was for
+    """
+    def __send_ack(self):
+        with self.lock:
+            self.unacked_received = 0
+            if self.delayed_ack_timer is not None:
+                self.delayed_ack_timer.cancel()
+                self.delayed_ack_timer = None
+            if self.communicator is None:
+                return
+            self.advertised_window = self.__receive_window()
+            self.stats.add('acks_sent')
+            stream, self.ack_stream = self.ack_stream, None
+            if stream is None:
+                self.communicator.sendSACK(self.sourceip, self.sourceport, self.destinationip, self.destinationport, self.receive_next - 1, self.__sack_blocks(), self.advertised_window)
+                return
+            stream.advertised_limit = stream.receive_limit()
+            self.communicator.sendSACK(self.sourceip, self.sourceport, self.destinationip, self.destinationport, self.receive_next - 1, self.__sack_blocks(), self.advertised_window,
+                stream.id, stream.advertised_limit)
+    
+    """Packets after receive_next that are sure to fit in the receive buffer"""
+    def __receive_window(self):
+        if self.receive_buffer is None:
+            return 0
+        return min(0xFFFF, self.receive_buffer.free() // self.MAX_SEGMENT_SIZE)
+    
+    def __schedule_delayed_ack(self):
+        if self.delayed_ack_timer is None and self.communicator is not None:
+            self.delayed_ack_timer = self.communicator.timers.schedule(self.DELAYED_ACK_TIMEOUT, self.__send_ack)
     
+    """Ranges of sequence numbers held out of order, lowest first"""
+    def __sack_blocks(self):
+        blocks = []
+        for sequence in sorted(self.out_of_order):
+            if blocks and blocks[-1][1] == sequence - 1:
+                blocks[-1][1] = sequence
+            elif len(blocks) < self.MAX_SACK_BLOCKS:
+                blocks.append([sequence, sequence])
+            else:
+                break
+        return [tuple(block) for block in blocks]
 
     def __handle_ack_packet(self, packet):
-        if self.state == RxPConnectionState.ESTABLISHED:
-            self.__remove_acked_from_send_window(packet.ack)
-        elif self.state == RxPConnectionState.FIN_WAIT_1:
-            self.state == RxPConnectionState.FIN_WAIT_2
-            t = Timer(self.FIN_WAIT_2_TIMEOUT, self.__handle_close_timeouts, [self.state])
-            t.start()
-        elif self.state == RxPConnectionState.CLOSING:
+        if self.send_window is not None and not packet.flags & RxPFlags.SYN:
+            self.peer_window = packet.window
+            if packet.stream:
+                self.__update_peer_limit(packet.stream, packet.offset)
+            self.__remove_acked_from_send_window(packet.ack, RxPacket.unpack_sack(packet.data))
+        fin_acked = self.fin_sequence is not None and packet.ack >= self.fin_sequence
+        if self.state == RxPConnectionState.FIN_WAIT_1 and fin_acked:
+            self.state = RxPConnectionState.FIN_WAIT_2
+            self.__schedule_close_timeout(self.FIN_WAIT_2_TIMEOUT, self.state)
+        elif self.state in (RxPConnectionState.CLOSING, RxPConnectionState.LAST_ACK) and fin_acked:
             self.destroy()
             
 
     def __handle_fin_received(self, packet):
         self.logger.debug("Recieved FIN")
+        if self.on_ticket is not None and packet.data:
+            ticket = RxPacket.unpack_options(packet.data).get(RxPOption.TICKET)
+            if ticket:
+                self.on_ticket(self, bytes(ticket))
         # Check if we are in the Active close flow in FIN_WAIT_1
         if self.state == RxPConnectionState.FIN_WAIT_1:
-            self.communicator.sendACK(self.sourceport, self.sourceip, packet)
-            self.state == RxPConnectionState.CLOSING
-            t = Timer(self.CLOSING_TIMEOUT, self.__handle_close_timeouts, [self.state])
-            t.start()
+            self.__send_ack()
+            self.state = RxPConnectionState.CLOSING
+            self.__schedule_close_timeout(self.CLOSING_TIMEOUT, self.state)
         elif self.state == RxPConnectionState.FIN_WAIT_2:
-            self.communicator.sendACK(self.sourceport, self.sourceip, packet)
-            self.state == RxPConnectionState.CLOSED
+            self.__send_ack()
+            self.state = RxPConnectionState.CLOSED
             self.destroy()
         elif self.state == RxPConnectionState.ESTABLISHED:
-            self.communicator.sendACK(self.sourceport, self.sourceip, packet)
+            self.__send_ack()
             # we are going to the passive close flow
             self.state = RxPConnectionState.CLOSE_WAIT
             self.close()
 
     """
-    Read data from the connection buffer
-    """            
-    def receive(self, buffer_size):
-        data_to_return = None
-        while data_to_return is None and self.state is RxPConnectionState.ESTABLISHED:
-            if len(self.receive_buffer) > 0:
-                self.logger.debug("Should be sending back to user data: %s" % self.receive_buffer)
-                data_to_return = self.receive_buffer[0:buffer_size]
-                if len(self.receive_buffer) > buffer_size:
-                    self.receive_buffer = self.receive_buffer[buffer_size:]
-                else:
-                    self.receive_buffer = bytearray()
+    Hand the data of a stream packet to its stream whatever its place in the connection,
+    False when it does not fit in the stream's window
+    """
+    def __take_stream_data(self, packet):
+        stream = self.__receiving_stream(packet.stream)
+        if stream is None:
+            # copies of packets of closed streams were taken before, a stream too many has to wait
+            return packet.stream <= self.peer_stream_id or packet.stream % 2 == self.next_stream_id % 2
+        self.ack_stream = stream
+        if not stream.take(packet.offset, packet.data, packet.flags & RxPFlags.FIN):
+            return False
+        if packet.data is not None:
+            self.stats.add('data_packets_received')
+            self.stats.add('data_bytes_received', len(packet.data))
+        if stream.receive_finished():
+            self.__retire_stream(stream)
+        self.__notify_readable()
+        return True
+
+    """
+    The stream a packet of the other side is for, None for a stream that is closed already or
+    one more than MAX_STREAMS. Streams the other side opens are made in the order of their ids,
+    so a packet that overtook the first packet of an earlier stream does not skip that one
+    """
+    def __receiving_stream(self, stream_id):
+        stream = self.streams.get(stream_id)
+        if stream is not None or stream_id % 2 == self.next_stream_id % 2 or stream_id <= self.peer_stream_id:
+            return stream
+        first = self.peer_stream_id + 2 if self.peer_stream_id else 1 + self.next_stream_id % 2
+        opened = sum(1 for open_id in self.streams if open_id % 2 != self.next_stream_id % 2)
+        if opened + (stream_id - first) // 2 + 1 > self.MAX_STREAMS:
+            self.logger.debug("Too many streams open, not opening stream %s", stream_id)
+            return None
+        for new_id in range(first, stream_id + 1, 2):
+            stream = RxPStream(self, new_id)
+            self.streams[new_id] = stream
+            self.accepted_streams.append(stream)
+            self.logger.debug("Other side opened stream %s", new_id)
+        self.peer_stream_id = stream_id
+        return stream
+
+    """The other side takes data of a stream up to limit now"""
+    def __update_peer_limit(self, stream_id, limit):
+        with self.lock:
+            stream = self.streams.get(stream_id)
+            if stream is not None and limit > stream.peer_limit:
+                stream.peer_limit = limit
+                stream.probes = 0
+
+    """Forget a stream once both sides finished sending on it, later packets of it are old copies"""
+    def __retire_stream(self, stream):
+        if stream.fin_sent and stream.receive_finished():
+            self.streams.pop(stream.id, None)
+            if stream.probe_timer is not None:
+                stream.probe_timer.cancel()
+                stream.probe_timer = None
+
+    """
+    Open a stream in the connection, see RxPStream
+    The other side learns of it from the first packet sent on it
+    """
+    def open_stream(self):
+        with self.lock:
+            self.__check_sending()
+            if not self.streams_enabled:
+                raise RxPConnectionSendException("The other side does not take streams")
+            if self.next_stream_id > 0xFFFF:
+                raise RxPConnectionSendException("No stream ids left")
+            stream = RxPStream(self, self.next_stream_id)
+            self.streams[stream.id] = stream
+            self.next_stream_id += 2
+            return stream
+
+    """
+    Wait for the next stream the other side opens, None once it closed the connection
+    Raises RxPConnectionTimeoutException like receive
+    """
+    def accept_stream(self, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        with self.lock:
+            if not self.receive_ready.wait_for(lambda: self.accepted_streams or self.state in RECEIVE_CLOSED_STATES, timeout):
+                raise RxPConnectionTimeoutException("No stream opened within %s seconds" % timeout)
+            return self.accepted_streams.popleft() if self.accepted_streams else None
+
+    """Wake receive and poll, called with the lock held whenever readable may have become true"""
+    def __notify_readable(self):
+        self.receive_ready.notify_all()
+        for poller in self.pollers:
+            poller.set()
+
+    """True when receive returns without waiting, with data or at the end of the stream"""
+    def readable(self, stream=None):
+        with self.lock:
+            if stream is not None:
+                return len(stream.receive_buffer) > 0 or stream.receive_finished() or self.state in RECEIVE_CLOSED_STATES
+            return (self.receive_buffer is not None and len(self.receive_buffer) > 0) or self.state in RECEIVE_CLOSED_STATES
+
+    """How long receive waits for data, like socket.settimeout None blocks and 0 makes it non blocking"""
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def setblocking(self, blocking):
+        self.timeout = None if blocking else 0.0
+
+    """
+    Read up to buffer_size bytes from the connection buffer, waiting until some arrive
+    Returns None at the end of the stream, once the other side closed and everything it sent was read
+    Raises RxPConnectionTimeoutException when nothing arrives within timeout seconds, or the
+    timeout of the connection when none is given. A waiting reader sleeps until a packet wakes it.
+    With a stream it reads from that stream instead of the connection's own
+    """
+    def receive(self, buffer_size, timeout=None, stream=None):
+        if timeout is None:
+            timeout = self.timeout
+        with self.lock:
+            if not self.receive_ready.wait_for(lambda: self.readable(stream), timeout):
+                raise RxPConnectionTimeoutException("No data received within %s seconds" % timeout)
+            if stream is not None:
+                return self.__receive_stream(stream, buffer_size)
+            if self.receive_buffer is None or len(self.receive_buffer) == 0:
+                return None
+            data_to_return = self.receive_buffer.read(buffer_size)
+            self.logger.debug("Returning %s bytes to the user", len(data_to_return))
+            self.__send_window_update()
         return data_to_return
     
-    """Send data to the other side"""
+    """Read from a stream, telling the other side once reading opened a quarter of its window"""
+    def __receive_stream(self, stream, buffer_size):
+        if len(stream.receive_buffer) == 0:
+            return None
+        data = stream.receive_buffer.read(buffer_size)
+        if stream.receive_limit() - stream.advertised_limit >= stream.WINDOW // 4 and not stream.receive_finished():
+            self.logger.debug("Window update for %s", stream)
+            self.ack_stream = stream
+            self.__send_ack()
+        return data
+
+    """Tell the other side when reading reopened a window that was closed or nearly so"""
+    def __send_window_update(self):
+        window = self.__receive_window()
+        maximum = self.RECEIVE_BUFFER_SIZE // self.MAX_SEGMENT_SIZE
+        if (self.advertised_window == 0 and window > 0) or window - self.advertised_window >= max(1, maximum // 4):
+            self.logger.debug("Window update from %s to %s", self.advertised_window, window)
+            self.__send_ack()
+    
+    """
+    Send data to the other side
+    data can be any buffer, bytes, a bytearray, a memoryview or an mmap of a file. It is not copied,
+    packets reference it until they are acknowledged so it must not change before then
+    """
     def send(self, command, data=None):
-        try:
-            if self.state is not RxPConnectionState.ESTABLISHED:
-                raise RxPConnectionSendException("Connection state is not established it is: %s" % self.state)
-            command_bytes = bytearray(command+"|SEPARATOR|", 'utf-8')
-            self.data_to_be_sent = command_bytes
-            self.data_to_be_sent_last_pointer = 0
-            # append data to command if not null
-            self.logger.debug("File Data: "+str(data))
-            if data:
-                self.data_to_be_sent.extend(data)
-            self.__fill_send_window()
-        except RxPConnectionSendException as e: 
-            self.logger.error("Connection Send exception: %s" % e)
-            
-        
-    """Remove ack'ed packets from send window"""    
-    def __remove_acked_from_send_window(self, sequence):
-        self.logger.debug("Removing ACK'ed from Send window: %s " % self.send_window)
-        for index, packet_sequence in enumerate(self.send_window):
-            if packet_sequence == sequence:
-                self.logger.debug("Removing from Send Window Packet with Sequence: %s" % packet_sequence)
-                self.send_window[index] = None
-        # fill the window with additional packets
+        self.write((command+"|SEPARATOR|").encode('utf-8'), data)
+
+    """
+    Send buffers to the other side one after the other as a byte stream, with nothing added
+    Like send the buffers are not copied and must not change until they are acknowledged.
+    With a stream they go on that stream. Raises RxPConnectionSendException once the connection
+    is closing or closed
+    """
+    def write(self, *buffers, stream=None):
+        with self.lock:
+            self.__check_sending()
+            self.__queue(buffers, stream)
+
+    """
+    Send count bytes of the file at path starting at offset, the rest of the file by default
+    The file is memory mapped instead of read, packets are views into the mapping so pages are only
+    read in as the window reaches them and a file of any size goes out without being held in memory.
+    header and trailer are bytes sent straight before and after the file
+    Returns how many bytes of the file were queued, raises RxPConnectionSendException like write
+    """
+    def sendfile(self, path, offset=0, count=None, header=None, trailer=None, stream=None):
+        self.__check_sending()
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if offset < 0 or offset > size:
+                raise ValueError("Offset %s is outside of %s, a file of %s bytes" % (offset, path, size))
+            count = size - offset if count is None else max(0, min(count, size - offset))
+            # the mapping keeps its own reference to the file, it can be closed straight away
+            view = self.__map_file(file, offset, count) if count else None
+        with self.lock:
+            self.__check_sending()
+            self.__queue((header, view, trailer), stream)
+        return count
+
+    """Raise RxPConnectionSendException unless data may still be sent on the connection"""
+    def __check_sending(self):
+        if self.state is not RxPConnectionState.ESTABLISHED:
+            raise RxPConnectionSendException("Connection state is not established it is: %s" % self.state)
+        if self.close_requested:
+            raise RxPConnectionSendException("Connection is closing")
+
+    """Queue buffers to go out on stream, the connection's own without one, and send what the windows let through"""
+    def __queue(self, buffers, stream=None):
+        queue = self.send_queue
+        if stream is not None:
+            if stream.send_closed:
+                raise RxPConnectionSendException("%s is closed for sending" % stream)
+            queue = stream.send_queue
+        for buffer in buffers:
+            if buffer:
+                queue.append(memoryview(buffer).cast('B'))
+        if stream is not None and stream not in self.sending:
+            self.sending.append(stream)
         self.__fill_send_window()
+
+    """
+    A read only view of count bytes of an open file from offset
+    The mapping is unmapped once the last packet referencing it is acknowledged and dropped
+    """
+    def __map_file(self, file, offset, count):
+        # mappings start at a multiple of the allocation granularity
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY
+        mapping = mmap.mmap(file.fileno(), offset + count - start, access=mmap.ACCESS_READ, offset=start)
+        if hasattr(mapping, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+            # read ahead of the window and let the kernel drop pages behind it
+            mapping.madvise(mmap.MADV_SEQUENTIAL)
+        return memoryview(mapping)[offset - start:]
+            
         
+    """
+    Remove ack'ed packets from send window
+    sequence is a cumulative ACK, every packet up to and including it was received,
+    sack_blocks are (first, last) ranges the receiver holds beyond it
+    """
+    def __remove_acked_from_send_window(self, sequence, sack_blocks=()):
+        with self.lock:
+            if self.send_window is None:
+                return
+            if self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug("Removing ACK'ed up to %s and %s from Send window: %s ", sequence, sack_blocks, self.send_window)
+            acked = 0
+            last = min(sequence, self.last_seq)
+            while self.send_unacked <= last:
+                acked += self.__clear_window_slot(self.send_unacked)
+                self.send_unacked += 1
+            for first, last in sack_blocks:
+                for packet_sequence in range(max(first, self.send_unacked), min(last, self.last_seq) + 1):
+                    acked += self.__clear_window_slot(packet_sequence)
+            if acked:
+                self.congestion.on_ack(acked, self.__srtt())
+            # fill the window with additional packets
+            self.__fill_send_window()
+            self.__maybe_send_fin()
+    
+    def __clear_window_slot(self, sequence):
+        slot = self.__window_slot(sequence)
+        if self.send_window[slot] == sequence:
+            self.send_window[slot] = None
+            return 1
+        return 0
+    
+    """Smoothed round trip time to the other side, None until measured"""
+    def __srtt(self):
+        return self.communicator.get_rtt_estimator(self.destinationip, self.destinationport).srtt if self.communicator else None
+    
+    """
+    How many packets may be in flight, the congestion window capped by the send window size and the peer's receive window
+    The peer's window is the room for the connection's own data, packets of streams only count against the windows of their streams
+    """
+    def effective_window(self, streams=False):
+        window = min(self.congestion.window(), len(self.send_window))
+        if self.peer_window is not None and not streams:
+            window = min(window, self.peer_window)
+        # with a zero window one packet still goes out to probe for the window opening,
+        # the retransmission timer keeps probing with backoff until it is taken
+        return max(1, window)
+    
+    """Called by the communicator when a packet to the other side was lost"""
+    def handle_packet_loss(self, timeout):
+        with self.lock:
+            if self.peer_window == 0:
+                # a zero window probe going unanswered says nothing about congestion
+                return
+            self.stats.add('congestion_events')
+            if timeout:
+                self.congestion.on_timeout()
+            else:
+                self.congestion.on_loss()
+            self.logger.debug("Packet loss (timeout: %s), congestion window now %s", timeout, self.congestion)
+    
+    """The send window is a ring, each sequence number has a fixed slot"""
+    def __window_slot(self, sequence):
+        return (sequence - self.window_base) % len(self.send_window)
            
     """Fill empty slots in the send window with additional packets"""
     def __fill_send_window(self):
-        for window_slot, value in enumerate(self.send_window):
-            if self.send_window[window_slot] == None:
-                data_in_bytes = self.__get_next_datagram()
-                if data_in_bytes:
-                    # send the packet, and record the sequence number in the send window
-                    packet_sequence = self.communicator.sendDATA(self.sourceip, self.sourceport, self.destinationip, self.destinationport, data_in_bytes)
-                    self.logger.debug("Fill Send Window Slot: %s Sent Packet with Sequence: %s and data: %s" % (window_slot,packet_sequence, data_in_bytes))
-                    self.send_window[window_slot] = packet_sequence
-                else:
+        # nothing goes after the FIN
+        if self.communicator is None or self.fin_sequence is not None:
+            return
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        with self.lock, self.communicator.batch():
+            while self.send_window is not None and self.__has_data_to_send():
+                packet_sequence = self.last_seq + 1
+                window_slot = self.__window_slot(packet_sequence)
+                window = self.effective_window()
+                stream_window = self.effective_window(streams=True) if self.sending else window
+                # never run further than the window ahead of the oldest unacked packet
+                if packet_sequence >= self.send_unacked + stream_window or self.send_window[window_slot] is not None:
+                    break
+                segment = self.__next_segment(packet_sequence < self.send_unacked + window)
+                if segment is None:
                     self.logger.debug("No More data to send")
-        self.logger.debug("Filled Send Window to: %s" % str(self.send_window))
+                    break
+                stream, data_in_bytes, offset, fin = segment
+                if stream is not None:
+                    window = stream_window
+                self.send_window[window_slot] = packet_sequence
+                self.last_seq = packet_sequence
+                # ask for an immediate ACK when this packet fills the window or ends the data
+                next_slot = self.__window_slot(packet_sequence + 1)
+                push = self.send_window[next_slot] is not None or packet_sequence + 1 >= self.send_unacked + window or not self.__has_data_to_send()
+                # send the packet, and record the sequence number in the send window
+                if stream is None:
+                    self.communicator.sendDATA(self.sourceip, self.sourceport, self.destinationip, self.destinationport, data_in_bytes, packet_sequence, push)
+                else:
+                    # the last packet a stream has, and a probe for its window, are answered at once
+                    push = push or not stream.has_data_to_send() or data_in_bytes is None
+                    self.communicator.sendDATA(self.sourceip, self.sourceport, self.destinationip, self.destinationport, data_in_bytes, packet_sequence, push, stream.id, offset, fin)
+                    if fin:
+                        self.__retire_stream(stream)
+                length = len(data_in_bytes) if data_in_bytes is not None else 0
+                self.stats.add('data_packets_sent')
+                self.stats.add('data_bytes_sent', length)
+                if debug:
+                    self.logger.debug("Fill Send Window Slot: %s Sent Packet with Sequence: %s of %s bytes", window_slot, packet_sequence, length)
+            if debug:
+                self.logger.debug("Filled Send Window to: %s", self.send_window)
+    
+    """
+    The next packet to send as (stream, data, offset, fin), stream is None for the connection's own data
+    The connection's own data and the streams take turns a packet at a time, so a long transfer on one
+    of them does not hold up the others. None when nothing the windows let through is left
+    """
+    def __next_segment(self, own_window_open):
+        own = own_window_open and self.__has_own_data_to_send()
+        if self.sending and (self.streams_turn or not own):
+            for _ in range(len(self.sending)):
+                stream = self.sending.popleft()
+                segment = stream.next_segment(min(self.send_buffer_size, self.MAX_STREAM_SEGMENT_SIZE))
+                if stream.has_data_to_send():
+                    self.sending.append(stream)
+                    if stream.blocked():
+                        self.__schedule_probe(stream)
+                if segment is not None:
+                    self.streams_turn = False
+                    return (stream,) + segment
+        if own:
+            self.streams_turn = True
+            return None, self.__get_next_datagram(), 0, False
+        return None
+    
+    """
+    A stream the other side's window holds up asks for the window again after a while, in case the
+    ACK that opened it was lost. Like the retransmission timer it backs off while the window stays shut
+    """
+    def __schedule_probe(self, stream):
+        if stream.probe_timer is None and self.communicator is not None:
+            delay = min(60.0, self.communicator.get_rtt_estimator(self.destinationip, self.destinationport).rto * 2 ** stream.probes)
+            stream.probe_timer = self.communicator.timers.schedule(delay, self.__probe_stream, stream)
+    
+    def __probe_stream(self, stream):
+        with self.lock:
+            stream.probe_timer = None
+            if self.communicator is None or not stream.blocked():
+                return
+            stream.probe_due = True
+            stream.probes += 1
+            self.__fill_send_window()
+    
+    """Whether anything passed to send has not been put in a packet yet"""
+    def __has_data_to_send(self):
+        return bool(self.sending) or self.__has_own_data_to_send()
     
-    """Split data to send into buffer size byte data grams"""
+    def __has_own_data_to_send(self):
+        if self.data_to_be_sent is not None and self.data_to_be_sent_last_pointer < len(self.data_to_be_sent):
+            return True
+        return any(len(buffer) for buffer in self.send_queue)
+    
+    """
+    Split data to send into buffer size byte data grams
+    A datagram is a view into the buffer being sent, only a datagram spanning the end of one buffer
+    and the start of the next is copied so every datagram but the last is full
+    """
     def __get_next_datagram(self):
-        data_in_bytes = None
-        self.logger.debug("Data To be Sent Last Pointer: %s, Length of Data: %s" % (self.data_to_be_sent_last_pointer, len(self.data_to_be_sent)))
-        if self.data_to_be_sent_last_pointer < len(self.data_to_be_sent):
-            end_index = self.data_to_be_sent_last_pointer+self.send_buffer_size
-            self.logger.debug("End Index: %s " % end_index)
-            data_in_bytes = self.data_to_be_sent[self.data_to_be_sent_last_pointer : end_index]
-            self.logger.debug("Data in bytes: %s, Data Indices: [%s : %s]" % (data_in_bytes, self.data_to_be_sent_last_pointer, end_index))
+        segments = []
+        remaining = self.send_buffer_size
+        while remaining:
+            if self.data_to_be_sent is None or self.data_to_be_sent_last_pointer >= len(self.data_to_be_sent):
+                if not self.send_queue:
+                    break
+                self.data_to_be_sent = self.send_queue.popleft()
+                self.data_to_be_sent_last_pointer = 0
+                continue
+            end_index = min(self.data_to_be_sent_last_pointer + remaining, len(self.data_to_be_sent))
+            segments.append(self.data_to_be_sent[self.data_to_be_sent_last_pointer : end_index])
+            remaining -= end_index - self.data_to_be_sent_last_pointer
             # advance data pointer to next point in data stream
             self.data_to_be_sent_last_pointer = end_index
-        return data_in_bytes
+        if not segments:
+            return None
+        if len(segments) == 1:
+            return segments[0]
+        return b''.join(segments)
     
         
-    """Close the connection"""
-    def close(self):
-        # Check if we are in established, if we are send FIN
-        if self.state == RxPConnectionState.ESTABLISHED:
-            self.logger.debug("Sending FIN packet to close connection")
-            sequence_number = self.communicator.sendCONNECTFIN(self.sourceip, self.sourceport, self.destinationip, self.destinationport)
-            self.state = RxPConnectionState.FIN_WAIT_1
-            t = Timer(self.FIN_WAIT_1_TIMEOUT, self.__handle_close_timeouts, [self.state, sequence_number])
-            t.start()
-        # First check if we are in the passive close flow
-        elif self.state == RxPConnectionState.CLOSE_WAIT:
-            self.logger.debug("Sending FIN packet to close connection")
-            sequence_number = self.communicator.sendCONNECTFIN(self.sourceip, self.sourceport, self.destinationip, self.destinationport)
-            self.state = RxPConnectionState.LAST_ACK
-            t = Timer(self.LAST_ACK_TIMEOUT, self.__handle_close_timeouts, [self.state, sequence_number])
-            t.start()
+    """
+    Close the connection, the application and a FIN from the other side can both close at once
+    With a stream only the sending half of that stream is closed, its FIN goes after the data written to it
+    """
+    def close(self, stream=None):
+        if stream is not None:
+            with self.lock:
+                if not stream.send_closed:
+                    stream.send_closed = True
+                    if stream not in self.sending:
+                        self.sending.append(stream)
+                    self.__fill_send_window()
+            return
+        with self.lock:
+            if self.state in (RxPConnectionState.ESTABLISHED, RxPConnectionState.CLOSE_WAIT) and not self.close_requested:
+                self.close_requested = True
+                self.__maybe_send_fin()
+
+    """
+    Send the FIN once close was called and all data, the connection's own and that of its streams,
+    went out and was acknowledged, so nothing is ever sent after it
+    """
+    def __maybe_send_fin(self):
+        with self.lock:
+            if not self.close_requested or self.fin_sequence is not None:
+                return
+            if self.__has_data_to_send() or self.send_unacked <= self.last_seq:
+                return
+            # Check if we are in established, if we are send FIN
+            if self.state == RxPConnectionState.ESTABLISHED:
+                self.logger.debug("Sending FIN packet to close connection")
+                sequence_number = self.__send_fin()
+                self.state = RxPConnectionState.FIN_WAIT_1
+                self.__schedule_close_timeout(self.FIN_WAIT_1_TIMEOUT, self.state, sequence_number)
+            # First check if we are in the passive close flow
+            elif self.state == RxPConnectionState.CLOSE_WAIT:
+                self.logger.debug("Sending FIN packet to close connection")
+                sequence_number = self.__send_fin()
+                self.state = RxPConnectionState.LAST_ACK
+                self.__schedule_close_timeout(self.LAST_ACK_TIMEOUT, self.state, sequence_number)
         
+    
+    """The FIN takes the next sequence number after the data"""
+    def __send_fin(self):
+        with self.lock:
+            communicator = self.communicator
+            if communicator is None:
+                # destroyed while we were closing
+                return None
+            self.last_seq += 1
+            self.fin_sequence = self.last_seq
+            data = None
+            if self.tickets is not None:
+                data = RxPacket.pack_options({RxPOption.TICKET: self.tickets.issue(self.destinationip, self.session())})
+            return communicator.sendCONNECTFIN(self.sourceip, self.sourceport, self.destinationip, self.destinationport, self.fin_sequence, data)
+
+    """What this connection learned about the path, for a later connection to the same peer to resume from"""
+    def session(self):
+        srtt = rttvar = None
+        communicator = self.communicator
+        if communicator is not None:
+            estimator = communicator.get_rtt_estimator(self.destinationip, self.destinationport)
+            srtt, rttvar = estimator.srtt, estimator.rttvar
+        with self.lock:
+            return RxPSession(srtt, rttvar, self.congestion.cwnd, self.congestion.ssthresh)
+
+    """Start from the round trip time and congestion window of an earlier connection instead of slow start"""
+    def resume(self, session):
+        with self.lock:
+            self.congestion.resume(session.cwnd, session.ssthresh)
+        if session.srtt is not None and self.communicator is not None:
+            self.communicator.get_rtt_estimator(self.destinationip, self.destinationport).restore(session.srtt, session.rttvar)
+        self.logger.debug("Resumed session %s", session)
 
         
+    """
+    A snapshot of the connection like TCP_INFO, the counters of this connection and of the traffic
+    with its peer, the round trip time estimate, windows and buffer depths
+    """
+    def info(self):
+        info = self.stats.snapshot()
+        communicator = self.communicator
+        if communicator is not None:
+            info.update(communicator.peer_info(self.destinationip, self.destinationport))
+        with self.lock:
+            info['state'] = self.state.name
+            info['cwnd'] = self.congestion.cwnd
+            info['ssthresh'] = self.congestion.ssthresh
+            info['send_window_size'] = self.window_size
+            info['in_flight'] = self.last_seq + 1 - self.send_unacked
+            info['peer_window'] = self.peer_window
+            info['advertised_window'] = self.advertised_window
+            info['receive_buffered'] = len(self.receive_buffer) if self.receive_buffer is not None else 0
+            info['out_of_order_held'] = len(self.out_of_order)
+            pending = len(self.data_to_be_sent) - self.data_to_be_sent_last_pointer if self.data_to_be_sent is not None else 0
+            info['send_pending'] = pending + sum(len(buffer) for buffer in self.send_queue) + sum(stream.send_pending() for stream in self.streams.values())
+            info['streams'] = len(self.streams)
+            if communicator is not None:
+                # destroy drops the send window under the lock, so it is only looked at while holding it
+                info['effective_window'] = self.effective_window() if self.send_window else 0
+        return info
+    
     # destroy any resources with this connection    
     def destroy(self):
         self.logger.debug("Destroying Connection")
         self.state = RxPConnectionState.CLOSED
-        self.receive_buffer = None
-        self.send_window = None
+        if self.communicator is not None:
+            self.communicator.remove_listener((self.destinationip, self.destinationport))
+            # the round trip time, duplicate ACK count and checksum of the peer go with the connection
+            self.communicator.forget_peer(self.destinationip, self.destinationport)
+        with self.lock:
+            if self.delayed_ack_timer is not None:
+                self.delayed_ack_timer.cancel()
+                self.delayed_ack_timer = None
+            for timer in self.close_timers:
+                timer.cancel()
+            self.close_timers = []
+            # data not read yet stays readable, receive returns None once it is gone
+            if self.receive_buffer is not None and len(self.receive_buffer) == 0:
+                self.receive_buffer = None
+            self.out_of_order = {}
+            self.send_window = None
+            for stream in self.streams.values():
+                if stream.probe_timer is not None:
+                    stream.probe_timer.cancel()
+                    stream.probe_timer = None
+            self.__notify_readable()
+        # wake up run so it sees we are closed
+        self.packet_queue.put(None)
         self.communicator = None
         return None
             
     
+    """Give up on the other side after timeout seconds in state unless the close went on"""
+    def __schedule_close_timeout(self, timeout, state, sequence=None):
+        communicator = self.communicator
+        if communicator is not None:
+            self.close_timers.append(communicator.timers.schedule(timeout, self.__handle_close_timeouts, state, sequence))
+
     """Function to handle any close state timeouts"""
     def __handle_close_timeouts(self, state, sequence=None):
         # If the state has changed since we were waiting for an ACK
         # ANd we are still not waiting for the FIN packet to be ACk'ed
-        if sequence and sequence not in self.communicator.waiting_to_be_acked and self.state is not state:
+        if self.communicator is None:
+            return None
+        if sequence and not self.communicator.is_waiting_for_ack(self.destinationip, self.destinationport, sequence) and self.state is not state:
             return None
         else:
-            self.logger.debug("Close timeout in State: %s for Packet Sequence: %s" % (state, sequence))
+            self.logger.debug("Close timeout in State: %s for Packet Sequence: %s", state, sequence)
             self.destroy()
             
-    """Set the Send Window Size"""
+    """Set the Send Window Size, packets already in flight keep their place in the ring"""
     def set_window_size(self, window_size):
-        self.window_size = window_size
-        self.send_window = []
-        for i in range(0, self.window_size):
-            self.send_window.append(None)
-    
\ No newline at end of file
+        with self.lock:
+            self.window_size = window_size
+            in_flight = []
+            if getattr(self, 'send_window', None):
+                in_flight = [sequence for sequence in self.send_window if sequence is not None]
+            self.send_window = []
+            # the ring has to hold everything still in flight
+            for i in range(0, max(self.window_size, self.last_seq + 1 - self.send_unacked)):
+                self.send_window.append(None)
+            for sequence in in_flight:
+                self.send_window[self.__window_slot(sequence)] = sequence
+
+
+'''
+Wait until at least one of connections is readable, like select on sockets
+Returns the readable connections, an empty list when timeout seconds pass first
+
+    for connection in poll(connections, 1.0):
+        data = connection.receive(65536)
+'''
+def poll(connections, timeout=None):
+    ready = Event()
+    for connection in connections:
+        with connection.lock:
+            connection.pollers.add(ready)
+    try:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # cleared before looking, a packet arriving after the look still wakes the wait
+            ready.clear()
+            readable = [connection for connection in connections if connection.readable()]
+            if readable:
+                return readable
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return []
+            ready.wait(remaining)
+    finally:
+        for connection in connections:
+            with connection.lock:
+                connection.pollers.discard(ready)
@@ -0,0 +1,63 @@
+from logs import get_logger
+import queue
+import zlib
+from threading import Thread
+
+# worker threads an RxP socket hands packets to by default
+DEFAULT_WORKERS = 4
+
+'''
+Hands incoming packets to their connection's handle_packet.
+With no workers packets are handled inline on the thread that submits them,
+otherwise each connection is pinned to one of a fixed number of worker threads,
+so packets of a connection are handled one at a time and in the order they arrived
+while different connections are handled in parallel
+'''
+class RxPPacketDispatcher:
+    def __init__(self, workers=DEFAULT_WORKERS, name="RxPPacketDispatcher"):
+        if workers < 0:
+            raise ValueError("Worker count can not be negative: %s" % workers)
+        self.logger = get_logger("PacketDispatcher")
+        self.workers = workers
+        self.queues = [queue.Queue() for i in range(workers)]
+        self.threads = []
+        for index, packets in enumerate(self.queues):
+            thread = Thread(target=self.__work, args=(packets,), name="%s worker %s" % (name, index))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    """Queue a packet for a connection, handled right away when there are no workers"""
+    def submit(self, connection, packet):
+        if not self.queues:
+            self.__handle(connection, packet)
+        else:
+            self.queues[self.worker_for(connection)].put((connection, packet))
+
+    """The worker a connection is pinned to, picked from the address of the other side"""
+    def worker_for(self, connection):
+        key = ("%s:%s" % (connection.destinationip, connection.destinationport)).encode('utf-8')
+        return zlib.crc32(key) % self.workers
+
+    """Stop the workers once they handled what is already queued"""
+    def close(self):
+        for packets in self.queues:
+            packets.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.workers = 0
+        self.queues = []
+        self.threads = []
+
+    def __work(self, packets):
+        while True:
+            item = packets.get()
+            if item is None:
+                return
+            self.__handle(*item)
+
+    def __handle(self, connection, packet):
+        try:
+            connection.handle_packet(packet)
+        except Exception:
+            self.logger.exception("Handling packet %s failed", packet)
@@ -0,0 +1,109 @@
+import errno
+import os
+
+'''
+Writes a received file to disk through one file descriptor kept open for the whole transfer
+Chunks in order collect in a large buffer that goes out in one pwrite when it fills,
+chunks at other offsets, like segments arriving out of order, are written where they belong
+straight away. The file is preallocated to the length it will have and synced once, on close.
+The length comes from the other side, one over max_length is refused with EFBIG before the file is made
+
+    sink = RxPFileSink(frame.name, frame.length)
+    sink.write(chunk)
+    ...
+    sink.close()
+'''
+class RxPFileSink:
+    BUFFER_SIZE = 1024 * 1024
+    # largest file taken unless told otherwise
+    MAX_LENGTH = 4 * 1024 * 1024 * 1024
+
+    def __init__(self, path, length=None, buffer_size=BUFFER_SIZE, sync=True, max_length=MAX_LENGTH):
+        if length is not None and max_length is not None and length > max_length:
+            raise OSError(errno.EFBIG, "%s bytes is more than the %s a file may have" % (length, max_length), path)
+        self.path = path
+        self.length = length
+        self.sync = sync
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        self.buffer = bytearray(buffer_size)
+        # bytes in the buffer, which belong at buffer_offset in the file
+        self.buffered = 0
+        self.buffer_offset = 0
+        # where the next chunk in order goes and the furthest byte written
+        self.offset = 0
+        self.end = 0
+        if length:
+            self.__preallocate(length)
+
+    """Reserve the blocks of the file up front, so it is not fragmented and a full disk shows at the start"""
+    def __preallocate(self, length):
+        if not hasattr(os, 'posix_fallocate'):
+            return
+        try:
+            os.posix_fallocate(self.fd, 0, length)
+        except OSError as e:
+            # not every file system can, the writes allocate as they go there
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                os.close(self.fd)
+                raise
+
+    """Write a chunk after the last one, or at offset when given"""
+    def write(self, data, offset=None):
+        data = memoryview(data).cast('B')
+        if offset is not None and offset != self.offset:
+            self.__pwrite(data, offset)
+            self.end = max(self.end, offset + len(data))
+            return len(data)
+        if self.buffered + len(data) > len(self.buffer):
+            self.flush()
+        if len(data) >= len(self.buffer):
+            # larger than the buffer, copying it first would only cost time
+            self.__pwrite(data, self.offset)
+        else:
+            if self.buffered == 0:
+                self.buffer_offset = self.offset
+            self.buffer[self.buffered:self.buffered + len(data)] = data
+            self.buffered += len(data)
+        self.offset += len(data)
+        self.end = max(self.end, self.offset)
+        return len(data)
+
+    """Write what the buffer holds, the data is with the kernel but not necessarily on disk"""
+    def flush(self):
+        if self.buffered:
+            self.__pwrite(memoryview(self.buffer)[:self.buffered], self.buffer_offset)
+            self.buffered = 0
+
+    def __pwrite(self, data, offset):
+        while len(data):
+            written = os.pwrite(self.fd, data, offset)
+            data = data[written:]
+            offset += written
+
+    """Flush, cut off what was preallocated but never written and sync the file to disk once"""
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            self.flush()
+            if self.length is not None and self.end != self.length:
+                os.ftruncate(self.fd, self.end)
+            if self.sync:
+                os.fsync(self.fd)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+
+    """Give up on a transfer that did not finish, keep what arrived without waiting for the disk"""
+    def abort(self):
+        self.sync = False
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if type is None:
+            self.close()
+        else:
+            self.abort()
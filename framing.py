@@ -0,0 +1,144 @@
+import os
+import struct
+from enum import Enum, unique
+
+'''
+Framed messages for the FxA client and server, carried over the byte stream of an RxPConnection
+Every message is a header, the name it is about and a payload of the length the header gives:
+
+    version(1) command(1) name length(2) payload length(8) name payload
+
+A receiver knows where a message ends before it starts, payloads can hold any bytes
+and a file streams to disk in the pieces it arrives in without anything being searched for
+'''
+
+@unique
+class RxPCommand(Enum):
+    '''Ask for the file called name, the payload is empty'''
+    GET = 1
+    '''The contents of the file called name'''
+    FILE = 2
+
+
+'''
+Raised when a framed stream holds something that is not a message we understand
+'''
+class RxPFrameFormatException(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
+
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('!BBHQ')
+
+# what RxPFrameDecoder.feed reports about a message
+FRAME_START = 'start'
+FRAME_DATA = 'data'
+FRAME_END = 'end'
+
+
+"""A message being received, received counts the payload bytes seen so far"""
+class RxPFrame:
+    def __init__(self, command, name, length):
+        self.command = command
+        self.name = name
+        self.length = length
+        self.received = 0
+
+    def complete(self):
+        return self.received == self.length
+
+    def __str__(self):
+        return "%s %s (%s of %s bytes)" % (self.command.name, self.name, self.received, self.length)
+
+
+"""The header and name of a message with a payload of length bytes"""
+def encode_frame(command, name, length):
+    name = name.encode('utf-8')
+    if len(name) > 0xFFFF:
+        raise ValueError("Name of %s bytes does not fit in a frame" % len(name))
+    return FRAME_HEADER.pack(FRAME_VERSION, command.value, len(name), length) + name
+
+
+"""Send a message with its payload, the payload is not copied"""
+def send_message(connection, command, name, payload=b''):
+    connection.write(encode_frame(command, name, len(payload)), payload)
+
+
+"""
+Send a file as the payload of a message, straight from a memory mapping of it
+Returns the payload length announced in the header
+"""
+def send_file(connection, command, name, path):
+    length = os.path.getsize(path)
+    sent = connection.sendfile(path, 0, length, header=encode_frame(command, name, length))
+    if sent != length:
+        raise RxPFrameFormatException("%s changed size while it was sent, %s of %s bytes" % (path, sent, length))
+    return length
+
+
+'''
+Splits the bytes of a connection back into messages, whatever the sizes of the pieces they arrive in
+Only a header and name split between pieces is held back, payload bytes are handed out as they come
+'''
+class RxPFrameDecoder:
+    def __init__(self):
+        # the start of a header and name that did not arrive in one piece
+        self.pending = bytearray()
+        # the message whose payload is being received
+        self.frame = None
+
+    '''
+    Take the next bytes of the stream, returns what they hold as a list of (event, frame, chunk)
+    FRAME_START once a header and name are complete, FRAME_DATA with each piece of the payload and
+    FRAME_END after the last one. Chunks are views into data, use them before data changes
+    '''
+    def feed(self, data):
+        data = memoryview(data).cast('B')
+        events = []
+        position = 0
+        while position < len(data):
+            if self.frame is None:
+                position += self.__read_header(data[position:], events)
+                continue
+            frame = self.frame
+            chunk = data[position:position + frame.length - frame.received]
+            position += len(chunk)
+            frame.received += len(chunk)
+            events.append((FRAME_DATA, frame, chunk))
+            if frame.complete():
+                self.__end(events)
+        return events
+
+    """Take bytes of a header and name, returns how many were used"""
+    def __read_header(self, data, events):
+        needed = FRAME_HEADER.size - len(self.pending)
+        if needed <= 0:
+            needed += FRAME_HEADER.unpack_from(self.pending)[2]
+        taken = data[:needed]
+        self.pending += taken
+        if len(self.pending) < FRAME_HEADER.size:
+            return len(taken)
+        version, command, name_length, length = FRAME_HEADER.unpack_from(self.pending)
+        if version != FRAME_VERSION:
+            raise RxPFrameFormatException("Unsupported frame version: %s" % version)
+        if len(self.pending) < FRAME_HEADER.size + name_length:
+            # the header says how long the name is, the next call takes it
+            return len(taken)
+        try:
+            command = RxPCommand(command)
+        except ValueError:
+            raise RxPFrameFormatException("Unknown command: %s" % command)
+        name = bytes(self.pending[FRAME_HEADER.size:]).decode('utf-8')
+        self.pending = bytearray()
+        self.frame = RxPFrame(command, name, length)
+        events.append((FRAME_START, self.frame, memoryview(b'')))
+        if length == 0:
+            self.__end(events)
+        return len(taken)
+
+    def __end(self, events):
+        events.append((FRAME_END, self.frame, memoryview(b'')))
+        self.frame = None
@@ -1,87 +1,121 @@
 from protocol import RxP
-from connection import RxPConnectionState
+from connection import RxPConnectionSendException
+from logs import get_logger
+from filesink import RxPFileSink
+from serverpool import RxPServerPool
+from tickets import RxPTicketIssuer
+from framing import RxPCommand, RxPFrameDecoder, RxPFrameFormatException, FRAME_START, FRAME_DATA, FRAME_END, send_file
 import logging
 from threading import Thread
+import os
 import sys
 
 
 
 
 class Server(Thread):
-    def __init__(self, sourceport, destinationip, destinationport, loglevel=logging.DEBUG):
+    # most bytes taken from a connection at a time
+    RECEIVE_SIZE = 65536
+    # largest file a client may post
+    MAX_FILE_SIZE = RxPFileSink.MAX_LENGTH
+
+    def __init__(self, sourceport, destinationip, destinationport, loglevel=logging.DEBUG, ip="127.0.0.1", reuse_port=False, fast_open=False, tickets=None):
         super(Server, self).__init__()
-        self.logger = logging.getLogger("RxPServer")
+        self.logger = get_logger("Server", loglevel)
         self.loglevel = loglevel
-        # create console handler and set level to debug
-        self.logger.setLevel(loglevel)
-        # create console handler and set level to debug
-        ch = logging.StreamHandler()
-        ch.setLevel(loglevel)
-        # create formatter
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        # add formatter to ch
-        ch.setFormatter(formatter)
-        # add ch to logger
-        self.logger.addHandler(ch)
         self.SHOULD_I_RUN = True
+        # the accept loop must not keep the process alive after terminate
+        self.daemon = True
+        self.ip = ip
         self.port = int(sourceport)
+        # share the port with the servers of the other workers of an RxPServerPool
+        self.reuse_port = reuse_port
+        # answer a get that came in the SYN of a client in the first round trip
+        self.fast_open = fast_open
+        # the RxPTicketIssuer that lets returning clients skip slow start
+        self.tickets = tickets
         self.destionationip = destinationip
         self.destinationport = int(destinationport)
-        self.connected_client = None
-        self.receive_state = None
-        self.separator_text = b'|SEPARATOR|'
+        self.connected_clients = []
         
         
     def handle_client(self,connection):
-        data = bytearray()
-        while self.SHOULD_I_RUN and connection.state is RxPConnectionState.ESTABLISHED:
-            data.extend(connection.receive(512))
-            self.logger.info("Data Recieved from Client: %s " % data)
-            
-            separator = data.find(self.separator_text)
-            print ("Separator Found : "+str(separator))
-            if separator is not -1:
-                server_command = data[0:separator].decode("utf-8") 
-                print ("Server command: "+server_command)
-                command = server_command.split(' ')[0]
-                filename = server_command.split(' ')[1]
-                if 'get' in command:
-                    file_contents = open(filename, "rb").read()
-                    self.logger.debug("Sending following file contents: %s" % file_contents)
-                    connection.send("file %s" % (filename+"_server"), file_contents+b'|END')
-                    data = bytearray()
-                elif 'file' in command:
-                    self.logger.debug("Server Start WRiting bytes to file")
-                    self.receive_state = 'file'
-                    self.__write_bytes_to_file(filename, data[separator+(len(self.separator_text)):])
-                    data = bytearray()
-            elif self.receive_state == 'file':
-                end_file = data.find(b'|END')
-                if end_file is -1:
-                    self.logger.debug("Server WRiting bytes to file")
-                    self.__write_bytes_to_file(filename, data)
-                    data = bytearray()
-                else:
-                    contents = data[:end_file]
-                    self.__write_bytes_to_file(filename, contents)
-                    self.logger.debug("Ending File Write")
-                    self.receive_state = None
-                    data = bytearray()
+        decoder = RxPFrameDecoder()
+        output = None
+        try:
+            while self.SHOULD_I_RUN:
+                data = connection.receive(self.RECEIVE_SIZE)
+                if data is None:
+                    # the other side closed and everything it sent was read
+                    break
+                for event, frame, chunk in decoder.feed(data):
+                    if frame.command is RxPCommand.GET:
+                        if event == FRAME_END:
+                            self.__send_file(connection, frame.name)
+                    elif event == FRAME_START:
+                        self.logger.debug("Server Start writing %s", frame)
+                        output = RxPFileSink(frame.name, frame.length, max_length=self.MAX_FILE_SIZE)
+                    elif event == FRAME_DATA:
+                        output.write(chunk)
+                    else:
+                        output.close()
+                        output = None
+                        self.logger.debug("Ending File Write of %s", frame)
+        except RxPFrameFormatException as e:
+            self.logger.error("Bad message from %s:%s: %s", connection.destinationip, connection.destinationport, e)
+        except OSError as e:
+            # the file can not be written, nothing more the client sends can be taken
+            self.logger.error("Can not store the file of %s:%s: %s", connection.destinationip, connection.destinationport, e)
+            connection.close()
+        finally:
+            if output is not None:
+                output.abort()
         self.logger.debug("Ended Handle Client")
-        
-    def __write_bytes_to_file(self, filename, data):
-        file = open(filename, "ab")
-        file.write(data)
-        file.close()
+
+    '''Answer a get with the file, stored by the client as filename_server'''
+    def __send_file(self, connection, filename):
+        try:
+            sent = send_file(connection, RxPCommand.FILE, filename + "_server", filename)
+            self.logger.debug("Sending file %s of %s bytes", filename, sent)
+        except OSError as e:
+            self.logger.error("Can not send %s: %s", filename, e)
+        except RxPConnectionSendException as e:
+            self.logger.info("Not sending %s, the client went away: %s", filename, e)
 
     
     def start(self):
-        socket = RxP(self.loglevel)
-        socket.listen("127.0.0.1", self.port)
-        connection = socket.accept()
-        t = Thread(target=self.handle_client, args=(connection,))
-        self.connected_client = (connection)
-        t.start()
+        self.socket = RxP(self.loglevel, fast_open=self.fast_open, tickets=self.tickets)
+        self.socket.listen(self.ip, self.port, reuse_port=self.reuse_port)
+        super(Server, self).start()
+    
+    '''Accept clients for as long as the server runs, each one is handled on its own thread'''
+    def run(self):
+        while self.SHOULD_I_RUN:
+            connection = self.socket.accept()
+            self.logger.info("Accepted client %s:%s", connection.destinationip, connection.destinationport)
+            self.connected_clients.append(connection)
+            t = Thread(target=self.handle_client, args=(connection,))
+            t.daemon = True
+            t.start()
+            t = Thread(target=self.accept_streams, args=(connection,))
+            t.daemon = True
+            t.start()
+    
+    '''Serve the streams a client opens in its connection, each on a thread of its own'''
+    def accept_streams(self, connection):
+        while self.SHOULD_I_RUN:
+            stream = connection.accept_stream()
+            if stream is None:
+                # the client closed the connection
+                break
+            t = Thread(target=self.handle_stream, args=(stream,))
+            t.daemon = True
+            t.start()
+    
+    '''Answer what a client asks for on a stream, our half is closed once the client closed its own'''
+    def handle_stream(self, stream):
+        self.handle_client(stream)
+        stream.close()
             
 
             
@@ -91,29 +125,45 @@ class Server(Thread):
             connection.close()
 
 
-if len(sys.argv) != 4:
-    print ("""Please provide the following 3 arguments: X A P\n
-""")
-else:
-    print ("Starting server")
-    server = Server( sys.argv[1], sys.argv[2], sys.argv[3], logging.INFO)
+'''
+Serve in a worker process of an RxPServerPool, sharing the port with the other workers
+and the ticket key, a client may reach another worker than the one that issued its ticket
+'''
+def start_worker(ip, port, loglevel=logging.INFO, ticket_key=None):
+    tickets = RxPTicketIssuer(ticket_key) if ticket_key is not None else None
+    server = Server(port, ip, 0, loglevel, ip=ip, reuse_port=True, tickets=tickets)
     server.start()
-    ALIVE = True
-    while ALIVE:
-        user_input = input("What is your wish (command) ?")
-        user_input = user_input.lower()
-        if user_input == 'terminate':
-            server.stop()
-            ALIVE = False
-            print ("Server End - Goodbye")
-        elif 'window' in user_input:
-            window_size = user_input.split(' ',2)[1]
-            try:
-                window_size = int(window_size)
-                #conn.set_window_size(window_size)
-            except ValueError:
-                print ("ERROR window size is not an integer")
+    return server.socket
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (4, 5):
+        print ("""Please provide the following 3 arguments: X A P\n
+W: optional, the number of worker processes sharing port X, one per core spreads the clients over every core
+""")
+    else:
+        print ("Starting server")
+        if len(sys.argv) == 5 and int(sys.argv[4]) > 1:
+            server = RxPServerPool(start_worker, "127.0.0.1", int(sys.argv[1]), args=(logging.INFO, os.urandom(32)), processes=int(sys.argv[4]))
+        else:
+            server = Server( sys.argv[1], sys.argv[2], sys.argv[3], logging.INFO, tickets=RxPTicketIssuer())
+        server.start()
+        ALIVE = True
+        while ALIVE:
+            user_input = input("What is your wish (command) ?")
+            user_input = user_input.lower()
+            if user_input == 'terminate':
+                server.stop()
+                ALIVE = False
+                print ("Server End - Goodbye")
+            elif 'window' in user_input:
+                window_size = user_input.split(' ',2)[1]
+                try:
+                    window_size = int(window_size)
+                    #conn.set_window_size(window_size)
+                except ValueError:
+                    print ("ERROR window size is not an integer")
     
-    print ("Server ended")
+        print ("Server ended")
 
 
@@ -0,0 +1,78 @@
+import time
+from collections import OrderedDict
+
+'''
+Handshakes a server answered with a SYN/ACK that the client did not finish yet
+Each is a small tuple kept until the final ACK, the connection is only built once it arrives.
+The table holds at most limit of them and forgets each after timeout seconds, the oldest make
+room for new ones, so a flood of SYNs or clients that never send the final ACK cost bounded
+memory and never slow down the clients that do. on_evict(key, entry) is called for every
+handshake forgotten without being popped
+'''
+class RxPHalfOpenTable:
+    def __init__(self, limit=1024, timeout=10.0, on_evict=None):
+        if limit < 1:
+            raise ValueError("Half open limit must be at least 1: %s" % limit)
+        self.limit = limit
+        self.timeout = timeout
+        self.on_evict = on_evict
+        # key -> (expiry, entry), oldest first
+        self.entries = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    """Add the handshake of key, evicting the oldest one when the table is full"""
+    def add(self, key, entry):
+        now = time.monotonic()
+        self.expire(now)
+        self.entries.pop(key, None)
+        while len(self.entries) >= self.limit:
+            self.__evict(*self.entries.popitem(last=False))
+        self.entries[key] = (now + self.timeout, entry)
+
+    """The entry of key, None when there is none or it expired"""
+    def get(self, key):
+        item = self.entries.get(key)
+        if item is None:
+            return None
+        if item[0] <= time.monotonic():
+            del self.entries[key]
+            self.__evict(key, item)
+            return None
+        return item[1]
+
+    """Remove the handshake of key once it completed, returns its entry or None"""
+    def pop(self, key):
+        entry = self.get(key)
+        if entry is not None:
+            del self.entries[key]
+        return entry
+
+    """Forget the handshakes that timed out, returns how many"""
+    def expire(self, now=None):
+        now = time.monotonic() if now is None else now
+        expired = 0
+        while self.entries:
+            key, item = next(iter(self.entries.items()))
+            if item[0] > now:
+                break
+            del self.entries[key]
+            self.__evict(key, item)
+            expired += 1
+        return expired
+
+    """Seconds until the oldest handshake times out, None when there are none"""
+    def next_expiry(self):
+        if not self.entries:
+            return None
+        return max(0.0, next(iter(self.entries.values()))[0] - time.monotonic())
+
+    def __evict(self, key, item):
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, item[1])
@@ -0,0 +1,135 @@
+import logging
+import struct
+import sys
+import time
+from threading import Lock
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# every RxP logger sits below this one, the only one with a handler
+ROOT_LOGGER = "RxP"
+
+_configure_lock = Lock()
+_handler = None
+
+
+'''
+Writes to the stream it was given, or to whatever sys.stderr is when a record is written
+so replacing sys.stderr, as test runners do, does not leave the handler writing to a closed file
+'''
+class RxPStreamHandler(logging.StreamHandler):
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self._stream = stream
+
+    @property
+    def stream(self):
+        return self._stream if self._stream is not None else sys.stderr
+
+    @stream.setter
+    def stream(self, stream):
+        self._stream = stream
+
+
+'''
+Attach the one handler every RxP logger writes through, the first call wins and later calls
+only change the format or the level of the handler when they are given
+Handlers belong to the process, not to each socket or connection, so the number of handlers
+stays at one however many connections come and go
+'''
+def configure_logging(level=None, stream=None, format=None):
+    global _handler
+    with _configure_lock:
+        root = logging.getLogger(ROOT_LOGGER)
+        if _handler is None:
+            _handler = RxPStreamHandler(stream)
+            _handler.setFormatter(logging.Formatter(LOG_FORMAT))
+            root.addHandler(_handler)
+            root.propagate = False
+            # the level of each RxP object is checked by its RxPLogger, this one lets everything through
+            root.setLevel(logging.DEBUG)
+        if stream is not None:
+            _handler.setStream(stream)
+        if format is not None:
+            _handler.setFormatter(logging.Formatter(format))
+        if level is not None:
+            _handler.setLevel(level)
+    return _handler
+
+
+'''
+A logger with a level of its own, so two sockets of a process can log at different levels
+through the shared loggers. debug and info check the level before anything is formatted,
+arguments are only formatted by the handler of a record that is written:
+
+    self.logger.debug("Received packet %s", packet)
+
+Anything costly to compute for a message belongs behind isEnabledFor(logging.DEBUG)
+'''
+class RxPLogger(logging.LoggerAdapter):
+    def __init__(self, logger, level=logging.DEBUG, prefix=None):
+        super().__init__(logger, {})
+        self.level = level
+        self.prefix = prefix
+
+    def setLevel(self, level):
+        self.level = level
+
+    def isEnabledFor(self, level):
+        return level >= self.level and self.logger.isEnabledFor(level)
+
+    def process(self, msg, kwargs):
+        if self.prefix is not None:
+            msg = "%s: %s" % (self.prefix, msg)
+        return msg, kwargs
+
+
+"""The logger of an RxP class, prefix tells apart the objects of a class sharing it, like connections"""
+def get_logger(name, level=logging.DEBUG, prefix=None):
+    configure_logging()
+    return RxPLogger(logging.getLogger("%s.%s" % (ROOT_LOGGER, name)), level, prefix)
+
+
+'''
+The last packets a communicator sent and received, kept in binary in a fixed buffer
+Recording a packet is one struct.pack_into, nothing is formatted until the trace is dumped,
+which makes it cheap enough to leave on where debug logging is not
+
+    rxp.communicator.enable_trace(4096)
+    ...
+    rxp.communicator.trace.dump(sys.stderr)
+'''
+class RxPPacketTrace:
+    SENT = 0
+    RECEIVED = 1
+    # time, direction, flags, sequence, ack, window, data length, peer port
+    RECORD = struct.Struct('!dBBIIHHH')
+
+    def __init__(self, capacity=4096):
+        if capacity < 1:
+            raise ValueError("Trace capacity must be at least 1: %s" % capacity)
+        self.capacity = capacity
+        self.buffer = bytearray(self.RECORD.size * capacity)
+        # records written so far, the next one goes to slot recorded % capacity
+        self.recorded = 0
+
+    def record(self, direction, packet):
+        slot = self.recorded % self.capacity
+        self.recorded += 1
+        self.RECORD.pack_into(self.buffer, slot * self.RECORD.size, time.time(), direction, packet.flags,
+            (packet.sequence or 0) & 0xFFFFFFFF, (packet.ack or 0) & 0xFFFFFFFF, min(packet.window or 0, 0xFFFF),
+            min(len(packet.data) if packet.data else 0, 0xFFFF), (packet.destport if direction == self.SENT else packet.sourceport) or 0)
+
+    """The records still held, oldest first, as tuples in the order of RECORD"""
+    def records(self):
+        count = min(self.recorded, self.capacity)
+        first = self.recorded - count
+        return [self.RECORD.unpack_from(self.buffer, ((first + index) % self.capacity) * self.RECORD.size) for index in range(count)]
+
+    """Write the records held as text, one line per packet"""
+    def dump(self, output):
+        for timestamp, direction, flags, sequence, ack, window, length, port in self.records():
+            output.write("%.6f %s port %s flags 0x%02x seq %s ack %s window %s len %s\n" % (
+                timestamp, 'out' if direction == self.SENT else 'in', port, flags, sequence, ack, window, length))
+
+    def clear(self):
+        self.recorded = 0
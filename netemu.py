@@ -0,0 +1,174 @@
+import argparse
+import heapq
+import itertools
+import logging
+import random
+import select
+import socket
+import time
+from collections import deque
+from threading import Thread
+from logs import get_logger
+
+'''
+NetEmu, a UDP relay that sits between an RxP client and server and impairs the traffic.
+Like the NetEmu the client and server expect, a datagram from port P goes to port P + 1 when P is even
+and to port P - 1 when P is odd on the host it came from, so a client bound to X talks to a server on X + 1
+by sending to the emulator.
+
+Every datagram can be lost, duplicated, corrupted, held back so later ones overtake it,
+delayed with jitter and queued behind a bandwidth limit. All decisions come from one seeded
+random generator, the same seed and the same traffic give the same impairments.
+
+    python netemu.py 5000 --loss 0.05 --reorder 0.01 --delay 20 --jitter 5 --bandwidth 10000 --seed 1
+'''
+class RxPNetEmu(Thread):
+    def __init__(self, ip, port, loss=0.0, duplicate=0.0, reorder=0.0, corrupt=0.0, delay=0.0, jitter=0.0,
+                 bandwidth=None, queue_limit=None, reorder_gap=0.01, seed=None, loglevel=logging.INFO):
+        super().__init__(name="RxPNetEmu %s:%s" % (ip, port))
+        self.daemon = True
+        self.logger = get_logger("NetEmu", loglevel)
+        for name, probability in (('loss', loss), ('duplicate', duplicate), ('reorder', reorder), ('corrupt', corrupt)):
+            if not 0.0 <= probability <= 1.0:
+                raise ValueError("%s probability must be between 0 and 1: %s" % (name, probability))
+        # probabilities of each impairment per datagram
+        self.loss = loss
+        self.duplicate = duplicate
+        self.reorder = reorder
+        self.corrupt = corrupt
+        # one way delay and the most it varies by, in seconds
+        self.delay = delay
+        self.jitter = jitter
+        # bytes per second leaving the emulator, None for no limit
+        self.bandwidth = bandwidth
+        # most bytes waiting for the link before datagrams are dropped, None for no limit
+        self.queue_limit = queue_limit
+        # how long a reordered datagram is held on top of its delay
+        self.reorder_gap = reorder_gap
+        self.random = random.Random(seed)
+        # datagrams on their way, (departure time, counter, datagram, address) ordered by departure
+        self.in_flight = []
+        self.counter = itertools.count()
+        # when the link finishes sending what is queued so far, and the bytes queued
+        self.link_free_at = 0.0
+        self.queued = deque()
+        self.queued_bytes = 0
+        self.stats = {'received': 0, 'forwarded': 0, 'lost': 0, 'duplicated': 0, 'reordered': 0, 'corrupted': 0, 'queue_dropped': 0}
+        self.running = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((ip, port))
+        self.ip, self.port = self.sock.getsockname()
+
+    """Where a datagram from an address is relayed to, the paired port on the same host"""
+    def destination_for(self, address):
+        ip, port = address[0], address[1]
+        return (ip, port + 1) if port % 2 == 0 else (ip, port - 1)
+
+    """
+    Decide what happens to a datagram arriving at now
+    Returns the copies to send as (departure time, datagram), an empty list when it is dropped
+    """
+    def impair(self, datagram, now):
+        self.stats['received'] += 1
+        if self.random.random() < self.loss:
+            self.stats['lost'] += 1
+            return []
+        copies = 2 if self.random.random() < self.duplicate else 1
+        if copies == 2:
+            self.stats['duplicated'] += 1
+        departures = []
+        for copy in range(copies):
+            data = datagram
+            if self.random.random() < self.corrupt and data:
+                data = bytearray(data)
+                index = self.random.randrange(len(data))
+                data[index] ^= 1 << self.random.randrange(8)
+                data = bytes(data)
+                self.stats['corrupted'] += 1
+            departure = self.__transmit(len(data), now)
+            if departure is None:
+                self.stats['queue_dropped'] += 1
+                continue
+            departure += self.delay
+            if self.jitter:
+                departure += self.random.uniform(-self.jitter, self.jitter)
+            if self.random.random() < self.reorder:
+                departure += self.reorder_gap
+                self.stats['reordered'] += 1
+            departures.append((max(departure, now), data))
+        return departures
+
+    """When a datagram of size bytes finishes crossing the link, None when the queue is full"""
+    def __transmit(self, size, now):
+        if self.bandwidth is None:
+            return now
+        # forget datagrams the link finished with
+        while self.queued and self.queued[0][0] <= now:
+            self.queued_bytes -= self.queued.popleft()[1]
+        if self.queue_limit is not None and self.queued_bytes + size > self.queue_limit:
+            return None
+        self.link_free_at = max(self.link_free_at, now) + size / self.bandwidth
+        self.queued.append((self.link_free_at, size))
+        self.queued_bytes += size
+        return self.link_free_at
+
+    def run(self):
+        self.logger.info("NetEmu relaying on %s:%s", self.ip, self.port)
+        while self.running:
+            timeout = max(0.0, self.in_flight[0][0] - time.monotonic()) if self.in_flight else 0.1
+            readable, writable, errors = select.select([self.sock], [], [], min(timeout, 0.1))
+            if readable:
+                try:
+                    datagram, address = self.sock.recvfrom(65535)
+                except OSError:
+                    if not self.running:
+                        break
+                    continue
+                now = time.monotonic()
+                destination = self.destination_for(address)
+                for departure, data in self.impair(datagram, now):
+                    heapq.heappush(self.in_flight, (departure, next(self.counter), data, destination))
+            now = time.monotonic()
+            while self.in_flight and self.in_flight[0][0] <= now:
+                departure, count, data, destination = heapq.heappop(self.in_flight)
+                try:
+                    self.sock.sendto(data, destination)
+                    self.stats['forwarded'] += 1
+                except OSError as e:
+                    self.logger.debug("Could not relay to %s:%s: %s", destination[0], destination[1], e)
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join()
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="UDP relay impairing RxP traffic between paired ports")
+    parser.add_argument('port', type=int, help="UDP port the emulator listens on")
+    parser.add_argument('--ip', default="127.0.0.1")
+    parser.add_argument('--loss', type=float, default=0.0, help="probability a datagram is lost")
+    parser.add_argument('--duplicate', type=float, default=0.0, help="probability a datagram is sent twice")
+    parser.add_argument('--reorder', type=float, default=0.0, help="probability a datagram is held back behind later ones")
+    parser.add_argument('--corrupt', type=float, default=0.0, help="probability a bit of a datagram is flipped")
+    parser.add_argument('--delay', type=float, default=0.0, help="one way delay in milliseconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="most the delay varies by in milliseconds")
+    parser.add_argument('--bandwidth', type=float, help="link speed in kilobytes per second")
+    parser.add_argument('--queue', type=int, help="most bytes queued for the link")
+    parser.add_argument('--seed', type=int, help="seed for reproducible impairments")
+    args = parser.parse_args(argv)
+    emulator = RxPNetEmu(args.ip, args.port, args.loss, args.duplicate, args.reorder, args.corrupt,
+        args.delay / 1000.0, args.jitter / 1000.0, args.bandwidth * 1000.0 if args.bandwidth else None, args.queue, seed=args.seed)
+    emulator.start()
+    try:
+        while emulator.is_alive():
+            emulator.join(1)
+    except KeyboardInterrupt:
+        pass
+    emulator.stop()
+    print(emulator.stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,36 @@
 from enum import Enum, unique
-import pickle
-import hashlib
+import struct
+from checksum import DEFAULT_CHECKSUM
 
 '''
-Class representing the different FLAGS that can be set on a FLAG
+The FLAGS that can be set on a packet, each is its bit in the flags field of the wire header
+A packet's flags are one int, combined with | and tested with &:
+
+    if packet.flags & RxPFlags.ACK:
+
+Plain ints rather than an IntFlag, whose operators cost a microsecond each on the packet path
 '''
-@unique
-class RxPFlags(Enum):
-    SYN = 'SYN'
-    ACK = 'ACK'
-    NACK = 'NACK'
-    FIN = 'FIN'
-    DATA = 'DATA'
+class RxPFlags:
+    SYN = 0x01
+    ACK = 0x02
+    NACK = 0x04
+    FIN = 0x08
+    DATA = 0x10
+    '''Sender asks for the DATA packet to be acknowledged without delay'''
+    PSH = 0x20
+
+    '''Names of the flags set in flags, for printing'''
+    @staticmethod
+    def names(flags):
+        return [name for name in ('SYN', 'ACK', 'NACK', 'FIN', 'DATA', 'PSH') if flags & getattr(RxPFlags, name)]
+
+    '''The bitmask of an iterable of flags'''
+    @staticmethod
+    def combine(flags):
+        bits = 0
+        for flag in flags:
+            bits |= flag
+        return bits
 
 '''
 Class representing the different states that the packet can be in
@@ -22,11 +41,71 @@ class RxPPacketState(Enum):
     SENT_WAITING_FOR_ACK = 2
     RECEIVED_ACK = 3
 
+'''
+Options carried in the data of SYN packets as type(1) length(1) value records
+'''
+@unique
+class RxPOption(Enum):
+    '''SYN: checksum algorithm IDs the sender accepts in order of preference, SYN/ACK: the chosen one'''
+    CHECKSUM = 1
+    '''
+    SYN: the number of bytes of application data after the options, always the last option
+    SYN/ACK: empty, the server took the data of the SYN
+    '''
+    FAST_OPEN = 2
+    '''
+    FIN of a server: a resumption ticket for the client to keep
+    SYN: the ticket of an earlier connection, SYN/ACK: empty, the server resumed from it
+    '''
+    TICKET = 3
+    '''
+    SYN: empty, the sender takes packets of opened streams, see RxPStream
+    SYN/ACK: empty, so does the server and both sides may open streams
+    '''
+    STREAMS = 4
+
+'''
+Raised when bytes received off the wire are not a packet we understand
+'''
+class RxPacketFormatException(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return repr(self.value)
+
 
 class RxPacket:
-    def __init__(self, flags, sequence, ack=None, data=None, sourceip=None, destinationip=None, sourceport=None, destport=None, checksum=None):
-        '''List of packet flags, describing the type of packet'''
-        self.flags = flags
+    __slots__ = ('flags', 'sequence', 'ack', 'data', 'sourceip', 'destinationip', 'sourceport', 'destport',
+                 'checksum', 'window', 'stream', 'offset', 'state', 'sent_time', 'transmissions')
+    '''Version of the wire format, first byte of every datagram'''
+    VERSION = 1
+    '''
+    Fixed header layout (network byte order):
+    version(1) flags(1) sequence(4) ack(4) sourceport(2) destport(2) window(2) length(2) checksum(4)
+    '''
+    HEADER_FORMAT = struct.Struct('!BBIIHHHHI')
+    HEADER_SIZE = HEADER_FORMAT.size
+    '''Offset of the checksum inside the header'''
+    CHECKSUM_OFFSET = HEADER_SIZE - 4
+    '''
+    Packets of an opened stream have a longer header, the stream and the offset of the data in it.
+    A DATA packet names the stream its data belongs to, an ACK the stream whose receive window
+    ends at offset. Packets of the connection's own stream 0 keep the shorter header:
+    version(1) flags(1) sequence(4) ack(4) sourceport(2) destport(2) window(2) length(2) stream(2) offset(8) checksum(4)
+    '''
+    STREAM_VERSION = 2
+    STREAM_HEADER_FORMAT = struct.Struct('!BBIIHHHHHQI')
+    STREAM_HEADER_SIZE = STREAM_HEADER_FORMAT.size
+    STREAM_CHECKSUM_OFFSET = STREAM_HEADER_SIZE - 4
+    '''A SACK block in the data of an ACK packet, first and last sequence received (inclusive)'''
+    SACK_BLOCK_FORMAT = struct.Struct('!II')
+    # most SACK blocks an ACK carries, any more are ignored
+    MAX_SACK_BLOCKS = 16
+    
+
+    def __init__(self, flags, sequence, ack=None, data=None, sourceip=None, destinationip=None, sourceport=None, destport=None, checksum=None, window=0, stream=0, offset=0):
+        '''Bitmask of RxPFlags describing the type of packet, an iterable of flags is combined into one'''
+        self.flags = flags if flags.__class__ is int else RxPFlags.combine(flags)
         '''Sequence Numbers'''
         self.sequence = sequence
         '''Acknowledgement Number'''
@@ -43,48 +122,228 @@ class RxPacket:
         self.destport = destport
         '''Checksum'''
         self.checksum = checksum
+        '''Window advertised by the sender of this packet'''
+        self.window = window
+        '''The stream the packet belongs to, 0 for the connection's own'''
+        self.stream = stream
+        '''Offset of the data in its stream, for an ACK the end of the stream's receive window'''
+        self.offset = offset
         '''Current state packet is in'''
         self.state = RxPPacketState.NOT_SENT
-        '''The time this packet was sent'''
+        '''The time this packet was sent (time.monotonic)'''
         self.sent_time = None
+        '''How many times this packet has been sent'''
+        self.transmissions = 0
         
     
     """String representation of this packet"""
     def __str__(self):
-        return "flags: %s, sequence %s, ack %s, sourceip:port: %s:%s, destinationip:port: %s:%s" % (self.flags,self.sequence, self.ack, self.sourceip, self.sourceport, self.destinationip, self.destport)
+        text = "flags: %s, sequence %s, ack %s, sourceip:port: %s:%s, destinationip:port: %s:%s" % ("|".join(RxPFlags.names(self.flags)), self.sequence, self.ack, self.sourceip, self.sourceport, self.destinationip, self.destport)
+        if self.stream:
+            text += ", stream %s offset %s" % (self.stream, self.offset)
+        return text
+    
+    '''Size of the header the packet is sent with'''
+    @staticmethod
+    def header_size(packet):
+        return RxPacket.STREAM_HEADER_SIZE if packet.stream else RxPacket.HEADER_SIZE
             
-    '''Serialize packet to bytes'''
+    '''
+    Serialize packet to bytes
+    When a checksum algorithm is given the checksum is calculated and stored in the packet,
+    otherwise the packet's checksum is written as is
+    '''
     @staticmethod
-    def serialize(packet):
-        return pickle.dumps(packet)
+    def serialize(packet, algorithm=None):
+        return bytes(RxPacket.serialize_header(packet, algorithm)) + (packet.data or b'')
     
-    '''deserialize from bytes to object'''
+    '''
+    Serialize only the header, the data follows it on the wire as is
+    so it can be sent straight from the caller's buffer with a scatter/gather write
+    '''
     @staticmethod
-    def deserialize(packet):
-        return pickle.loads(packet)
+    def serialize_header(packet, algorithm=None):
+        header = RxPacket.__pack_header(packet)
+        checksum_offset = RxPacket.STREAM_CHECKSUM_OFFSET if packet.stream else RxPacket.CHECKSUM_OFFSET
+        if algorithm is not None:
+            packet.checksum = algorithm.compute(header[:checksum_offset], packet.data)
+        struct.pack_into('!I', header, checksum_offset, packet.checksum or 0)
+        return header
     
-    # Calculate checksum
-    @staticmethod
-    def calculate_checksum(packet):
-        m = hashlib.md5()
-        # add all the flags to the checksum
-        for flag in packet.flags:
-            m.update(flag.name.encode('utf-8'))
-        if packet.sequence:
-            m.update(str(packet.sequence).encode('utf-8'))
-        if packet.ack:
-            m.update(str(packet.ack).encode('utf-8'))
-        if packet.data:
-            m.update(packet.data)
-        if packet.sourceip:
-            m.update(packet.sourceip.encode('utf-8'))
-        if packet.sourceport:
-            m.update(str(packet.sourceport).encode('utf-8'))
-        if packet.destinationip:
-            m.update(packet.destinationip.encode('utf-8'))
-        if packet.destport:
-            m.update(str(packet.destport).encode('utf-8'))
-        return m.digest()
-        
-        
-        
+    '''
+    deserialize from bytes to object
+    The data of the returned packet is a memoryview into the passed in buffer, no bytes are copied
+    The packet comes from pool, whoever is done with it last can release it back
+    '''
+    @staticmethod
+    def deserialize(packet, pool=None):
+        view = memoryview(packet)
+        if len(view) < RxPacket.HEADER_SIZE:
+            raise RxPacketFormatException("Datagram of %s bytes is shorter than the header" % len(view))
+        stream = offset = 0
+        if view[0] == RxPacket.VERSION:
+            version, flags, sequence, ack, sourceport, destport, window, length, checksum = RxPacket.HEADER_FORMAT.unpack_from(view)
+            header_size = RxPacket.HEADER_SIZE
+        elif view[0] == RxPacket.STREAM_VERSION:
+            if len(view) < RxPacket.STREAM_HEADER_SIZE:
+                raise RxPacketFormatException("Datagram of %s bytes is shorter than the stream header" % len(view))
+            version, flags, sequence, ack, sourceport, destport, window, length, stream, offset, checksum = RxPacket.STREAM_HEADER_FORMAT.unpack_from(view)
+            if stream == 0:
+                raise RxPacketFormatException("Stream header for stream 0")
+            header_size = RxPacket.STREAM_HEADER_SIZE
+        else:
+            raise RxPacketFormatException("Unsupported packet format version: %s" % view[0])
+        if len(view) < header_size + length:
+            raise RxPacketFormatException("Datagram truncated, expected %s bytes of data" % length)
+        data = view[header_size:header_size + length] if length else None
+        if pool is None:
+            pool = PACKET_POOL
+        return pool.acquire(flags, sequence, ack, data, None, None, sourceport, destport, checksum, window, stream, offset)
+    
+    '''Check a received datagram against its checksum in one pass over the bytes it arrived in'''
+    @staticmethod
+    def verify_checksum(datagram, packet, algorithm=DEFAULT_CHECKSUM):
+        header = memoryview(datagram)[:RxPacket.STREAM_CHECKSUM_OFFSET if packet.stream else RxPacket.CHECKSUM_OFFSET]
+        return packet.checksum == algorithm.compute(header, packet.data)
+    
+    # Calculate checksum over the serialized header (without the checksum) and the data
+    @staticmethod
+    def calculate_checksum(packet, algorithm=DEFAULT_CHECKSUM):
+        header = RxPacket.__pack_header(packet)
+        return algorithm.compute(header[:RxPacket.STREAM_CHECKSUM_OFFSET if packet.stream else RxPacket.CHECKSUM_OFFSET], packet.data)
+    
+    '''Pack the options for a SYN or SYN/ACK, options is a dict of RxPOption to bytes'''
+    @staticmethod
+    def pack_options(options):
+        data = bytearray()
+        for option, value in options.items():
+            data.append(option.value)
+            data.append(len(value))
+            data.extend(value)
+        return bytes(data)
+    
+    '''Unpack SYN options, options we do not know about are skipped'''
+    @staticmethod
+    def unpack_options(data):
+        options = {}
+        if not data:
+            return options
+        data = bytes(data)
+        index = 0
+        while index + 2 <= len(data):
+            option_type, length = data[index], data[index+1]
+            value = data[index+2:index+2+length]
+            index += 2 + length
+            try:
+                options[RxPOption(option_type)] = value
+            except ValueError:
+                pass
+            if option_type == RxPOption.FAST_OPEN.value:
+                # what follows is application data
+                break
+        return options
+    
+    '''Options followed by the application data a SYN carries with fast open'''
+    @staticmethod
+    def pack_fast_open(options, data):
+        options = dict(options)
+        options[RxPOption.FAST_OPEN] = len(data).to_bytes(2, 'big')
+        return RxPacket.pack_options(options) + bytes(data)
+    
+    '''The application data after the options of a SYN, None when it carries none'''
+    @staticmethod
+    def unpack_fast_open(data):
+        length = RxPacket.unpack_options(data).get(RxPOption.FAST_OPEN)
+        if length is None or len(length) != 2:
+            return None
+        length = int.from_bytes(length, 'big')
+        if length == 0 or length > len(data):
+            return None
+        return bytes(data[len(data) - length:])
+    
+    '''Pack SACK blocks, a list of (first, last) sequence ranges, for the data of an ACK packet'''
+    @staticmethod
+    def pack_sack(blocks):
+        data = bytearray(RxPacket.SACK_BLOCK_FORMAT.size * len(blocks))
+        for index, (first, last) in enumerate(blocks):
+            RxPacket.SACK_BLOCK_FORMAT.pack_into(data, index * RxPacket.SACK_BLOCK_FORMAT.size, first, last)
+        return bytes(data)
+    
+    '''Unpack the SACK blocks carried in the data of an ACK packet, at most MAX_SACK_BLOCKS of them'''
+    @staticmethod
+    def unpack_sack(data):
+        if not data:
+            return []
+        length = min(len(data) - len(data) % RxPacket.SACK_BLOCK_FORMAT.size, RxPacket.MAX_SACK_BLOCKS * RxPacket.SACK_BLOCK_FORMAT.size)
+        return list(RxPacket.SACK_BLOCK_FORMAT.iter_unpack(memoryview(data)[:length]))
+
+    '''
+    The sequence numbers among sequences that SACK blocks cover
+    Only the sequences we have are looked at, the blocks come from the peer and can span anything
+    '''
+    @staticmethod
+    def sacked(sequences, blocks):
+        if not blocks:
+            return []
+        return [sequence for sequence in sequences if any(first <= sequence <= last for first, last in blocks)]
+    
+    '''Header of the packet with a zero checksum'''
+    @staticmethod
+    def __pack_header(packet):
+        if packet.stream:
+            header = bytearray(RxPacket.STREAM_HEADER_SIZE)
+            RxPacket.STREAM_HEADER_FORMAT.pack_into(header, 0,
+                RxPacket.STREAM_VERSION,
+                packet.flags,
+                (packet.sequence or 0) & 0xFFFFFFFF,
+                (packet.ack or 0) & 0xFFFFFFFF,
+                packet.sourceport or 0,
+                packet.destport or 0,
+                packet.window or 0,
+                len(packet.data) if packet.data else 0,
+                packet.stream,
+                packet.offset or 0,
+                0)
+            return header
+        header = bytearray(RxPacket.HEADER_SIZE)
+        RxPacket.HEADER_FORMAT.pack_into(header, 0,
+            RxPacket.VERSION,
+            packet.flags,
+            (packet.sequence or 0) & 0xFFFFFFFF,
+            (packet.ack or 0) & 0xFFFFFFFF,
+            packet.sourceport or 0,
+            packet.destport or 0,
+            packet.window or 0,
+            len(packet.data) if packet.data else 0,
+            0)
+        return header
+
+
+'''
+A free list of packet objects, so the send and receive paths reuse packets instead of allocating
+one per datagram and leaving the garbage collector to find them
+A packet may only be released by whoever holds the last reference to it, it is handed out again
+by the next acquire. Packets that are never released are simply garbage collected
+'''
+class RxPPacketPool:
+    def __init__(self, size=1024):
+        # most packets kept for reuse
+        self.size = size
+        self.free = []
+
+    def acquire(self, flags, sequence, ack=None, data=None, sourceip=None, destinationip=None, sourceport=None, destport=None, checksum=None, window=0, stream=0, offset=0):
+        try:
+            packet = self.free.pop()
+        except IndexError:
+            return RxPacket(flags, sequence, ack, data, sourceip, destinationip, sourceport, destport, checksum, window, stream, offset)
+        packet.__init__(flags, sequence, ack, data, sourceip, destinationip, sourceport, destport, checksum, window, stream, offset)
+        return packet
+
+    def release(self, packet):
+        if packet is not None and len(self.free) < self.size:
+            # the data is the sender's or the receive buffer's, do not keep it alive
+            packet.data = None
+            self.free.append(packet)
+
+# packets received off the wire come from here
+PACKET_POOL = RxPPacketPool()
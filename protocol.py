@@ -1,99 +1,288 @@
 import socket
 import multiprocessing
 import logging
+import queue
 from connection import RxPConnection
 from connection import RxPConnectionState
 from communicator import RxPCommunicator
-from packet import RxPFlags
-from threading import Thread
+from packet import RxPacket, RxPFlags, RxPOption, PACKET_POOL
+from threading import Thread, Lock, current_thread
+from checksum import DEFAULT_CHECKSUM_PREFERENCE
+from congestion import DEFAULT_CONGESTION_CONTROL
+from dispatch import RxPPacketDispatcher, DEFAULT_WORKERS
+from logs import get_logger
+from handshake import RxPHalfOpenTable
 
 class RxP:
-    def __init__(self, loglevel=logging.DEBUG):
-        self.logger = logging.getLogger("RxP")
+    def __init__(self, loglevel=logging.DEBUG, checksums=DEFAULT_CHECKSUM_PREFERENCE, congestion_control=DEFAULT_CONGESTION_CONTROL, workers=DEFAULT_WORKERS, trace=None, fast_open=False, tickets=None, sessions=None):
+        self.logger = get_logger("Socket", loglevel)
         self.loglevel = loglevel
-        # create console handler and set level to debug
-        self.logger.setLevel(loglevel)
-        # create console handler and set level to debug
-        ch = logging.StreamHandler()
-        ch.setLevel(loglevel)
-        # create formatter
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        # add formatter to ch
-        ch.setFormatter(formatter)
-        # add ch to logger
-        self.logger.addHandler(ch)
-        # all the connections that are still waiting to establish
-        self.initiating_connections = {}
+        # congestion control algorithm for new connections
+        self.congestion_control = congestion_control
+        # handshakes waiting for the client's final ACK, keyed by (ip, port), (our sequence, their sequence, session)
+        self.initiating_connections = RxPHalfOpenTable(on_evict=self.__forget_half_open)
+        # the timer that forgets handshakes that timed out, scheduled while there are any
+        self.half_open_sweep = None
+        # connections that completed the handshake and are waiting to be accepted
+        self.accept_queue = queue.Queue()
+        # connect calls waiting for their SYN/ACK, keyed by (ip, port) of the server, (queue, window size, session)
+        self.connecting = {}
+        '''
+        Take the data a client's SYN carries and accept the connection straight away, so the server
+        can answer in the first round trip. The connection exists before the client proved it owns
+        its address, only turn this on where SYNs from forged addresses are not a concern
+        '''
+        self.fast_open = fast_open
+        '''
+        A server with an RxPTicketIssuer hands every client a ticket when the connection closes,
+        a client that presents it in its next SYN starts from the round trip time and congestion
+        window the last connection ended with instead of slow start
+        '''
+        self.tickets = tickets
+        # a client keeps the tickets it was given in this RxPSessionCache, share it between sockets
+        self.sessions = sessions
+        # guards the handshake tables between the reader and the calling threads
+        self.lock = Lock()
         # Initialize underlying implementation socket to UDP socket
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        # Initialize RxP communication class
-        self.communicator = RxPCommunicator(self.sock, loglevel)
+        # Initialize RxP communication class, trace is how many packets to keep a binary record of
+        self.communicator = RxPCommunicator(self.sock, loglevel, checksums, trace)
+        # the one thread reading the socket, started once we are bound
+        self.reader = None
+        # worker threads handling packets of every connection, 0 handles them on the reader,
+        # None gives each connection a thread of its own
+        self.dispatcher = RxPPacketDispatcher(workers) if workers is not None else None
 
     
-    '''Start listening for incoming packets'''
-    def listen(self, ip, port):
-        self.ip = ip
-        self.port = port
-        self.logger.info("Listening @ IP: %s, Port: %s" % (ip,port))
+    '''
+    Start listening for incoming packets
+    With reuse_port several sockets, usually in different processes, bind the same port and the
+    kernel hands each of them the packets of some peers, always the same socket for the same peer
+    '''
+    def listen(self, ip, port, reuse_port=False):
+        if reuse_port:
+            if not hasattr(socket, 'SO_REUSEPORT'):
+                raise ValueError("SO_REUSEPORT is not supported on this platform")
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         self.sock.bind((ip, port))
+        self.ip = ip
+        # the port the socket actually got, port 0 picks a free one
+        self.port = self.sock.getsockname()[1]
+        self.logger.info("Listening @ IP: %s, Port: %s", ip, self.port)
+        self.reader = Thread(target=self.__read_packets, name="RxP reader %s:%s" % (ip, self.port))
+        self.reader.daemon = True
+        self.reader.start()
         
+    
+    '''
+    The only place the socket is read from
+    Packets of established connections go to the connection they belong to by the (ip, port) they came from,
+    everything else is part of a handshake
+    '''
+    def __read_packets(self):
+        while not self.communicator.closed:
+            for packet in self.communicator.receive_packets():
+                key = (packet.sourceip, packet.sourceport)
+                connection = self.communicator.listeners.get(key)
+                if packet.flags & RxPFlags.SYN:
+                    self.__handle_handshake(key, packet, connection)
+                elif connection is not None:
+                    connection.deliver_packet(packet)
+                else:
+                    self.__establish(key, packet)
+    
+    """SYN and SYN/ACK packets"""
+    def __handle_handshake(self, key, packet, connection):
+        if packet.flags & RxPFlags.ACK:
+            waiting = self.connecting.pop(key, None)
+            if waiting is not None:
+                self.__connected(key, packet, *waiting)
+            elif connection is not None:
+                # our ACK of the SYN/ACK was lost, the server is still waiting for it
+                self.communicator.sendACK(self.port, self.ip, packet, connection.advertised_window)
+        elif connection is None:
+            with self.lock:
+                # a repeated SYN is answered by the SYN/ACK retransmission
+                if key in self.initiating_connections:
+                    return
+                data = RxPacket.unpack_fast_open(packet.data) if self.fast_open else None
+                session = self.__redeem(key, packet)
+                # streams are only used with a client that offered them
+                streams = RxPOption.STREAMS in RxPacket.unpack_options(packet.data)
+                sequence = self.communicator.sendCONNECTSYNACK(self.ip, self.port, packet, fast_open=data is not None, resumed=session is not None, streams=streams)
+                if data is None:
+                    # the connection is only made once the client completes the handshake
+                    self.initiating_connections.add(key, (sequence, packet.sequence, session, streams))
+                    self.__schedule_half_open_sweep()
+                    return
+            self.__fast_open(key, packet, sequence, data, session, streams)
+    
+    """The session in the ticket of a SYN, None without one or when it is not good"""
+    def __redeem(self, key, packet):
+        if self.tickets is None:
+            return None
+        ticket = RxPacket.unpack_options(packet.data).get(RxPOption.TICKET)
+        if not ticket:
+            return None
+        session = self.tickets.redeem(key[0], ticket)
+        if session is None:
+            self.logger.debug("Ignoring bad ticket from %s:%s", *key)
+        return session
+    
+    """
+    A connection with a peer, resumed from session when there is one, initiator is the side that connected
+    and streams whether both sides offered streams in the handshake
+    """
+    def __make_connection(self, key, sequence, peer_sequence, session=None, streams=False, initiator=False):
+        connection = RxPConnection("Connection to: %s:%s" % key, self.ip, self.port, key[0], key[1], sequence, peer_sequence, self.communicator, self.loglevel, congestion_control=self.congestion_control, dispatcher=self.dispatcher, initiator=initiator, streams=streams)
+        connection.tickets = self.tickets
+        if self.sessions is not None:
+            connection.on_ticket = self.__store_ticket
+        if session is not None:
+            connection.resume(session)
+            self.communicator.stats.add('sessions_resumed')
+        return connection
+    
+    """Keep the ticket the server gave us with what we learned about the path ourselves"""
+    def __store_ticket(self, connection, ticket):
+        session = connection.session()
+        session.ticket = ticket
+        self.sessions.put((connection.destinationip, connection.destinationport), session)
+        self.logger.debug("Stored ticket for %s:%s, %s", connection.destinationip, connection.destinationport, session)
+    
+    """
+    A SYN with data and fast open on, the connection is accepted at once and gets the data as the
+    packet after the SYN, the server answers while the SYN/ACK is on its way
+    """
+    def __fast_open(self, key, packet, sequence, data, session=None, streams=False):
+        connection = self.__make_connection(key, sequence, packet.sequence, session, streams)
+        self.communicator.add_listener(key, connection)
+        self.__start_connection(connection)
+        connection.deliver_packet(RxPacket(RxPFlags.DATA | RxPFlags.PSH, packet.sequence + 1, data=data, sourceip=key[0], sourceport=key[1]))
+        self.logger.debug("Fast open connection with %s:%s, %s bytes in the SYN", key[0], key[1], len(data))
+        self.accept_queue.put(connection)
+    
+    """
+    Our SYN was answered, the connection is made here on the reader so packets the server sends
+    right after its SYN/ACK find it. The data of a fast open SYN took the sequence number after it,
+    the session is only resumed when the server took our ticket and resumes its side too
+    """
+    def __connected(self, key, packet, synack, window_size, session):
+        options = RxPacket.unpack_options(packet.data)
+        fast_open = RxPOption.FAST_OPEN in options
+        sequence = packet.ack + 1 if fast_open else packet.ack
+        connection = self.__make_connection(key, sequence, packet.sequence, session if RxPOption.TICKET in options else None, RxPOption.STREAMS in options, initiator=True)
+        connection.set_window_size(window_size)
+        self.communicator.add_listener(key, connection)
+        self.__start_connection(connection)
+        self.communicator.sendACK(self.port, self.ip, packet, connection.advertised_window)
+        synack.put((connection, fast_open))
+    
+    """The SYN/ACK of a handshake that was evicted or timed out is no longer resent"""
+    def __forget_half_open(self, key, entry):
+        self.logger.debug("Forgetting half open connection %s:%s", *key)
+        self.communicator.forget_peer(*key)
+        self.communicator.stats.add('half_open_evictions')
+    
+    def __schedule_half_open_sweep(self):
+        if self.half_open_sweep is None:
+            self.half_open_sweep = self.communicator.timers.schedule(self.initiating_connections.next_expiry(), self.__sweep_half_open)
+    
+    def __sweep_half_open(self):
+        with self.lock:
+            self.half_open_sweep = None
+            self.initiating_connections.expire()
+            if len(self.initiating_connections):
+                self.__schedule_half_open_sweep()
+    
+    """
+    The ACK of our SYN/ACK establishes the connection, so does any packet from the client after it
+    in case that ACK was lost
+    """
+    def __establish(self, key, packet):
+        with self.lock:
+            entry = self.initiating_connections.pop(key)
+        if entry is None:
+            self.logger.debug("Dropping packet for unknown connection %s:%s", *key)
+            PACKET_POOL.release(packet)
+            return
+        connection = self.__make_connection(key, *entry)
+        self.communicator.add_listener(key, connection)
+        self.__start_connection(connection)
+        if packet.flags & (RxPFlags.DATA | RxPFlags.FIN):
+            connection.deliver_packet(packet)
+        else:
+            PACKET_POOL.release(packet)
+        self.logger.debug("Connection established with %s:%s", *key)
+        self.accept_queue.put(connection)
         
         
-    """Accept listens for new connections and hands off a new connection back to the calling server"""
+    """Stats of the socket and of every connection on it, keyed by the peer's ip:port"""
+    def info(self):
+        socket_info = self.communicator.info()
+        socket_info['ip'] = getattr(self, 'ip', None)
+        socket_info['port'] = getattr(self, 'port', None)
+        socket_info['half_open'] = len(self.initiating_connections)
+        socket_info['accept_queue'] = self.accept_queue.qsize()
+        connections = {"%s:%s" % key: connection.info() for key, connection in list(self.communicator.listeners.items())}
+        return {'socket': socket_info, 'connections': connections}
+    
+    """Accept waits for the next new connection and hands it back to the calling server"""
     def accept(self):
-        '''Read all the packets and determine whether a new connection is to be established'''
-        while True:
-            self.logger.debug("Accept - waiting for packet to arrive")
-            # wait for a packet to arrive
-            packet = self.communicator.receive_packet()
-            self.logger.debug("Accept: Got packet: %s " % packet)
-            if packet:
-                connection_key = packet.sourceip+":"+str(packet.sourceport)
-                ''' Client request to connect '''
-                self.logger.debug("Initiating Connections: %s" % (self.initiating_connections.keys()))
-                if RxPFlags.SYN in packet.flags:
-                    # add client to possible connections list
-                    self.initiating_connections[connection_key] = RxPConnection("Connection to: "+connection_key,self.ip, self.port, packet.sourceip, packet.sourceport, 0, None, self.communicator, self.loglevel)
-                    self.communicator.sendCONNECTSYNACK(self.ip, self.port, packet)
-                elif connection_key in self.initiating_connections and RxPFlags.ACK in packet.flags:
-                    """
-                    Check if an incoming ACK's is for connection establishment
-                    if it is then we will break and return an established connection
-                    """
-                    connection = self.initiating_connections[packet.sourceip+":"+str(packet.sourceport)]
-                    # start the connection process
-                    connection.start()
-                    # remove from the list of connections waiting to be established
-                    del self.initiating_connections[connection_key]
-                    # break out of loop and return connection
-                    self.logger.debug("End Accept Returning Connection to Server")
-                    return connection
-    
-    
-    
-    """Clients will use this method to connect to a remote destination"""                
-    def connect(self, sourceip, sourceport, destinationip, destport, window_size=1):
+        self.logger.debug("Accept - waiting for a connection")
+        connection = self.accept_queue.get()
+        self.logger.debug("End Accept Returning Connection to Server")
+        return connection
+    
+    
+    
+    """
+    Clients will use this method to connect to a remote destination
+    data is sent as soon as the connection is up, with fast open its first segment rides in the SYN
+    and reaches a server that takes it one round trip earlier. With a session cache the SYN carries
+    the ticket of the last connection to the server
+    """
+    def connect(self, sourceip, sourceport, destinationip, destport, window_size=64, data=None):
+        # packets are matched to connections by the address they come from
+        destinationip = socket.gethostbyname(destinationip)
+        key = (destinationip, destport)
+        synack = queue.Queue()
+        session = self.sessions.get(key) if self.sessions is not None else None
+        ticket = session.ticket if session is not None else None
+        self.connecting[key] = (synack, window_size, session)
         self.listen(sourceip, sourceport)
-        '''To initiate a connection we must send a SYN packet'''
-        self.communicator.sendCONNECTSYN(sourceip, sourceport, destinationip, destport)
-        while True:
-           self.logger.debug("Connection Init Starting to recieve packet")
-           # wait for a packet to arrive
-           packet = self.communicator.receive_packet()
-           '''Check if its an ACK packet sent to our correct destination'''
-           if packet.destinationip == sourceip and packet.destport == sourceport and RxPFlags.ACK in packet.flags:
-               # Send acknowledgement to the client
-               self.communicator.sendACK(sourceport, sourceip, packet)
-               connection_key = packet.sourceip+":"+str(packet.sourceport)
-               # set the connection to established and return
-               connection = RxPConnection("Connection to: "+connection_key,sourceip, sourceport, packet.sourceip, packet.sourceport, 0, None, self.communicator, self.loglevel)
-               # start the connection process
-               connection.start()
-               connection.window_size = window_size
-               return connection
-               
-               
+        first = bytes(data[:self.communicator.fast_open_size(ticket)]) if data else None
+        # To initiate a connection we must send a SYN packet
+        self.communicator.sendCONNECTSYN(sourceip, self.port, destinationip, destport, first, ticket)
+        self.logger.debug("Connection Init waiting for SYN/ACK")
+        connection, fast_open = synack.get()
+        if data:
+            # a server that did not take the data of the SYN gets it again as normal data
+            remaining = memoryview(data)[len(first):] if fast_open else data
+            if len(remaining):
+                connection.write(remaining)
+        return connection
     
+    """
+    Close the socket, connections still on it are dropped without telling the other side,
+    close them first for that. The reader, the dispatcher's workers and the timers stop
+    """
+    def close(self):
+        if self.communicator.closed:
+            return
+        self.communicator.close()
+        for connection in list(self.communicator.listeners.values()):
+            connection.destroy()
+        if self.reader is not None and self.reader is not current_thread():
+            self.reader.join()
+        if self.dispatcher is not None:
+            self.dispatcher.close()
+        self.sock.close()
+        self.logger.debug("Closed socket")
 
-                
-        
\ No newline at end of file
+    """Connections without a dispatcher run in a thread of their own"""
+    def __start_connection(self, connection):
+        if self.dispatcher is not None:
+            connection.establish()
+        else:
+            connection.start()
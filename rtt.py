@@ -0,0 +1,59 @@
+'''
+Round trip time estimation and retransmission timeout calculation
+following Jacobson/Karels as specified in RFC 6298
+'''
+class RxPRTTEstimator:
+    ALPHA = 1.0 / 8
+    BETA = 1.0 / 4
+    K = 4
+
+    def __init__(self, initial_rto=1.0, min_rto=0.02, max_rto=60.0, granularity=0.001):
+        # smoothed round trip time, None until the first sample
+        self.srtt = None
+        # round trip time variation
+        self.rttvar = None
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.granularity = granularity
+        # retransmission timeout in seconds
+        self.rto = initial_rto
+        # how many times in a row the timer has been backed off
+        self.backoffs = 0
+
+    """
+    Add a round trip time measurement in seconds
+    By Karn's rule only packets that were sent once may be measured
+    """
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.BETA) * self.rttvar + self.BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.ALPHA) * self.srtt + self.ALPHA * rtt
+        self.backoffs = 0
+        self.__update_rto()
+
+    """
+    Start from the estimate of an earlier connection to the same peer
+    A measurement this one already took counts as the first sample after it
+    """
+    def restore(self, srtt, rttvar):
+        measured = self.srtt
+        self.srtt = srtt
+        self.rttvar = rttvar
+        if measured is not None:
+            self.sample(measured)
+        else:
+            self.__update_rto()
+
+    def __update_rto(self):
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + max(self.granularity, self.K * self.rttvar)))
+
+    """The retransmission timer expired, double the timeout"""
+    def backoff(self):
+        self.backoffs += 1
+        self.rto = min(self.max_rto, self.rto * 2)
+
+    def __str__(self):
+        return "srtt: %s, rttvar: %s, rto: %s" % (self.srtt, self.rttvar, self.rto)
@@ -0,0 +1,147 @@
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import socket
+import time
+from threading import Thread, Event, Lock
+from logs import get_logger
+
+'''
+Runs a server in several worker processes sharing one port, so it is not held to the one core
+the GIL leaves a process. Every worker has an RxP socket of its own bound with SO_REUSEPORT,
+the kernel hashes the addresses of a datagram to pick the socket it goes to, so all the packets
+of a connection reach the same worker.
+
+The pool supervises the workers: one that exits is started again, and the stats each worker
+sends every interval seconds add up to those of the whole server
+
+    pool = RxPServerPool(start_worker, "127.0.0.1", 5001, processes=4)
+    pool.start()
+    exporter = RxPStatsExporter([pool], port=9464)
+
+target runs in the worker as target(ip, port, *args), starts serving and returns the RxP socket
+it listens on with reuse_port. The connections of a worker that dies are lost, and while workers
+come and go the kernel may move peers to another socket, which drops their packets as unknown
+'''
+class RxPServerPool(Thread):
+    def __init__(self, target, ip, port, args=(), processes=None, interval=1.0, loglevel=logging.INFO):
+        super().__init__(name="RxPServerPool")
+        self.daemon = True
+        self.logger = get_logger("ServerPool", loglevel)
+        self.target = target
+        self.ip = ip
+        self.port = port if port else self.__free_port(ip)
+        self.args = tuple(args)
+        self.processes = processes or os.cpu_count() or 1
+        if self.processes < 1:
+            raise ValueError("A pool needs at least one process: %s" % self.processes)
+        self.interval = interval
+        # the worker process at each index, replaced when it exits
+        self.workers = [None] * self.processes
+        # the last info each worker sent, keyed by index
+        self.worker_info = {}
+        self.restarts = 0
+        self.stats = multiprocessing.Queue()
+        self.lock = Lock()
+        self.stopped = Event()
+
+    """A port nothing is bound to, for the workers to share when the pool was given port 0"""
+    def __free_port(self, ip):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            probe.bind((ip, 0))
+            return probe.getsockname()[1]
+        finally:
+            probe.close()
+
+    '''
+    Start the workers and wait until each is listening, the kernel picks a socket from the ones
+    bound at the time, a peer arriving while workers still bind could be moved to another one
+    '''
+    def start(self, timeout=10.0):
+        for index in range(self.processes):
+            self.__spawn(index)
+        deadline = time.monotonic() + timeout
+        while len(self.worker_info) < self.processes and time.monotonic() < deadline:
+            try:
+                self.__keep(*self.stats.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                break
+        if len(self.worker_info) < self.processes:
+            self.logger.warning("Only %s of %s workers are listening", len(self.worker_info), self.processes)
+        super().start()
+
+    def __spawn(self, index):
+        process = multiprocessing.Process(target=_run_worker, name="RxP worker %s" % index,
+            args=(index, self.target, self.ip, self.port, self.args, self.stats, self.interval))
+        process.daemon = True
+        process.start()
+        self.workers[index] = process
+        self.logger.info("Started worker %s with pid %s on %s:%s", index, process.pid, self.ip, self.port)
+
+    """Restart workers as soon as they exit and keep the stats they send"""
+    def run(self):
+        while not self.stopped.is_set():
+            multiprocessing.connection.wait([process.sentinel for process in self.workers], self.interval)
+            self.__collect()
+            for index, process in enumerate(self.workers):
+                if process.is_alive() or self.stopped.is_set():
+                    continue
+                self.logger.warning("Worker %s with pid %s exited with %s, restarting it", index, process.pid, process.exitcode)
+                with self.lock:
+                    self.worker_info.pop(index, None)
+                    self.restarts += 1
+                self.__spawn(index)
+
+    def __collect(self):
+        while True:
+            try:
+                self.__keep(*self.stats.get_nowait())
+            except queue.Empty:
+                return
+
+    def __keep(self, index, pid, info):
+        # stats a worker sent just before it died do not belong to its replacement
+        if self.workers[index].pid == pid:
+            with self.lock:
+                self.worker_info[index] = info
+
+    """The stats of every worker added up, in the form RxP.info gives them"""
+    def info(self):
+        with self.lock:
+            infos = [self.worker_info[index] for index in sorted(self.worker_info)]
+            restarts = self.restarts
+        socket_info = {'ip': self.ip, 'port': self.port, 'workers': sum(1 for process in self.workers if process is not None and process.is_alive()),
+            'worker_restarts': restarts}
+        connections = {}
+        for info in infos:
+            for name, value in info['socket'].items():
+                if name in ('ip', 'port'):
+                    continue
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    socket_info[name] = socket_info.get(name, 0) + value
+            # a peer is only ever served by one worker
+            connections.update(info['connections'])
+        return {'socket': socket_info, 'connections': connections}
+
+    def stop(self):
+        self.stopped.set()
+        for process in self.workers:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.workers:
+            if process is not None:
+                process.join()
+        if self.ident is not None:
+            self.join()
+
+
+"""The body of a worker process, serves with target and reports its stats until the pool goes away"""
+def _run_worker(index, target, ip, port, args, stats, interval):
+    parent = os.getppid()
+    rxp = target(ip, port, *args)
+    while os.getppid() == parent:
+        stats.put((index, os.getpid(), rxp.info()))
+        time.sleep(interval)
@@ -0,0 +1,124 @@
+import http.server
+from logs import get_logger
+import math
+import os
+from threading import Thread, Event
+
+# counters a communicator keeps for its socket and for each peer
+SOCKET_COUNTERS = (
+    'packets_sent', 'bytes_sent', 'packets_received', 'bytes_received',
+    'retransmits', 'fast_retransmits', 'retransmit_timeouts', 'duplicate_acks', 'rtt_samples',
+    'corrupt_drops', 'malformed_drops', 'half_open_evictions', 'sessions_resumed')
+# counters a connection keeps
+CONNECTION_COUNTERS = (
+    'data_packets_sent', 'data_bytes_sent', 'data_packets_received', 'data_bytes_received',
+    'duplicates_received', 'out_of_order_received', 'receive_buffer_drops', 'acks_sent', 'congestion_events')
+COUNTERS = frozenset(SOCKET_COUNTERS + CONNECTION_COUNTERS)
+
+'''
+A set of counters, only ever increased.
+Increments take no lock, with the GIL a counter bumped from two threads at once can at worst
+lose an increment, which is fine for statistics and keeps the packet path cheap.
+snapshot copies them in one go, like reading TCP_INFO
+'''
+class RxPStats:
+    def __init__(self, names):
+        self.counters = dict.fromkeys(names, 0)
+
+    def add(self, name, amount=1):
+        self.counters[name] += amount
+
+    def snapshot(self):
+        return dict(self.counters)
+
+
+"""Prometheus text exposition of RxP sockets, each with the info of its socket and connections"""
+def render_prometheus(sockets):
+    samples = {}
+    for rxp in sockets:
+        info = rxp.info()
+        local = "%s:%s" % (info['socket'].get('ip'), info['socket'].get('port'))
+        groups = [({'local': local}, info['socket'])]
+        groups += [({'local': local, 'peer': peer}, connection) for peer, connection in sorted(info['connections'].items())]
+        for labels, values in groups:
+            for name, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                scope = 'connection' if 'peer' in labels else 'socket'
+                metric = "rxp_%s_%s%s" % (scope, name, '_total' if name in COUNTERS else '')
+                label_text = ",".join('%s="%s"' % item for item in sorted(labels.items()))
+                if isinstance(value, float) and math.isinf(value):
+                    value = '+Inf' if value > 0 else '-Inf'
+                samples.setdefault(metric, (name in COUNTERS, []))[1].append("%s{%s} %s" % (metric, label_text, value))
+    lines = []
+    for metric in sorted(samples):
+        counter, values = samples[metric]
+        lines.append("# TYPE %s %s" % (metric, 'counter' if counter else 'gauge'))
+        lines.extend(values)
+    return "\n".join(lines) + "\n"
+
+
+'''
+Exports the stats of RxP sockets in Prometheus text format, to a file rewritten every interval seconds,
+to an HTTP endpoint on localhost, or both
+
+    exporter = RxPStatsExporter([rxp], path="/var/lib/node_exporter/rxp.prom", port=9464)
+    exporter.start()
+'''
+class RxPStatsExporter(Thread):
+    def __init__(self, sockets, path=None, port=None, interval=10.0, ip="127.0.0.1"):
+        super().__init__(name="RxPStatsExporter")
+        self.daemon = True
+        self.logger = get_logger("StatsExporter")
+        self.sockets = list(sockets)
+        self.path = path
+        self.interval = interval
+        self.stopped = Event()
+        self.server = None
+        if port is not None:
+            exporter = self
+            class Handler(http.server.BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = exporter.render().encode('utf-8')
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                def log_message(self, format, *args):
+                    pass
+            self.server = http.server.ThreadingHTTPServer((ip, port), Handler)
+            self.server.daemon_threads = True
+            self.port = self.server.server_address[1]
+
+    def add(self, rxp):
+        self.sockets.append(rxp)
+
+    def render(self):
+        return render_prometheus(self.sockets)
+
+    """Write the file in one piece, a scraper never sees it half written"""
+    def write(self):
+        temporary = "%s.tmp" % self.path
+        with open(temporary, 'w') as output:
+            output.write(self.render())
+        os.replace(temporary, self.path)
+
+    def run(self):
+        if self.server is not None:
+            server = Thread(target=self.server.serve_forever, name="RxPStatsExporter HTTP")
+            server.daemon = True
+            server.start()
+        while self.path is not None and not self.stopped.is_set():
+            try:
+                self.write()
+            except OSError as e:
+                self.logger.error("Could not write stats to %s: %s", self.path, e)
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        # shutdown waits for serve_forever, which only runs once we were started
+        if self.server is not None and self.ident is not None:
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,168 @@
+from collections import deque
+from buffers import RxPRingBuffer
+
+'''
+A stream opened inside an RxPConnection, a byte stream of its own next to the connection's
+Streams share the handshake, the packet sequence and retransmissions of their connection but are
+ordered and flow controlled one by one: data of a stream is handed to its reader as soon as
+everything before it in that stream arrived, a packet lost on one stream never holds up another,
+and a stream whose reader falls behind only stops its own sender.
+
+    stream = connection.open_stream()
+    stream.write(request)
+    stream.close()
+    answer = stream.receive(65536)
+
+The other side gets the stream from connection.accept_stream. Either side closes its sending half
+with close, receive returns None once the other side closed its half and everything was read.
+A stream is used like a connection, it has receive, write, send, sendfile and close, and poll
+takes streams too
+'''
+class RxPStream:
+    # bytes each side may send before the receiver says it has read some, and the receive buffer
+    WINDOW = 64 * 1024
+
+    def __init__(self, connection, stream_id):
+        self.connection = connection
+        self.id = stream_id
+        # receive and poll wait on the connection
+        self.lock = connection.lock
+        self.pollers = connection.pollers
+        self.destinationip = connection.destinationip
+        self.destinationport = connection.destinationport
+        # how long receive waits, None leaves it to the timeout of the connection
+        self.timeout = None
+        # received data in order, waiting for the reader
+        self.receive_buffer = RxPRingBuffer(self.WINDOW)
+        # offset of the next byte expected, everything before it is in the buffer or was read
+        self.receive_offset = 0
+        # data that arrived ahead of a gap, keyed by offset, (data, fin)
+        self.out_of_order = {}
+        # where the stream ends, known once the FIN of the other side arrived
+        self.final_offset = None
+        # the end of the receive window we last told the other side
+        self.advertised_limit = self.WINDOW
+        # buffers passed to write, the first one partly sent up to send_pointer
+        self.send_queue = deque()
+        self.send_pointer = 0
+        # offset of the next byte sent
+        self.send_offset = 0
+        # the other side takes data up to this offset
+        self.peer_limit = self.WINDOW
+        # close was called, the FIN goes after the data queued before it
+        self.send_closed = False
+        self.fin_sent = False
+        # blocked by the window of the other side, a probe asks it for the window again
+        self.probe_timer = None
+        self.probe_due = False
+        self.probes = 0
+
+    def __str__(self):
+        return "stream %s of %s:%s" % (self.id, self.destinationip, self.destinationport)
+
+    def receive(self, buffer_size, timeout=None):
+        return self.connection.receive(buffer_size, timeout if timeout is not None else self.timeout, stream=self)
+
+    def readable(self):
+        return self.connection.readable(stream=self)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def gettimeout(self):
+        return self.timeout
+
+    def send(self, command, data=None):
+        self.write((command+"|SEPARATOR|").encode('utf-8'), data)
+
+    def write(self, *buffers):
+        self.connection.write(*buffers, stream=self)
+
+    def sendfile(self, path, offset=0, count=None, header=None, trailer=None):
+        return self.connection.sendfile(path, offset, count, header, trailer, stream=self)
+
+    """Close the sending half of the stream, the other side can still send until it closes its own"""
+    def close(self):
+        self.connection.close(stream=self)
+
+    """
+    Take the data of a packet at offset in the stream, False when it does not fit in the window
+    Data in order goes to the buffer along with whatever it let through, data past a gap is kept
+    """
+    def take(self, offset, data, fin):
+        length = len(data) if data is not None else 0
+        end = offset + length
+        if end > self.receive_limit():
+            return False
+        if fin:
+            self.final_offset = end
+        if end <= self.receive_offset:
+            return True
+        if offset > self.receive_offset:
+            # an empty probe holds nothing, it must not take the place of the data at its offset
+            if length or fin:
+                self.out_of_order[offset] = (bytes(data) if data is not None else None, fin)
+            return True
+        self.receive_buffer.write(memoryview(data)[self.receive_offset - offset:])
+        self.receive_offset = end
+        while self.receive_offset in self.out_of_order:
+            data, fin = self.out_of_order.pop(self.receive_offset)
+            if data:
+                self.receive_buffer.write(data)
+                self.receive_offset += len(data)
+        return True
+
+    """The offset the other side may send up to, what was read plus the room in the buffer"""
+    def receive_limit(self):
+        return self.receive_offset + self.receive_buffer.free()
+
+    """Everything the other side sent arrived, the reader sees the end once the buffer is empty"""
+    def receive_finished(self):
+        return self.final_offset is not None and self.receive_offset >= self.final_offset
+
+    def has_data_to_send(self):
+        return bool(self.send_queue) or (self.send_closed and not self.fin_sent)
+
+    """Out of data the window of the other side does not take yet"""
+    def blocked(self):
+        return bool(self.send_queue) and self.send_offset >= self.peer_limit
+
+    """
+    The next packet of the stream as (data, offset, fin), None when there is nothing to send or the
+    window of the other side is full. A due probe is an empty packet that gets the window back in its ACK
+    """
+    def next_segment(self, size):
+        if self.fin_sent:
+            return None
+        if self.blocked():
+            if not self.probe_due:
+                return None
+            self.probe_due = False
+            return None, self.send_offset, False
+        size = min(size, self.peer_limit - self.send_offset)
+        segments = []
+        while size and self.send_queue:
+            buffer = self.send_queue[0]
+            end = min(self.send_pointer + size, len(buffer))
+            segments.append(buffer[self.send_pointer:end])
+            size -= end - self.send_pointer
+            self.send_pointer = end
+            if self.send_pointer >= len(buffer):
+                self.send_queue.popleft()
+                self.send_pointer = 0
+        data = None
+        if len(segments) == 1:
+            data = segments[0]
+        elif segments:
+            data = b''.join(segments)
+        fin = self.send_closed and not self.send_queue
+        if data is None and not fin:
+            return None
+        offset = self.send_offset
+        self.send_offset += len(data) if data is not None else 0
+        self.fin_sent = fin
+        return data, offset, fin
+
+    """Bytes passed to write that have not gone out yet"""
+    def send_pending(self):
+        return sum(len(buffer) for buffer in self.send_queue) - self.send_pointer
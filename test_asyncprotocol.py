@@ -0,0 +1,113 @@
+import unittest
+import asyncio
+import logging
+import time
+from threading import Thread
+from asyncprotocol import AsyncRxP
+from protocol import RxP
+from connection import RxPConnectionState, RxPConnectionSendException
+
+
+class TestAsyncProtocol(unittest.TestCase):
+
+    def run_async(self, coroutine, timeout=20):
+        return asyncio.run(asyncio.wait_for(coroutine, timeout))
+
+    """Test an asyncio client and server exchanging data in both directions and closing"""
+    def test_async_to_async(self):
+        payload = bytes(range(256)) * 200
+        async def scenario():
+            async def handle(connection):
+                data = await connection.readexactly(len(payload))
+                connection.write(data[::-1])
+                await connection.drain()
+                connection.close()
+            server = AsyncRxP(logging.WARNING)
+            await server.start_server(handle, "127.0.0.1", 0)
+            client = AsyncRxP(logging.WARNING)
+            connection = await client.open_connection("127.0.0.1", 0, "127.0.0.1", server.port)
+            connection.write(payload)
+            await connection.drain()
+            echoed = await connection.readexactly(len(payload))
+            self.assertEqual(await connection.read(), b'')
+            connection.close()
+            await connection.wait_closed()
+            client.close()
+            server.close()
+            return echoed
+        self.assertEqual(self.run_async(scenario()), payload[::-1])
+
+    """Test an asyncio client talking to the threaded server"""
+    def test_async_client_threaded_server(self):
+        server = RxP(logging.WARNING)
+        server.listen("127.0.0.1", 0)
+        accepted = []
+        Thread(target=lambda: accepted.append(server.accept()), daemon=True).start()
+        payload = b'\x01' * 5000
+        async def scenario():
+            client = AsyncRxP(logging.WARNING)
+            connection = await client.open_connection("127.0.0.1", 0, "127.0.0.1", server.port)
+            connection.write(payload)
+            await connection.drain()
+            deadline = time.time() + 10
+            while time.time() < deadline and (not accepted or len(accepted[0].receive_buffer) < len(payload)):
+                await asyncio.sleep(0.01)
+            accepted[0].send("reply", b'\x02' * 3000)
+            reply = await connection.readexactly(len("reply|SEPARATOR|") + 3000)
+            client.close()
+            return reply
+        reply = self.run_async(scenario())
+        self.assertEqual(bytes(accepted[0].receive(len(payload))), payload)
+        self.assertEqual(reply, b'reply|SEPARATOR|' + b'\x02' * 3000)
+
+    """Test the threaded client talking to an asyncio server"""
+    def test_threaded_client_async_server(self):
+        payload = b'hello|SEPARATOR|' + b'\x03' * 4000
+        async def scenario():
+            received = asyncio.get_running_loop().create_future()
+            async def handle(connection):
+                received.set_result(await connection.readexactly(len(payload)))
+                connection.write(b'\x04' * 2000)
+                await connection.drain()
+            server = AsyncRxP(logging.WARNING)
+            await server.start_server(handle, "127.0.0.1", 0)
+            client = RxP(logging.WARNING)
+            connection = await asyncio.get_running_loop().run_in_executor(None, client.connect, "127.0.0.1", 0, "127.0.0.1", server.port)
+            self.assertIs(connection.state, RxPConnectionState.ESTABLISHED)
+            connection.send("hello", b'\x03' * 4000)
+            data = await received
+            deadline = time.time() + 10
+            while time.time() < deadline and len(connection.receive_buffer) < 2000:
+                await asyncio.sleep(0.01)
+            reply = bytes(connection.receive(2000))
+            server.close()
+            return data, reply
+        data, reply = self.run_async(scenario())
+        self.assertEqual(data, payload)
+        self.assertEqual(reply, b'\x04' * 2000)
+
+    """Test the threaded client opens no streams to an asyncio server, which refuses their packets"""
+    def test_no_streams_with_async_server(self):
+        async def scenario():
+            received = asyncio.get_running_loop().create_future()
+            async def handle(connection):
+                received.set_result(await connection.readexactly(5))
+            server = AsyncRxP(logging.WARNING)
+            await server.start_server(handle, "127.0.0.1", 0)
+            client = RxP(logging.WARNING)
+            connection = await asyncio.get_running_loop().run_in_executor(None, client.connect, "127.0.0.1", 0, "127.0.0.1", server.port)
+            self.assertFalse(connection.streams_enabled)
+            with self.assertRaises(RxPConnectionSendException):
+                connection.open_stream()
+            # a stream packet sent anyway does not end up in the connection's data
+            client.communicator.sendDATA(client.ip, client.port, "127.0.0.1", server.port, b'xxxxx', connection.last_seq + 1, True, 1)
+            await asyncio.sleep(0.1)
+            connection.write(b'after')
+            data = await received
+            server.close()
+            return data
+        self.assertEqual(self.run_async(scenario()), b'after')
+
+
+if __name__ == '__main__':
+    unittest.main()
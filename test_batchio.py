@@ -0,0 +1,65 @@
+import unittest
+import socket
+from batchio import RxPDatagramIO
+
+
+class TestBatchIO(unittest.TestCase):
+
+    def setUp(self):
+        self.receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.receiver.bind(("127.0.0.1", 0))
+        self.receiver.settimeout(5)
+        self.sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sender.bind(("127.0.0.1", 0))
+
+    def tearDown(self):
+        self.receiver.close()
+        self.sender.close()
+
+    """Send a batch with one method and receive it with another, views and several buffers per datagram"""
+    def round_trip(self, send_method, receive_method, kernel_batching=False):
+        try:
+            sending = RxPDatagramIO(self.sender, 512, 8, send_method=send_method, kernel_batching=kernel_batching)
+            receiving = RxPDatagramIO(self.receiver, 512, 8, receive_method=receive_method, kernel_batching=kernel_batching)
+        except ValueError:
+            self.skipTest("%s/%s not available" % (send_method, receive_method))
+        payload = bytes(range(256)) * 2
+        address = self.receiver.getsockname()
+        datagrams = [([bytearray(b'header%s' % bytes([48 + i])), memoryview(payload)[i * 10:i * 10 + 40]], address) for i in range(12)]
+        sending.send(datagrams)
+        received = []
+        while len(received) < len(datagrams):
+            received.extend(receiving.receive())
+        self.assertEqual([bytes(data) for data, source in received], [b''.join(bytes(buffer) for buffer in buffers) for buffers, destination in datagrams])
+        self.assertTrue(all(source == self.sender.getsockname() for data, source in received))
+
+    def test_sendto_recvfrom(self):
+        self.round_trip('sendto', 'recvfrom')
+
+    def test_sendmsg_recvmsg_into(self):
+        self.round_trip('sendmsg', 'recvmsg_into')
+
+    def test_sendmmsg_recvmmsg(self):
+        self.receiver.settimeout(None)
+        self.round_trip('sendmmsg', 'recvmmsg', kernel_batching=True)
+
+    """Test datagrams are sent with sendto and not held back unless kernel batching is asked for"""
+    def test_default_send(self):
+        io = RxPDatagramIO(self.sender, 512)
+        self.assertEqual(io.send_method, 'sendto')
+        self.assertFalse(io.batching)
+
+    """Test sockets without sendmsg and without a file descriptor fall back to sendto and recvfrom"""
+    def test_fallback(self):
+        class Plain:
+            def sendto(self, data, address):
+                pass
+            def recvfrom(self, buffer_size):
+                return (b'', None)
+        io = RxPDatagramIO(Plain(), 512, kernel_batching=True)
+        self.assertEqual((io.send_method, io.receive_method), ('sendto', 'recvfrom'))
+        self.assertEqual(io.receive(), [(b'', None)])
+
+
+if __name__ == '__main__':
+    unittest.main()
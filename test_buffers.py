@@ -0,0 +1,32 @@
+import unittest
+from buffers import RxPRingBuffer
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def test_write_read(self):
+        ring = RxPRingBuffer(8)
+        self.assertEqual(ring.write(b'hello'), 5)
+        self.assertEqual(ring.free(), 3)
+        self.assertEqual(ring.read(2), bytearray(b'he'))
+        self.assertEqual(len(ring), 3)
+
+    """Test that data wraps around the end of the storage"""
+    def test_wrap_around(self):
+        ring = RxPRingBuffer(8)
+        ring.write(b'abcdef')
+        ring.read(4)
+        self.assertEqual(ring.write(b'ghijkl'), 6)
+        self.assertEqual(ring.read(100), bytearray(b'efghijkl'))
+        self.assertEqual(len(ring), 0)
+
+    """Test that a full buffer only takes what fits"""
+    def test_full(self):
+        ring = RxPRingBuffer(4)
+        self.assertEqual(ring.write(b'abcdef'), 4)
+        self.assertEqual(ring.write(b'g'), 0)
+        self.assertEqual(ring.read(4), bytearray(b'abcd'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+import zlib
+import checksum
+from checksum import get_checksum, DEFAULT_CHECKSUM_PREFERENCE
+
+
+class TestChecksum(unittest.TestCase):
+
+    """Test CRC32C against the standard check value"""
+    def test_crc32c(self):
+        self.assertEqual(get_checksum('crc32c').compute(b'1234', b'56789'), 0xE3069283)
+
+    """Test CRC32 chains header and data like a single buffer"""
+    def test_crc32(self):
+        self.assertEqual(get_checksum('crc32').compute(b'1234', b'56789'), zlib.crc32(b'123456789'))
+
+    """Test the Internet checksum against the example from RFC 1071"""
+    def test_internet_checksum(self):
+        data = bytes([0x00, 0x01, 0xf2, 0x03, 0xf4, 0xf5, 0xf6, 0xf7])
+        self.assertEqual(get_checksum('inet').compute(data[:4], data[4:]), 0xFFFF - 0xddf2)
+        # odd length data is padded with a zero byte
+        self.assertEqual(get_checksum('inet').compute(b'', b'\x01'), get_checksum('inet').compute(b'', b'\x01\x00'))
+
+    """Test CRC32C is only offered by default when the fast implementation is installed"""
+    def test_default_preference(self):
+        self.assertEqual('crc32c' in DEFAULT_CHECKSUM_PREFERENCE, checksum._crc32c is not None)
+        self.assertEqual(DEFAULT_CHECKSUM_PREFERENCE[:2], ('crc32', 'inet'))
+
+    """Test looking up algorithms by ID and name"""
+    def test_get_checksum(self):
+        self.assertIs(get_checksum('none'), get_checksum(0))
+        with self.assertRaises(ValueError):
+            get_checksum('sha1')
+
+
+if __name__ == '__main__':
+    unittest.main()
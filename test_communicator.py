@@ -1,7 +1,9 @@
 import unittest
 import logging
+import time
 from packet import RxPacket, RxPFlags
 from communicator import RxPCommunicator
+from checksum import get_checksum, DEFAULT_CHECKSUM
 
 class TestPacket(RxPacket):
     def __init__(self, flags, sequence, ack=None, data=None, sourceip=None, destinationip=None, sourceport=None, destport=None, checksum=None):
@@ -10,14 +12,17 @@ class TestPacket(RxPacket):
 """dummy socket object to emulate udp socket"""
 class DummySocket:
 
-    def __init__(self, test_packet):
+    def __init__(self, test_packet, address="127.0.0.1"):
         self.test_packet = test_packet
+        self.address = address
+        self.sent = []
 
     def recvfrom(self,buffer_size):
-        return (self.test_packet, "127.0.0.1")
+        return (self.test_packet, self.address)
 
     def sendto(self, data, tuple):
-        print ("Send To: "+data)
+        print ("Send To: %s" % data)
+        self.sent.append(RxPacket.deserialize(data))
 
 
 
@@ -38,6 +43,90 @@ class TestCommunicator(unittest.TestCase):
         self.communicator.sock.test_packet = RxPacket.serialize(test_packet)
         self.assertIsNotNone(self.communicator.receive_packet())
 
+    def test_checksum_negotiation(self):
+        client = RxPCommunicator(DummySocket(None), checksums=['crc32c', 'inet'])
+        server = RxPCommunicator(DummySocket(None), checksums=['inet', 'crc32c'])
+        syn_packet = TestPacket([RxPFlags.SYN], 1, sourceip="127.0.0.1", sourceport=50000, data=client._RxPCommunicator__syn_options())
+        # the server goes with the client's preference
+        self.assertEqual(server._RxPCommunicator__choose_checksum(syn_packet), get_checksum('crc32c'))
+        # and falls back to the default when nothing matches
+        syn_packet.data = RxPacket.pack_options({})
+        self.assertEqual(server._RxPCommunicator__choose_checksum(syn_packet), get_checksum('inet'))
+
+    """Deliver an ACK from the peer to the communicator"""
+    def receive_ack(self, communicator, ack, sack_blocks=()):
+        ack_packet = RxPacket([RxPFlags.ACK], None, ack=ack, data=RxPacket.pack_sack(sack_blocks) if sack_blocks else None)
+        communicator.sock.test_packet = RxPacket.serialize(ack_packet, DEFAULT_CHECKSUM)
+        return communicator.receive_packet()
+
+    def test_fast_retransmit(self):
+        communicator = RxPCommunicator(DummySocket(None, ("127.0.0.1", 50001)))
+        for sequence in range(1, 6):
+            communicator.sendDATA("127.0.0.1", 50000, "127.0.0.1", 50001, b'x', sequence)
+        self.receive_ack(communicator, 1)
+        self.assertFalse(communicator.is_waiting_for_ack("127.0.0.1", 50001, 1))
+        self.assertIsNotNone(communicator.get_rtt_estimator("127.0.0.1", 50001).srtt)
+        # packet 2 is lost, the receiver keeps acking 1 with 3, 4 and 5 in SACK blocks
+        for last in range(3, 6):
+            self.receive_ack(communicator, 1, [(3, last)])
+        retransmitted = [packet.sequence for packet in communicator.sock.sent[5:]]
+        self.assertEqual(retransmitted, [2])
+        self.assertEqual(communicator.waiting_to_be_acked[("127.0.0.1", 50001)][2].transmissions, 2)
+        self.receive_ack(communicator, 5)
+        self.assertNotIn(("127.0.0.1", 50001), communicator.waiting_to_be_acked)
+
+    """Test a SACK block spanning the whole sequence space only costs the packets waiting"""
+    def test_huge_sack_block(self):
+        communicator = RxPCommunicator(DummySocket(None, ("127.0.0.1", 50001)))
+        for sequence in range(1, 6):
+            communicator.sendDATA("127.0.0.1", 50000, "127.0.0.1", 50001, b'x', sequence)
+        start = time.monotonic()
+        self.receive_ack(communicator, 1, [(3, 0xFFFFFFFF)] * (RxPacket.MAX_SACK_BLOCKS + 4))
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(list(communicator.waiting_to_be_acked[("127.0.0.1", 50001)]), [2])
+
+    def test_retransmit_timeout(self):
+        communicator = RxPCommunicator(DummySocket(None, ("127.0.0.1", 50001)))
+        estimator = communicator.get_rtt_estimator("127.0.0.1", 50001)
+        estimator.rto = 0.01
+        communicator.sendDATA("127.0.0.1", 50000, "127.0.0.1", 50001, b'x', 1)
+        time.sleep(0.1)
+        self.assertGreater(len(communicator.sock.sent), 1)
+        self.assertGreater(estimator.rto, 0.01)
+        self.receive_ack(communicator, 1)
+        # a retransmitted packet is not measured
+        self.assertIsNone(estimator.srtt)
+        self.assertEqual(communicator.retransmit_timers, {})
+
+    """Test packets sent inside a batch go out together when the outermost batch ends"""
+    def test_batch(self):
+        communicator = RxPCommunicator(DummySocket(None, ("127.0.0.1", 50001)))
+        # without kernel batching nothing is held back
+        with communicator.batch():
+            communicator.sendDATA("127.0.0.1", 50000, "127.0.0.1", 50001, b'a', 1)
+            self.assertEqual(len(communicator.sock.sent), 1)
+        communicator = RxPCommunicator(DummySocket(None, ("127.0.0.1", 50001)))
+        communicator.io.batching = True
+        with communicator.batch():
+            communicator.sendDATA("127.0.0.1", 50000, "127.0.0.1", 50001, b'a', 1)
+            with communicator.batch():
+                communicator.sendDATA("127.0.0.1", 50000, "127.0.0.1", 50001, b'b', 2)
+            self.assertEqual(communicator.sock.sent, [])
+            self.assertTrue(communicator.is_waiting_for_ack("127.0.0.1", 50001, 2))
+        self.assertEqual([bytes(packet.data) for packet in communicator.sock.sent], [b'a', b'b'])
+        communicator.sendDATA("127.0.0.1", 50000, "127.0.0.1", 50001, b'c', 3)
+        self.assertEqual(len(communicator.sock.sent), 3)
+
+    """Test the trace records packets both ways"""
+    def test_trace(self):
+        communicator = RxPCommunicator(DummySocket(None, ("127.0.0.1", 50001)), logging.INFO, trace=16)
+        communicator.sendDATA("127.0.0.1", 50000, "127.0.0.1", 50001, b'abc', 1)
+        ack = RxPacket([RxPFlags.ACK], None, ack=1, window=5, sourceport=50001, destport=50000)
+        communicator.sock.test_packet = RxPacket.serialize(ack)
+        communicator.receive_packet()
+        records = communicator.trace.records()
+        self.assertEqual([(record[1], record[3], record[4], record[6]) for record in records], [(0, 1, 0, 3), (1, 0, 1, 0)])
+
 
 
 if __name__ == '__main__':
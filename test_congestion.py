@@ -0,0 +1,66 @@
+import unittest
+from congestion import get_congestion_control, RxPCongestionControl
+
+
+class TestReno(unittest.TestCase):
+
+    def test_slow_start_and_avoidance(self):
+        reno = get_congestion_control('reno')
+        self.assertEqual(reno.window(), RxPCongestionControl.INITIAL_WINDOW)
+        reno.on_ack(10)
+        self.assertEqual(reno.window(), 20)
+        reno.on_loss()
+        self.assertEqual(reno.window(), 10)
+        self.assertFalse(reno.in_slow_start())
+        # one packet per round trip in congestion avoidance
+        reno.on_ack(10)
+        self.assertAlmostEqual(reno.cwnd, 11, delta=0.1)
+
+    def test_timeout(self):
+        reno = get_congestion_control('reno')
+        reno.on_ack(10)
+        reno.on_timeout()
+        self.assertEqual(reno.window(), 1)
+        self.assertEqual(reno.ssthresh, 10)
+
+    def test_resume(self):
+        reno = get_congestion_control('reno')
+        reno.resume(40, float('inf'))
+        self.assertEqual(reno.window(), 40)
+        # no slow start from the window of the last connection
+        self.assertFalse(reno.in_slow_start())
+        reno.resume(2, 2)
+        self.assertEqual(reno.window(), RxPCongestionControl.INITIAL_WINDOW)
+
+
+class TestCubic(unittest.TestCase):
+
+    def test_recovers_to_last_maximum(self):
+        cubic = get_congestion_control('cubic')
+        cubic.on_ack(90)
+        self.assertEqual(cubic.window(), 100)
+        cubic.on_loss(now=0.0)
+        self.assertEqual(cubic.window(), 70)
+        # the cubic curve is back at the window of the loss after K seconds
+        k = ((100 - 70) / cubic.C) ** (1.0 / 3)
+        cubic.on_ack(1, srtt=0.0, now=0.0)
+        cubic.on_ack(1000, srtt=0.0, now=k)
+        self.assertAlmostEqual(cubic.cwnd, 100, delta=2)
+        # and grows beyond it after that
+        cubic.on_ack(1000, srtt=0.0, now=k + 2)
+        self.assertGreater(cubic.cwnd, 100)
+
+    def test_resume(self):
+        cubic = get_congestion_control('cubic')
+        cubic.resume(50, 40)
+        self.assertEqual(cubic.window(), 50)
+        cubic.on_loss(now=0.0)
+        self.assertEqual(cubic.window(), 35)
+
+    def test_unknown(self):
+        with self.assertRaises(ValueError):
+            get_congestion_control('vegas')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,26 +1,73 @@
 import unittest
+import contextlib
 import logging
-from connection import RxPConnection, RxPConnectionState
+import mmap
+import os
+import tempfile
+import threading
+import time
+from connection import RxPConnection, RxPConnectionState, RxPConnectionSendException, RxPConnectionTimeoutException, poll
+from packet import RxPacket, RxPFlags
+from rtt import RxPRTTEstimator
+from buffers import RxPRingBuffer
+from streams import RxPStream
+from timers import RxPTimerQueue
+from framing import RxPCommand, send_file
 
 
 class DummyCommunicator:
     def __init__(self):
         self.packet_sequence = 0
+        self.BUFFER_SIZE = 512
+        self.sent = []
+        self.data = []
+        self.acks = []
+        self.windows = []
+        self.streams = []
+        self.limits = []
+        self.fins = []
+        self.rtt_estimator = RxPRTTEstimator()
+        self.timers = RxPTimerQueue()
 
 
-    def sendDATA(self, sourceip, sourceport, destinationip, destport, data_in_bytes):
+    def sendDATA(self, sourceip, sourceport, destinationip, destport, data_in_bytes, sequence=None, push=False, stream=0, offset=0, fin=False):
         print ("Dummy Communicator: %s" % data_in_bytes)
-        self.packet_sequence += 1
+        self.packet_sequence = sequence if sequence is not None else self.packet_sequence + 1
+        self.sent.append((self.packet_sequence, push))
+        self.data.append(data_in_bytes)
+        self.streams.append((stream, offset, fin))
         return self.packet_sequence
 
     def sendACK(self, ip, port, packet):
         print ("Dummy Communicator ACK: %s" % packet['ack'])
 
-    def sendCONNECTFIN(self,sourceip, sourceport, destinationip, destport):
+    def sendSACK(self, sourceip, sourceport, destinationip, destport, ack, sack_blocks=(), window=0, stream=0, limit=0):
+        print ("Dummy Communicator SACK: %s %s %s" % (ack, sack_blocks, window))
+        self.acks.append((ack, list(sack_blocks)))
+        self.windows.append(window)
+        self.limits.append((stream, limit))
+
+    def sendCONNECTFIN(self,sourceip, sourceport, destinationip, destport, sequence=None, data=None):
         print ("Dummy Communicator CONNECT FIN")
-        self.packet_sequence += 1
+        self.packet_sequence = sequence if sequence is not None else self.packet_sequence + 1
+        self.fins.append(self.packet_sequence)
         return self.packet_sequence
 
+    def is_waiting_for_ack(self, ip, port, sequence):
+        return False
+
+    def get_rtt_estimator(self, ip, port):
+        return self.rtt_estimator
+
+    def remove_listener(self, key):
+        pass
+
+    def forget_peer(self, ip, port):
+        pass
+
+    def batch(self):
+        return contextlib.nullcontext()
+
 
 class TestConnection(unittest.TestCase):
     
@@ -31,10 +78,12 @@ class TestConnection(unittest.TestCase):
         sourceport = 50002
         destinationip = "127.0.0.1"
         destinationport = 50002
+        self.communicator = communicator
         self.connection =  RxPConnection("Connection to: "+connection_key,sourceip, sourceport, destinationip, destinationport, 0, None, communicator, logging.DEBUG, 10)
 
     """Test splitting data into datagrams"""
     def test__get_next_datagram(self):
+        self.connection.send_buffer_size = 8
         self.connection.data_to_be_sent = bytearray("hello my friend! guy", 'utf-8')
         self.connection.data_to_be_sent_last_pointer = 0
         self.assertEqual(self.connection._RxPConnection__get_next_datagram(), self.connection.data_to_be_sent[0:8])
@@ -43,15 +92,92 @@ class TestConnection(unittest.TestCase):
         self.assertEqual(self.connection._RxPConnection__get_next_datagram(), None)
 
 
+    """Test send segments at the segment size with views into the caller's buffer"""
+    def test_send_segments_without_copying(self):
+        self.connection.state = RxPConnectionState.ESTABLISHED
+        data = bytearray(range(256)) * 10
+        self.connection.send("get", data)
+        segment_size = self.connection.MAX_SEGMENT_SIZE
+        sent = self.communicator.data
+        self.assertEqual(b''.join(bytes(segment) for segment in sent), b'get|SEPARATOR|' + data)
+        self.assertEqual([len(segment) for segment in sent[:-1]], [segment_size] * (len(sent) - 1))
+        # only the segment joining the command and the data is a copy
+        for segment in sent[1:]:
+            self.assertIsInstance(segment, memoryview)
+            self.assertIs(segment.obj, data)
+
+    """Test a file goes out in segments that are views into its mapping"""
+    def test_sendfile(self):
+        self.connection.set_window_size(64)
+        self.connection.peer_window = 64
+        self.connection.congestion.cwnd = 64
+        contents = bytes(range(256)) * 40
+        with tempfile.NamedTemporaryFile(delete=False) as file:
+            file.write(contents)
+        self.addCleanup(os.unlink, file.name)
+        self.connection.state = RxPConnectionState.ESTABLISHED
+        offset = mmap.ALLOCATIONGRANULARITY + 100
+        self.assertEqual(self.connection.sendfile(file.name, offset, 5000, header=b'file copy|SEPARATOR|', trailer=b'|END'), 5000)
+        sent = self.communicator.data
+        self.assertEqual(b''.join(bytes(segment) for segment in sent), b'file copy|SEPARATOR|' + contents[offset:offset + 5000] + b'|END')
+        self.assertTrue(any(isinstance(segment, memoryview) and isinstance(segment.obj, mmap.mmap) for segment in sent))
+        # the count is cut at the end of the file
+        self.assertEqual(self.connection.sendfile(file.name, len(contents) - 10, 100), 10)
+        with self.assertRaises(ValueError):
+            self.connection.sendfile(file.name, len(contents) + 1)
+        # a closed connection is reported as such, send_file does not take it for a file that changed
+        self.connection.state = RxPConnectionState.CLOSE_WAIT
+        with self.assertRaises(RxPConnectionSendException):
+            self.connection.sendfile(file.name)
+        with self.assertRaises(RxPConnectionSendException):
+            send_file(self.connection, RxPCommand.FILE, "copy", file.name)
+
     """Test sending back data to clients"""
     def test_receive_buffer(self):
         test_data = bytearray("hello my friend! guy", 'utf-8')
-        self.connection.receive_buffer = test_data
+        self.connection.receive_buffer.write(test_data)
         self.assertEqual(test_data[0:8],self.connection.receive(8))
         self.assertEqual(test_data[8:16],self.connection.receive(8))
         self.assertEqual(test_data[16:24],self.connection.receive(8))
-        # this will block till we have data
-        #self.assertEqual(None,self.connection.receive(8))
+        # with the buffer empty it waits for data
+        with self.assertRaises(RxPConnectionTimeoutException):
+            self.connection.receive(8, timeout=0.05)
+        self.connection.setblocking(False)
+        with self.assertRaises(RxPConnectionTimeoutException):
+            self.connection.receive(8)
+
+    """Test a waiting receive wakes for a packet and returns None at the end of the stream"""
+    def test_receive_wakeup(self):
+        self.connection.state = RxPConnectionState.ESTABLISHED
+        received = []
+        def reader():
+            while True:
+                data = self.connection.receive(8, timeout=5)
+                received.append(data)
+                if data is None:
+                    return
+        thread = threading.Thread(target=reader)
+        thread.start()
+        time.sleep(0.05)
+        self.connection.handle_packet(RxPacket([RxPFlags.DATA, RxPFlags.PSH], 1, data=b'hello'))
+        self.connection.handle_packet(RxPacket([RxPFlags.FIN], 2))
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(b''.join(received[:-1]), b'hello')
+        self.assertIsNone(received[-1])
+
+    """Test poll returns the connections with data, or none when the timeout passes"""
+    def test_poll(self):
+        other = RxPConnection("Other", "127.0.0.1", 50002, "127.0.0.1", 50004, 0, None, DummyCommunicator(), logging.DEBUG, 10)
+        for connection in (self.connection, other):
+            connection.state = RxPConnectionState.ESTABLISHED
+        start = time.time()
+        self.assertEqual(poll([self.connection, other], 0.05), [])
+        self.assertGreaterEqual(time.time() - start, 0.04)
+        timer = threading.Timer(0.05, other.handle_packet, [RxPacket([RxPFlags.DATA, RxPFlags.PSH], 1, data=b'x')])
+        timer.start()
+        self.assertEqual(poll([self.connection, other], 5), [other])
+        self.assertEqual(other.pollers, set())
 
     """Test Send window logic"""
     def test_send_window(self):
@@ -77,12 +203,200 @@ class TestConnection(unittest.TestCase):
             self.assertNotIn(sequence,self.connection.send_window)
 
 
+    """Test that SACK blocks free slots beyond the cumulative ACK"""
+    def test_sack_removes_from_send_window(self):
+        self.connection.send_buffer_size = 1
+        self.connection.data_to_be_sent = bytearray("0123456789abc", 'utf-8')
+        self.connection.data_to_be_sent_last_pointer = 0
+        self.connection._RxPConnection__fill_send_window()
+        # 1 and 2 received in order, 4 to 6 out of order
+        self.connection._RxPConnection__remove_acked_from_send_window(2, [(4, 6)])
+        self.assertEqual(self.connection.send_unacked, 3)
+        for sequence in (1, 2, 4, 5, 6):
+            self.assertNotIn(sequence, self.connection.send_window)
+        self.assertIn(3, self.connection.send_window)
+        # the window never runs more than the window size past the oldest unacked packet
+        self.assertEqual(self.connection.last_seq, 12)
+
+    """Test that the packet filling the window asks for an immediate ACK"""
+    def test_push_on_full_window(self):
+        self.connection.send_buffer_size = 1
+        self.connection.data_to_be_sent = bytearray("0123456789abc", 'utf-8')
+        self.connection.data_to_be_sent_last_pointer = 0
+        self.connection._RxPConnection__fill_send_window()
+        self.assertEqual([sequence for sequence, push in self.communicator.sent if push], [10])
+
+    """Test reordering of packets that arrive out of order"""
+    def test_out_of_order_receive(self):
+        self.connection.state = RxPConnectionState.ESTABLISHED
+        handle = self.connection.handle_packet
+        handle(RxPacket([RxPFlags.DATA], 2, data=b'b'))
+        handle(RxPacket([RxPFlags.DATA], 4, data=b'd'))
+        self.assertEqual(len(self.connection.receive_buffer), 0)
+        self.assertEqual(self.communicator.acks[-1], (0, [(2, 2), (4, 4)]))
+        handle(RxPacket([RxPFlags.DATA], 1, data=b'a'))
+        self.assertEqual(len(self.connection.receive_buffer), 2)
+        # filling a gap is acknowledged straight away
+        self.assertEqual(self.communicator.acks[-1], (2, [(4, 4)]))
+        handle(RxPacket([RxPFlags.DATA], 3, data=b'c'))
+        self.assertEqual(self.communicator.acks[-1], (4, []))
+        self.assertEqual(self.connection.receive_buffer.read(100), bytearray(b'abcd'))
+
+    """Test a full receive buffer closes the window and reading opens it again"""
+    def test_flow_control(self):
+        self.connection.state = RxPConnectionState.ESTABLISHED
+        self.connection.RECEIVE_BUFFER_SIZE = 1000
+        self.connection.receive_buffer = RxPRingBuffer(1000)
+        segment = bytes(self.connection.MAX_SEGMENT_SIZE)
+        handle = self.connection.handle_packet
+        handle(RxPacket([RxPFlags.DATA, RxPFlags.PSH], 1, data=segment))
+        self.assertEqual(self.communicator.windows[-1], 1)
+        # outside the advertised window
+        handle(RxPacket([RxPFlags.DATA, RxPFlags.PSH], 3, data=segment))
+        self.assertEqual(self.connection.out_of_order, {})
+        handle(RxPacket([RxPFlags.DATA, RxPFlags.PSH], 2, data=segment))
+        self.assertEqual(self.communicator.windows[-1], 0)
+        # no room left, the packet is dropped and not acknowledged
+        handle(RxPacket([RxPFlags.DATA, RxPFlags.PSH], 3, data=segment))
+        self.assertEqual(self.communicator.acks[-1], (2, []))
+        # reading reopens the window
+        self.connection.receive(len(segment))
+        self.assertEqual(self.communicator.windows[-1], 1)
+
+    """Test the sender stays inside the window the receiver advertised"""
+    def test_peer_window(self):
+        self.connection.send_buffer_size = 1
+        self.connection.data_to_be_sent = bytearray(100)
+        self.connection.data_to_be_sent_last_pointer = 0
+        self.connection._RxPConnection__handle_ack_packet(RxPacket([RxPFlags.ACK], None, ack=0, window=3))
+        self.connection._RxPConnection__fill_send_window()
+        self.assertEqual(self.connection.last_seq, 3)
+        # a zero window still lets one probe out once everything is acked
+        self.connection._RxPConnection__handle_ack_packet(RxPacket([RxPFlags.ACK], None, ack=3, window=0))
+        self.assertEqual(self.connection.last_seq, 4)
+
+    """Test in order packets share an ACK"""
+    def test_delayed_ack(self):
+        self.connection.state = RxPConnectionState.ESTABLISHED
+        self.connection.ACK_EVERY = 4
+        handle = self.connection.handle_packet
+        for sequence in range(1, 9):
+            handle(RxPacket([RxPFlags.DATA], sequence, data=b'x'))
+        self.assertEqual(self.communicator.acks, [(4, []), (8, [])])
+        handle(RxPacket([RxPFlags.DATA, RxPFlags.PSH], 9, data=b'x'))
+        self.assertEqual(self.communicator.acks[-1], (9, []))
+        # a lone packet is acknowledged by a timer on the communicator's queue, no thread of its own
+        threads = threading.active_count()
+        handle(RxPacket([RxPFlags.DATA], 10, data=b'x'))
+        self.assertEqual(threading.active_count(), threads)
+        deadline = time.time() + 5
+        while self.communicator.acks[-1] != (10, []) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.communicator.acks[-1], (10, []))
+        self.connection.destroy()
+
+    """Test the congestion window limits the packets in flight"""
+    def test_congestion_window(self):
+        self.connection.set_window_size(64)
+        self.connection.send_buffer_size = 1
+        self.connection.data_to_be_sent = bytearray(100)
+        self.connection.data_to_be_sent_last_pointer = 0
+        self.connection._RxPConnection__fill_send_window()
+        self.assertEqual(self.connection.last_seq, self.connection.congestion.INITIAL_WINDOW)
+        # a loss halves the window, packets acked after it only open it slowly
+        self.connection.handle_packet_loss(False)
+        self.connection._RxPConnection__remove_acked_from_send_window(10)
+        self.assertLess(self.connection.last_seq, 20)
+        self.connection.handle_packet_loss(True)
+        self.assertEqual(self.connection.effective_window(), 1)
+
+    """Test a stream is read while a packet of another stream before it is missing"""
+    def test_streams_out_of_order(self):
+        self.connection.state = RxPConnectionState.ESTABLISHED
+        self.connection.streams_enabled = True
+        handle = self.connection.handle_packet
+        # the other side connected, its streams are odd, and stream 1 is made along with stream 3
+        handle(RxPacket([RxPFlags.DATA], 2, data=b'three', stream=3))
+        first = self.connection.accept_stream(timeout=0)
+        third = self.connection.accept_stream(timeout=0)
+        self.assertEqual((first.id, third.id), (1, 3))
+        self.assertEqual(third.receive(100, timeout=0), b'three')
+        self.assertEqual(self.communicator.acks[-1], (0, [(2, 2)]))
+        self.assertEqual(self.communicator.limits[-1], (3, RxPStream.WINDOW))
+        with self.assertRaises(RxPConnectionTimeoutException):
+            first.receive(100, timeout=0)
+        # the end of stream 1 overtakes its start
+        handle(RxPacket([RxPFlags.DATA, RxPFlags.FIN], 3, data=b'ne', stream=1, offset=1))
+        handle(RxPacket([RxPFlags.DATA], 1, data=b'o', stream=1))
+        self.assertEqual(self.communicator.acks[-1], (3, []))
+        self.assertEqual(first.receive(100, timeout=0), b'one')
+        self.assertIsNone(first.receive(100, timeout=0))
+        self.assertEqual(self.connection.out_of_order, {})
+        # copies of packets already taken change nothing
+        handle(RxPacket([RxPFlags.DATA], 2, data=b'three', stream=3))
+        self.assertEqual(self.connection.stats.snapshot()['duplicates_received'], 1)
+        with self.assertRaises(RxPConnectionTimeoutException):
+            third.receive(100, timeout=0)
+
+    """Test streams are neither opened nor taken when the handshake did not agree on them"""
+    def test_streams_not_negotiated(self):
+        self.connection.state = RxPConnectionState.ESTABLISHED
+        with self.assertRaises(RxPConnectionSendException):
+            self.connection.open_stream()
+        self.connection.handle_packet(RxPacket([RxPFlags.DATA], 1, data=b'one', stream=1))
+        self.assertEqual(self.communicator.acks, [])
+        self.assertEqual(self.connection.streams, {})
+        self.assertEqual(len(self.connection.receive_buffer), 0)
+
+    """Test a stream sends no further than the other side's window for it while another stream goes on"""
+    def test_stream_window(self):
+        self.connection.state = RxPConnectionState.ESTABLISHED
+        self.connection.streams_enabled = True
+        self.connection.set_window_size(1000)
+        self.connection.congestion.cwnd = 1000.0
+        self.communicator.rtt_estimator.rto = 0.01
+        stream = self.connection.open_stream()
+        self.assertEqual(stream.id, 2)
+        stream.write(bytes(RxPStream.WINDOW + 1000))
+        stream.close()
+        self.assertEqual(stream.send_offset, RxPStream.WINDOW)
+        other = self.connection.open_stream()
+        other.write(b'other')
+        self.assertEqual(self.communicator.streams[-1], (4, 0, False))
+        # with the window shut a probe asks for it again
+        deadline = time.time() + 5
+        while self.communicator.data[-1] is not None and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.communicator.streams[-1], (2, RxPStream.WINDOW, False))
+        # the other side read, its ACK opens the window and the rest goes with the FIN
+        self.connection._RxPConnection__handle_ack_packet(RxPacket([RxPFlags.ACK], None, ack=0, stream=2, offset=2 * RxPStream.WINDOW))
+        self.assertEqual(self.communicator.streams[-1][0::2], (2, True))
+        self.assertEqual(stream.send_offset, RxPStream.WINDOW + 1000)
+        self.connection.destroy()
+
     def test_active_close(self):
         self.connection.state = RxPConnectionState.ESTABLISHED
         self.connection.close()
         # test active flow
         self.assertEqual(RxPConnectionState.FIN_WAIT_1, self.connection.state)
 
+    """Test the FIN waits until everything written before close was sent and acknowledged"""
+    def test_close_after_data(self):
+        self.connection.state = RxPConnectionState.ESTABLISHED
+        self.connection.write(bytes(30 * self.connection.MAX_SEGMENT_SIZE))
+        self.connection.close()
+        self.assertEqual(self.communicator.fins, [])
+        self.assertEqual(RxPConnectionState.ESTABLISHED, self.connection.state)
+        with self.assertRaises(RxPConnectionSendException):
+            self.connection.write(b'too late')
+        while not self.communicator.fins:
+            self.connection._RxPConnection__handle_ack_packet(RxPacket([RxPFlags.ACK], None, ack=self.connection.last_seq, window=64))
+        # the FIN follows the last data packet and nothing is sent after it
+        self.assertEqual(sum(1 for data in self.communicator.data if data is not None), 30)
+        self.assertEqual(self.communicator.fins, [self.communicator.sent[-1][0] + 1])
+        self.assertEqual(RxPConnectionState.FIN_WAIT_1, self.connection.state)
+        self.connection.destroy()
+
     def test_passive_close(self):
         self.connection.state = RxPConnectionState.CLOSE_WAIT
         self.connection.close()
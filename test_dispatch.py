@@ -0,0 +1,60 @@
+import unittest
+import threading
+from dispatch import RxPPacketDispatcher
+
+
+"""Records the packets it handles and the threads it handled them on"""
+class DummyConnection:
+    def __init__(self, destinationport):
+        self.destinationip = "127.0.0.1"
+        self.destinationport = destinationport
+        self.handled = []
+        self.threads = set()
+
+    def handle_packet(self, packet):
+        self.handled.append(packet)
+        self.threads.add(threading.current_thread().name)
+
+
+class TestDispatch(unittest.TestCase):
+
+    """Test no workers handles the packet on the submitting thread"""
+    def test_inline(self):
+        dispatcher = RxPPacketDispatcher(0)
+        connection = DummyConnection(50001)
+        dispatcher.submit(connection, 1)
+        self.assertEqual(connection.handled, [1])
+        self.assertEqual(connection.threads, {threading.current_thread().name})
+
+    """Test packets of a connection are handled by one worker in the order they were submitted"""
+    def test_ordering(self):
+        dispatcher = RxPPacketDispatcher(4)
+        connections = [DummyConnection(port) for port in range(50000, 50016)]
+        for sequence in range(500):
+            for connection in connections:
+                dispatcher.submit(connection, sequence)
+        dispatcher.close()
+        for connection in connections:
+            self.assertEqual(connection.handled, list(range(500)))
+            self.assertEqual(len(connection.threads), 1)
+        # connections are spread over the workers
+        self.assertGreater(len(set.union(*[connection.threads for connection in connections])), 1)
+
+    """Test a failing handler does not stop the worker"""
+    def test_handler_exception(self):
+        dispatcher = RxPPacketDispatcher(1)
+        connection = DummyConnection(50001)
+        failing = DummyConnection(50002)
+        failing.handle_packet = lambda packet: 1 / 0
+        dispatcher.submit(failing, 1)
+        dispatcher.submit(connection, 2)
+        dispatcher.close()
+        self.assertEqual(connection.handled, [2])
+
+    def test_negative_workers(self):
+        with self.assertRaises(ValueError):
+            RxPPacketDispatcher(-1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import errno
+import os
+import shutil
+import tempfile
+from filesink import RxPFileSink
+
+
+class TestFileSink(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "received")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        with open(self.path, "rb") as received:
+            return received.read()
+
+    """Test chunks in order pass through the buffer and land in one file"""
+    def test_in_order(self):
+        data = os.urandom(100000)
+        sink = RxPFileSink(self.path, len(data), buffer_size=4096)
+        for start in range(0, len(data), 490):
+            sink.write(data[start:start + 490])
+        sink.close()
+        self.assertEqual(self.read(), data)
+        sink.close()
+
+    """Test chunks written at their offsets in any order make up the file"""
+    def test_offsets(self):
+        data = os.urandom(10000)
+        chunks = [(start, data[start:start + 1000]) for start in range(0, len(data), 1000)]
+        with RxPFileSink(self.path, len(data)) as sink:
+            for start, chunk in reversed(chunks):
+                sink.write(chunk, start)
+            self.assertEqual(os.path.getsize(self.path), len(data))
+        self.assertEqual(self.read(), data)
+
+    """Test a length over the limit is refused before the file is made"""
+    def test_max_length(self):
+        with self.assertRaises(OSError) as raised:
+            RxPFileSink(self.path, 2 ** 63, max_length=1000)
+        self.assertEqual(raised.exception.errno, errno.EFBIG)
+        self.assertFalse(os.path.exists(self.path))
+        RxPFileSink(self.path, 1000, max_length=1000).close()
+
+    """Test a transfer that ends early keeps what arrived and not the preallocated rest"""
+    def test_abort(self):
+        sink = RxPFileSink(self.path, 50000, buffer_size=4096)
+        sink.write(b'a' * 3000)
+        # bigger than the buffer and past the preallocated length
+        sink.write(b'b' * 70000)
+        sink.abort()
+        self.assertEqual(self.read(), b'a' * 3000 + b'b' * 70000)
+        sink = RxPFileSink(self.path, 50000)
+        sink.write(b'c' * 1000)
+        sink.abort()
+        self.assertEqual(self.read(), b'c' * 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
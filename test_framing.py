@@ -0,0 +1,160 @@
+import unittest
+import logging
+import os
+import shutil
+import tempfile
+import time
+from framing import RxPFrameDecoder, RxPFrameFormatException, RxPCommand, encode_frame, FRAME_START, FRAME_DATA, FRAME_END
+from fxaserver import Server
+from client import Client
+from threading import Thread
+
+
+"""The messages a decoder finds, as (command, name, payload)"""
+def decode(decoder, pieces):
+    messages = []
+    for piece in pieces:
+        for event, frame, chunk in decoder.feed(piece):
+            if event == FRAME_START:
+                messages.append([frame.command, frame.name, bytearray()])
+            elif event == FRAME_DATA:
+                messages[-1][2] += chunk
+            else:
+                messages[-1] = tuple(messages[-1])
+    return messages
+
+
+class TestFraming(unittest.TestCase):
+
+    """Test messages come back whatever the pieces the stream is cut into, markers of the old format included"""
+    def test_split_anywhere(self):
+        payload = b'|SEPARATOR|' + bytes(range(256)) * 4 + b'|END'
+        stream = encode_frame(RxPCommand.GET, "report.txt", 0) + encode_frame(RxPCommand.FILE, "report.txt_server", len(payload)) + payload
+        expected = [(RxPCommand.GET, "report.txt", b''), (RxPCommand.FILE, "report.txt_server", payload)]
+        for size in (1, 2, 7, 13, 100, len(stream)):
+            pieces = [stream[start:start + size] for start in range(0, len(stream), size)]
+            self.assertEqual(decode(RxPFrameDecoder(), pieces), expected)
+
+    """Test payload bytes are handed out as they arrive, not held until the message is complete"""
+    def test_streaming(self):
+        decoder = RxPFrameDecoder()
+        events = decoder.feed(encode_frame(RxPCommand.FILE, "big", 1000) + bytes(10))
+        self.assertEqual([(event, len(chunk)) for event, frame, chunk in events], [(FRAME_START, 0), (FRAME_DATA, 10)])
+        events = decoder.feed(bytes(990))
+        self.assertEqual([event for event, frame, chunk in events], [FRAME_DATA, FRAME_END])
+        self.assertTrue(events[-1][1].complete())
+
+    def test_bad_frames(self):
+        with self.assertRaises(RxPFrameFormatException):
+            RxPFrameDecoder().feed(b'\x09' + encode_frame(RxPCommand.GET, "x", 0)[1:])
+        wire = bytearray(encode_frame(RxPCommand.GET, "x", 0))
+        wire[1] = 99
+        with self.assertRaises(RxPFrameFormatException):
+            RxPFrameDecoder().feed(wire)
+
+
+class TestFileTransfer(unittest.TestCase):
+
+    def read(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as file:
+            return file.read()
+
+    """Test a post and a get between the FxA client and server over loopback"""
+    def test_post_and_get(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "hello")
+        contents = b'hello |SEPARATOR| world |END|' * 1000
+        with open(path, 'wb') as file:
+            file.write(contents)
+        server = Server(0, "127.0.0.1", 0, logging.WARNING)
+        server.start()
+        client = Client(0, "127.0.0.1", server.socket.port, logging.WARNING)
+        connection = client.connect()
+        receiver = Thread(target=client.handle_receive_data, args=(connection,))
+        receiver.daemon = True
+        receiver.start()
+        self.assertEqual(client.post(path), len(contents))
+        client.get(path)
+        deadline = time.time() + 10
+        copies = [path + "_client", path + "_server"]
+        # copies are preallocated, their size is right before their contents are
+        while time.time() < deadline and not all(self.read(copy) == contents for copy in copies):
+            time.sleep(0.05)
+        for copy in copies:
+            with open(copy, 'rb') as file:
+                self.assertEqual(file.read(), contents)
+        connection.close()
+        server.stop()
+
+    """Test a post of a file over the server's limit closes the connection without writing it"""
+    def test_post_too_large(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "big")
+        with open(path, 'wb') as file:
+            file.write(bytes(1000))
+        server = Server(0, "127.0.0.1", 0, logging.WARNING)
+        server.MAX_FILE_SIZE = 100
+        server.start()
+        client = Client(0, "127.0.0.1", server.socket.port, logging.WARNING)
+        connection = client.connect()
+        receiver = Thread(target=client.handle_receive_data, args=(connection,))
+        receiver.daemon = True
+        receiver.start()
+        client.post(path)
+        # the server closes, the client reads to the end of the stream
+        receiver.join(10)
+        self.assertFalse(receiver.is_alive())
+        self.assertFalse(os.path.exists(path + "_client"))
+        connection.close()
+        server.stop()
+
+    """Test a get asked for in the handshake of a fast open server"""
+    def test_fast_open_get(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "hello")
+        with open(path, 'wb') as file:
+            file.write(b'hello' * 100)
+        server = Server(0, "127.0.0.1", 0, logging.WARNING, fast_open=True)
+        server.start()
+        client = Client(0, "127.0.0.1", server.socket.port, logging.WARNING)
+        connection = client.connect(get=path)
+        receiver = Thread(target=client.handle_receive_data, args=(connection,))
+        receiver.daemon = True
+        receiver.start()
+        deadline = time.time() + 10
+        while time.time() < deadline and self.read(path + "_server") != b'hello' * 100:
+            time.sleep(0.05)
+        self.assertEqual(self.read(path + "_server"), b'hello' * 100)
+        connection.close()
+        server.stop()
+
+    """Test gets of several files at once, each on a stream of its own"""
+    def test_concurrent_gets(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        files = {}
+        for name, size in (("big", 1000000), ("small", 100), ("empty", 0)):
+            files[os.path.join(directory, name)] = os.urandom(size)
+        for path, contents in files.items():
+            with open(path, 'wb') as file:
+                file.write(contents)
+        server = Server(0, "127.0.0.1", 0, logging.WARNING)
+        server.start()
+        client = Client(0, "127.0.0.1", server.socket.port, logging.WARNING)
+        connection = client.connect()
+        receivers = [client.get(path) for path in files]
+        for receiver in receivers:
+            receiver.join(20)
+        for path, contents in files.items():
+            self.assertEqual(self.read(path + "_server"), contents)
+        connection.close()
+        server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import time
+from handshake import RxPHalfOpenTable
+
+
+class TestHalfOpenTable(unittest.TestCase):
+
+    """Test a full table makes room by evicting the oldest handshake"""
+    def test_limit(self):
+        evicted = []
+        table = RxPHalfOpenTable(limit=3, on_evict=lambda key, entry: evicted.append(key))
+        for port in range(5):
+            table.add(("127.0.0.1", port), (port, 100 + port))
+        self.assertEqual(len(table), 3)
+        self.assertEqual(evicted, [("127.0.0.1", 0), ("127.0.0.1", 1)])
+        self.assertNotIn(("127.0.0.1", 0), table)
+        self.assertEqual(table.pop(("127.0.0.1", 4)), (4, 104))
+        self.assertIsNone(table.pop(("127.0.0.1", 4)))
+        # completed handshakes are not evictions
+        self.assertEqual(table.evictions, 2)
+
+    """Test handshakes are forgotten once they time out"""
+    def test_timeout(self):
+        evicted = []
+        table = RxPHalfOpenTable(timeout=0.05, on_evict=lambda key, entry: evicted.append(entry))
+        table.add("a", 1)
+        table.add("b", 2)
+        self.assertLessEqual(table.next_expiry(), 0.05)
+        time.sleep(0.06)
+        table.add("c", 3)
+        self.assertEqual(evicted, [1, 2])
+        self.assertEqual(list(table.entries), ["c"])
+        time.sleep(0.06)
+        self.assertIsNone(table.get("c"))
+        self.assertEqual(table.expire(), 0)
+        self.assertIsNone(table.next_expiry())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import io
+import logging
+from logs import get_logger, configure_logging, RxPPacketTrace, RxPStreamHandler, ROOT_LOGGER
+from packet import RxPacket, RxPFlags
+
+
+"""Counts how often it is turned into a string"""
+class Formatted:
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count += 1
+        return "formatted"
+
+
+class TestLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.output = io.StringIO()
+        configure_logging(stream=self.output)
+
+    def tearDown(self):
+        configure_logging(stream=None)
+
+    """Test loggers share the one handler however many are made"""
+    def test_one_handler(self):
+        for index in range(10):
+            get_logger("Connection", logging.DEBUG, "Connection %s" % index)
+        handlers = [handler for handler in logging.getLogger(ROOT_LOGGER).handlers if isinstance(handler, RxPStreamHandler)]
+        self.assertEqual(len(handlers), 1)
+        self.assertEqual(logging.getLogger("%s.Connection" % ROOT_LOGGER).handlers, [])
+
+    """Test arguments are only formatted for records at an enabled level"""
+    def test_lazy_formatting(self):
+        argument = Formatted()
+        quiet = get_logger("Connection", logging.INFO, "quiet")
+        quiet.debug("Received packet %s", argument)
+        self.assertEqual(argument.count, 0)
+        self.assertFalse(quiet.isEnabledFor(logging.DEBUG))
+        verbose = get_logger("Connection", logging.DEBUG, "verbose")
+        verbose.debug("Received packet %s", argument)
+        self.assertIn("verbose: Received packet formatted", self.output.getvalue())
+        self.assertNotIn("quiet", self.output.getvalue())
+
+    """Test the trace keeps the last packets and dumps them oldest first"""
+    def test_packet_trace(self):
+        trace = RxPPacketTrace(4)
+        for sequence in range(1, 7):
+            trace.record(RxPPacketTrace.SENT, RxPacket([RxPFlags.DATA, RxPFlags.PSH], sequence, data=b'x' * sequence, destport=50001))
+        trace.record(RxPPacketTrace.RECEIVED, RxPacket([RxPFlags.ACK], None, ack=6, window=12, sourceport=50001))
+        records = trace.records()
+        self.assertEqual([record[3] for record in records], [4, 5, 6, 0])
+        self.assertEqual(records[0][6], 4)
+        self.assertEqual(records[-1][1:], (RxPPacketTrace.RECEIVED, 0x02, 0, 6, 12, 0, 50001))
+        output = io.StringIO()
+        trace.dump(output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertIn("out port 50001 flags 0x30 seq 4", lines[0])
+        self.assertIn("in port 50001 flags 0x02 seq 0 ack 6 window 12", lines[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
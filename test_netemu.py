@@ -0,0 +1,76 @@
+import unittest
+import logging
+import time
+from threading import Thread
+from netemu import RxPNetEmu
+from protocol import RxP
+
+
+class TestNetEmu(unittest.TestCase):
+
+    def emulator(self, **impairments):
+        emulator = RxPNetEmu("127.0.0.1", 0, loglevel=logging.WARNING, **impairments)
+        self.addCleanup(emulator.sock.close)
+        return emulator
+
+    """Test the same seed makes the same decisions"""
+    def test_seeded(self):
+        fates = []
+        for run in range(2):
+            emulator = self.emulator(loss=0.2, duplicate=0.2, reorder=0.2, corrupt=0.2, delay=0.01, jitter=0.005, seed=7)
+            fates.append([emulator.impair(bytes([i]) * 100, i * 0.001) for i in range(200)])
+            stats = emulator.stats
+        self.assertEqual(fates[0], fates[1])
+        self.assertEqual(stats['received'], 200)
+        for impairment in ('lost', 'duplicated', 'reordered', 'corrupted'):
+            self.assertGreater(stats[impairment], 10)
+
+    def test_loss_and_duplicate(self):
+        self.assertEqual(self.emulator(loss=1.0).impair(b'data', 0.0), [])
+        self.assertEqual(self.emulator(duplicate=1.0).impair(b'data', 0.0), [(0.0, b'data'), (0.0, b'data')])
+
+    def test_corrupt_flips_one_bit(self):
+        [(departure, data)] = self.emulator(corrupt=1.0, seed=1).impair(bytes(64), 0.0)
+        self.assertEqual(sum(bin(byte).count('1') for byte in data), 1)
+
+    """Test datagrams leave one after the other at the link speed and are dropped when the queue is full"""
+    def test_bandwidth(self):
+        emulator = self.emulator(bandwidth=1000, queue_limit=300, delay=0.05)
+        departures = [emulator.impair(bytes(100), 0.0) for i in range(4)]
+        self.assertEqual([round(fate[0][0], 3) for fate in departures[:3]], [0.15, 0.25, 0.35])
+        self.assertEqual(departures[3], [])
+        self.assertEqual(emulator.stats['queue_dropped'], 1)
+
+    def test_pairing(self):
+        emulator = self.emulator()
+        self.assertEqual(emulator.destination_for(("127.0.0.1", 5000)), ("127.0.0.1", 5001))
+        self.assertEqual(emulator.destination_for(("127.0.0.1", 5001)), ("127.0.0.1", 5000))
+
+    """Test a transfer through the emulator with loss, duplication, reordering and corruption"""
+    def test_transfer(self):
+        emulator = self.emulator(loss=0.05, duplicate=0.02, reorder=0.05, corrupt=0.02, delay=0.002, seed=3)
+        emulator.start()
+        self.addCleanup(emulator.stop)
+        server = RxP(logging.CRITICAL)
+        server.listen("127.0.0.1", 0)
+        # the client has to be on the port paired with the server's
+        client = RxP(logging.CRITICAL)
+        accepted = []
+        Thread(target=lambda: accepted.append(server.accept()), daemon=True).start()
+        connection = client.connect("127.0.0.1", server.port - 1 if server.port % 2 else server.port + 1, "127.0.0.1", emulator.port)
+        payload = bytes(range(256)) * 200
+        connection.send("post", payload)
+        expected = b'post|SEPARATOR|' + payload
+        data = bytearray()
+        deadline = time.time() + 20
+        while len(data) < len(expected) and time.time() < deadline:
+            if accepted and len(accepted[0].receive_buffer):
+                data.extend(accepted[0].receive(len(expected)))
+            else:
+                time.sleep(0.001)
+        self.assertEqual(bytes(data), expected)
+        self.assertGreater(emulator.stats['lost'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
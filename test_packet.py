@@ -0,0 +1,94 @@
+import unittest
+from packet import RxPacket, RxPFlags, RxPOption, RxPacketFormatException, RxPPacketPool
+
+
+class TestPacket(unittest.TestCase):
+
+    """Test packing a packet into the fixed header and reading it back"""
+    def test_serialize_round_trip(self):
+        packet = RxPacket([RxPFlags.SYN, RxPFlags.ACK], 7, ack=3, data=b'hello', sourceport=50001, destport=50002, window=12)
+        packet.checksum = RxPacket.calculate_checksum(packet)
+        wire = RxPacket.serialize(packet)
+        self.assertEqual(len(wire), RxPacket.HEADER_SIZE + 5)
+        received = RxPacket.deserialize(wire)
+        self.assertEqual(received.flags, RxPFlags.SYN | RxPFlags.ACK)
+        self.assertEqual(received.sequence, 7)
+        self.assertEqual(received.ack, 3)
+        self.assertEqual(received.sourceport, 50001)
+        self.assertEqual(received.destport, 50002)
+        self.assertEqual(received.window, 12)
+        self.assertEqual(bytes(received.data), b'hello')
+        self.assertIsInstance(received.data, memoryview)
+        self.assertEqual(received.checksum, RxPacket.calculate_checksum(received))
+
+    """Test that datagrams of another format version are rejected"""
+    def test_unknown_version(self):
+        wire = bytearray(RxPacket.serialize(RxPacket([RxPFlags.DATA], 1, data=b'x')))
+        wire[0] = 0x80
+        with self.assertRaises(RxPacketFormatException):
+            RxPacket.deserialize(wire)
+
+    """Test that a truncated datagram is rejected"""
+    def test_truncated(self):
+        wire = RxPacket.serialize(RxPacket([RxPFlags.DATA], 1, data=b'hello'))
+        with self.assertRaises(RxPacketFormatException):
+            RxPacket.deserialize(wire[:-1])
+
+    """Test flags are one bitmask, whether given as a bitmask or a list of flags"""
+    def test_flags(self):
+        packet = RxPacket([RxPFlags.DATA, RxPFlags.PSH], 1)
+        self.assertEqual(packet.flags, RxPFlags.DATA | RxPFlags.PSH)
+        self.assertTrue(packet.flags & RxPFlags.PSH)
+        self.assertFalse(packet.flags & RxPFlags.ACK)
+        self.assertEqual(RxPFlags.names(packet.flags), ['DATA', 'PSH'])
+        with self.assertRaises(AttributeError):
+            packet.unknown = 1
+
+    """Test released packets are handed out again without the data they held"""
+    def test_pool(self):
+        pool = RxPPacketPool(1)
+        packet = pool.acquire(RxPFlags.DATA, 1, data=b'hello')
+        pool.release(packet)
+        pool.release(RxPacket(RxPFlags.DATA, 2))
+        self.assertIsNone(packet.data)
+        self.assertEqual(len(pool.free), 1)
+        reused = pool.acquire(RxPFlags.ACK, None, ack=1, window=3)
+        self.assertIs(reused, packet)
+        self.assertEqual((reused.flags, reused.ack, reused.window, reused.transmissions), (RxPFlags.ACK, 1, 3, 0))
+        received = RxPacket.deserialize(RxPacket.serialize(RxPacket(RxPFlags.DATA, 5, data=b'x')), pool)
+        self.assertEqual(received.sequence, 5)
+
+    """Test the data of a fast open SYN follows its options, whatever bytes it holds"""
+    def test_fast_open_options(self):
+        data = RxPacket.pack_fast_open({RxPOption.CHECKSUM: bytes([1, 2])}, b'\x01\x05get')
+        self.assertEqual(RxPacket.unpack_options(data), {RxPOption.CHECKSUM: bytes([1, 2]), RxPOption.FAST_OPEN: bytes([0, 5])})
+        self.assertEqual(RxPacket.unpack_fast_open(memoryview(data)), b'\x01\x05get')
+        self.assertIsNone(RxPacket.unpack_fast_open(RxPacket.pack_options({RxPOption.CHECKSUM: bytes([1])})))
+        self.assertIsNone(RxPacket.unpack_fast_open(None))
+
+    """Test SACK blocks beyond MAX_SACK_BLOCKS are ignored and only known sequences are looked at"""
+    def test_sack(self):
+        blocks = [(index * 10, index * 10 + 5) for index in range(RxPacket.MAX_SACK_BLOCKS + 3)]
+        self.assertEqual(RxPacket.unpack_sack(RxPacket.pack_sack(blocks)), blocks[:RxPacket.MAX_SACK_BLOCKS])
+        self.assertEqual(RxPacket.sacked([1, 2, 3, 7, 4000000000], [(2, 3), (5, 0xFFFFFFFF)]), [2, 3, 7, 4000000000])
+
+    """Test packets of an opened stream carry it and their offset in it in the longer header"""
+    def test_stream_header(self):
+        packet = RxPacket([RxPFlags.DATA, RxPFlags.FIN], 9, data=b'tail', stream=3, offset=1 << 33)
+        packet.checksum = RxPacket.calculate_checksum(packet)
+        wire = RxPacket.serialize(packet)
+        self.assertEqual(wire[0], RxPacket.STREAM_VERSION)
+        self.assertEqual(len(wire), RxPacket.STREAM_HEADER_SIZE + 4)
+        received = RxPacket.deserialize(wire)
+        self.assertEqual((received.stream, received.offset, bytes(received.data)), (3, 1 << 33, b'tail'))
+        self.assertTrue(RxPacket.verify_checksum(wire, received))
+        # the connection's own stream keeps the short header
+        self.assertEqual(RxPacket.serialize(RxPacket([RxPFlags.DATA], 1, data=b'x'))[0], RxPacket.VERSION)
+        wire = bytearray(wire)
+        wire[18:20] = bytes(2)
+        with self.assertRaises(RxPacketFormatException):
+            RxPacket.deserialize(wire)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,244 @@
+import unittest
+import logging
+import os
+import socket
+import threading
+import time
+from threading import Thread
+from protocol import RxP
+from connection import RxPConnectionState, RxPConnectionTimeoutException
+from packet import RxPacket, RxPFlags
+from checksum import DEFAULT_CHECKSUM
+from tickets import RxPTicketIssuer, RxPSessionCache
+
+
+class TestProtocol(unittest.TestCase):
+
+    def setUp(self):
+        self.server = RxP(logging.WARNING)
+        self.server.listen("127.0.0.1", 0)
+
+    """Read from a connection until count bytes arrived"""
+    def receive_all(self, connection, count, timeout=10):
+        data = bytearray()
+        deadline = time.monotonic() + timeout
+        while len(data) < count:
+            try:
+                chunk = connection.receive(count - len(data), timeout=max(0.0, deadline - time.monotonic()))
+            except RxPConnectionTimeoutException:
+                break
+            if chunk is None:
+                break
+            data.extend(chunk)
+        return bytes(data)
+
+    """Test one listening socket serving several clients at the same time"""
+    def test_concurrent_connections(self):
+        clients = [RxP(logging.WARNING) for i in range(3)]
+        connections = [None] * len(clients)
+        def connect(index):
+            connections[index] = clients[index].connect("127.0.0.1", 0, "127.0.0.1", self.server.port)
+        threads = [Thread(target=connect, args=(index,)) for index in range(len(clients))]
+        for thread in threads:
+            thread.start()
+        accepted = {}
+        for i in range(len(clients)):
+            connection = self.server.accept()
+            accepted[connection.destinationport] = connection
+        for thread in threads:
+            thread.join(5)
+        for index, connection in enumerate(connections):
+            self.assertIs(connection.state, RxPConnectionState.ESTABLISHED)
+            connection.send("client %s" % index, bytes([index]) * 2000)
+        for index, connection in enumerate(connections):
+            expected = ("client %s|SEPARATOR|" % index).encode('utf-8') + bytes([index]) * 2000
+            self.assertEqual(self.receive_all(accepted[clients[index].port], len(expected)), expected)
+
+    """Test a flood of SYNs that never complete stays within the half open limit and times out"""
+    def test_syn_flood(self):
+        self.server.initiating_connections.limit = 8
+        self.server.initiating_connections.timeout = 0.3
+        flood = []
+        for index in range(20):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.addCleanup(sock.close)
+            sock.sendto(RxPacket.serialize(RxPacket(RxPFlags.SYN, 1, destport=self.server.port), DEFAULT_CHECKSUM), ("127.0.0.1", self.server.port))
+            flood.append(sock)
+        deadline = time.time() + 5
+        while self.server.info()['socket']['half_open_evictions'] < 12 and time.time() < deadline:
+            time.sleep(0.01)
+        info = self.server.info()['socket']
+        self.assertEqual(info['half_open'], 8)
+        self.assertEqual(info['half_open_evictions'], 12)
+        # clients that finish the handshake still get in
+        client = RxP(logging.WARNING)
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", self.server.port)
+        self.assertEqual(self.server.accept().destinationport, client.port)
+        self.assertIs(connection.state, RxPConnectionState.ESTABLISHED)
+        while self.server.info()['socket']['half_open'] and time.time() < deadline:
+            time.sleep(0.05)
+        info = self.server.info()['socket']
+        self.assertEqual(info['half_open'], 0)
+        # nothing is resent to the peers that never answered
+        self.assertEqual(info['waiting_to_be_acked'], 0)
+        self.assertEqual(info['peers'], 1)
+
+    """Test data in the SYN reaches a fast open server before the handshake completes, and the answer comes back"""
+    def test_fast_open(self):
+        server = RxP(logging.WARNING, fast_open=True)
+        server.listen("127.0.0.1", 0)
+        client = RxP(logging.WARNING)
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", server.port, data=b'get hello')
+        accepted = server.accept()
+        self.assertEqual(accepted.receive(100, timeout=5), b'get hello')
+        accepted.write(b'hello back')
+        self.assertEqual(self.receive_all(connection, 10), b'hello back')
+        # nothing went again after the SYN
+        self.assertEqual(connection.info()['data_packets_sent'], 0)
+        connection.write(b'more')
+        self.assertEqual(accepted.receive(100, timeout=5), b'more')
+
+    """Test a server without fast open gets the data of the SYN as normal data, and so does the rest"""
+    def test_fast_open_fallback(self):
+        client = RxP(logging.WARNING)
+        data = bytes(range(256)) * 8
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", self.server.port, data=data)
+        accepted = self.server.accept()
+        self.assertEqual(self.receive_all(accepted, len(data)), data)
+        server = RxP(logging.WARNING, fast_open=True)
+        server.listen("127.0.0.1", 0)
+        client = RxP(logging.WARNING)
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", server.port, data=data)
+        accepted = server.accept()
+        self.assertEqual(self.receive_all(accepted, len(data)), data)
+
+    """Test a client that comes back with the ticket of its last connection starts where that one ended"""
+    def test_resumption(self):
+        server = RxP(logging.WARNING, tickets=RxPTicketIssuer())
+        server.listen("127.0.0.1", 0)
+        sessions = RxPSessionCache()
+        client = RxP(logging.WARNING, sessions=sessions)
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", server.port)
+        accepted = server.accept()
+        data = bytes(200000)
+        accepted.write(data)
+        self.assertEqual(self.receive_all(connection, len(data)), data)
+        connection.close()
+        deadline = time.time() + 10
+        while sessions.get(("127.0.0.1", server.port)) is None and time.time() < deadline:
+            time.sleep(0.01)
+        session = server.tickets.redeem("127.0.0.1", sessions.get(("127.0.0.1", server.port)).ticket)
+        self.assertGreater(session.cwnd, 10)
+        client = RxP(logging.WARNING, sessions=sessions)
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", server.port)
+        accepted = server.accept()
+        info = accepted.info()
+        self.assertEqual(info['cwnd'], session.cwnd)
+        self.assertFalse(accepted.congestion.in_slow_start())
+        self.assertIsNotNone(info['srtt'])
+        self.assertEqual(server.info()['socket']['sessions_resumed'], 1)
+        self.assertEqual(client.info()['socket']['sessions_resumed'], 1)
+        # a server without an issuer ignores the ticket
+        sessions.put(("127.0.0.1", self.server.port), sessions.get(("127.0.0.1", server.port)))
+        client = RxP(logging.WARNING, sessions=sessions)
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", self.server.port)
+        accepted = self.server.accept()
+        self.assertEqual(accepted.info()['cwnd'], 10)
+        self.assertEqual(client.info()['socket']['sessions_resumed'], 0)
+
+    """Test closing straight after a large write still delivers every byte before the end of the stream"""
+    def test_close_after_write(self):
+        client = RxP(logging.WARNING)
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", self.server.port)
+        accepted = self.server.accept()
+        data = os.urandom(1000000)
+        connection.write(data)
+        connection.close()
+        received = bytearray()
+        while True:
+            chunk = accepted.receive(65536, timeout=10)
+            if chunk is None:
+                break
+            received.extend(chunk)
+        self.assertEqual(bytes(received), data)
+        accepted.close()
+        deadline = time.time() + 10
+        while connection.state is not RxPConnectionState.CLOSED and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertIs(connection.state, RxPConnectionState.CLOSED)
+
+    """Test nothing is kept about a peer once its connection closed"""
+    def test_close_forgets_peer(self):
+        for index in range(3):
+            client = RxP(logging.WARNING)
+            connection = client.connect("127.0.0.1", 0, "127.0.0.1", self.server.port)
+            accepted = self.server.accept()
+            connection.write(b'hello')
+            self.assertEqual(accepted.receive(100, timeout=5), b'hello')
+            connection.close()
+            self.assertIsNone(accepted.receive(100, timeout=5))
+            accepted.close()
+            deadline = time.time() + 10
+            while accepted.state is not RxPConnectionState.CLOSED and time.time() < deadline:
+                time.sleep(0.01)
+        communicator = self.server.communicator
+        self.assertEqual(self.server.info()['socket']['peers'], 0)
+        self.assertEqual((communicator.rtt_estimators, communicator.duplicate_acks, communicator.peer_checksums), ({}, {}, {}))
+
+    """Test closing a socket stops every thread it started and closes the socket"""
+    def test_close_socket(self):
+        threads = threading.active_count()
+        server = RxP(logging.WARNING)
+        server.listen("127.0.0.1", 0)
+        client = RxP(logging.WARNING)
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", server.port)
+        accepted = server.accept()
+        connection.write(b'hello')
+        self.assertEqual(accepted.receive(100, timeout=5), b'hello')
+        self.assertGreater(threading.active_count(), threads)
+        for rxp in (client, server):
+            rxp.close()
+            self.assertEqual(rxp.sock.fileno(), -1)
+        self.assertIs(connection.state, RxPConnectionState.CLOSED)
+        deadline = time.time() + 5
+        while threading.active_count() > threads and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(threading.active_count(), threads)
+        client.close()
+
+    """Test streams of a connection carry data on their own, a stream nobody reads does not hold up another"""
+    def test_streams(self):
+        client = RxP(logging.WARNING)
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", self.server.port)
+        accepted = self.server.accept()
+        self.assertTrue(connection.streams_enabled and accepted.streams_enabled)
+        data = bytes(range(256)) * 1000
+        big = connection.open_stream()
+        big.write(data)
+        big.close()
+        small = connection.open_stream()
+        small.write(b'small')
+        small.close()
+        first = accepted.accept_stream(timeout=5)
+        second = accepted.accept_stream(timeout=5)
+        self.assertEqual((first.id, second.id), (1, 3))
+        # the first stream fills its window before the second is read
+        self.assertEqual(second.receive(100, timeout=5), b'small')
+        self.assertIsNone(second.receive(100, timeout=5))
+        received = bytearray()
+        while True:
+            chunk = first.receive(65536, timeout=5)
+            if chunk is None:
+                break
+            received.extend(chunk)
+        self.assertEqual(bytes(received), data)
+        second.write(b'answer')
+        second.close()
+        self.assertEqual(small.receive(100, timeout=5), b'answer')
+        self.assertIsNone(small.receive(100, timeout=5))
+        # done both ways, only the first stream is still open
+        self.assertEqual(connection.info()['streams'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import time
+from threading import Event
+from rtt import RxPRTTEstimator
+from timers import RxPTimerQueue
+
+
+class TestRTTEstimator(unittest.TestCase):
+
+    def test_first_sample(self):
+        estimator = RxPRTTEstimator()
+        estimator.sample(0.1)
+        self.assertAlmostEqual(estimator.srtt, 0.1)
+        self.assertAlmostEqual(estimator.rttvar, 0.05)
+        self.assertAlmostEqual(estimator.rto, 0.3)
+
+    def test_smoothing(self):
+        estimator = RxPRTTEstimator()
+        estimator.sample(0.1)
+        estimator.sample(0.2)
+        self.assertAlmostEqual(estimator.rttvar, 0.75 * 0.05 + 0.25 * 0.1)
+        self.assertAlmostEqual(estimator.srtt, 0.875 * 0.1 + 0.125 * 0.2)
+
+    def test_bounds_and_backoff(self):
+        estimator = RxPRTTEstimator(min_rto=0.02, max_rto=1.0)
+        estimator.sample(0.0001)
+        self.assertEqual(estimator.rto, 0.02)
+        for i in range(10):
+            estimator.backoff()
+        self.assertEqual(estimator.rto, 1.0)
+
+    def test_restore(self):
+        estimator = RxPRTTEstimator()
+        estimator.restore(0.1, 0.05)
+        self.assertAlmostEqual(estimator.rto, 0.3)
+        # a measurement taken before the restore is folded in after it
+        estimator = RxPRTTEstimator()
+        estimator.sample(0.2)
+        estimator.restore(0.1, 0.05)
+        self.assertAlmostEqual(estimator.srtt, 0.875 * 0.1 + 0.125 * 0.2)
+        # a new measurement resets the backoff
+        estimator.sample(0.0001)
+        self.assertEqual(estimator.backoffs, 0)
+
+
+class TestTimerQueue(unittest.TestCase):
+
+    def test_order_and_cancel(self):
+        timers = RxPTimerQueue()
+        fired = []
+        done = Event()
+        timers.schedule(0.03, fired.append, 3)
+        timers.schedule(0.01, fired.append, 1)
+        cancelled = timers.schedule(0.02, fired.append, 2)
+        timers.schedule(0.04, done.set)
+        cancelled.cancel()
+        self.assertTrue(done.wait(1))
+        self.assertEqual(fired, [1, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
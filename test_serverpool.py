@@ -0,0 +1,68 @@
+import unittest
+import logging
+import os
+import signal
+import time
+from threading import Thread
+from protocol import RxP
+from serverpool import RxPServerPool
+
+
+"""Accept connections and read everything they send, in a worker of the pool"""
+def start_reader(ip, port):
+    rxp = RxP(logging.WARNING)
+    rxp.listen(ip, port, reuse_port=True)
+    def read(connection):
+        while connection.receive(65536) is not None:
+            pass
+    def serve():
+        while True:
+            Thread(target=read, args=(rxp.accept(),), daemon=True).start()
+    Thread(target=serve, daemon=True).start()
+    return rxp
+
+
+class TestServerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = RxPServerPool(start_reader, "127.0.0.1", 0, processes=2, interval=0.1, loglevel=logging.WARNING)
+        self.pool.start()
+        self.addCleanup(self.pool.stop)
+
+    def wait_for(self, condition, timeout=10):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.05)
+        return condition()
+
+    """Test clients connect to the shared port and the stats of the workers add up"""
+    def test_shared_port(self):
+        clients = []
+        for index in range(6):
+            client = RxP(logging.WARNING)
+            connection = client.connect("127.0.0.1", 0, "127.0.0.1", self.pool.port)
+            connection.send("post", bytes(1000))
+            clients.append(client)
+        received = len("post|SEPARATOR|") + 1000
+        self.assertTrue(self.wait_for(lambda: len(self.pool.info()['connections']) == 6))
+        info = self.pool.info()
+        self.assertEqual(info['socket']['workers'], 2)
+        self.assertEqual(info['socket']['peers'], 6)
+        self.assertEqual(sorted(info['connections']), sorted("127.0.0.1:%s" % client.port for client in clients))
+        self.assertTrue(self.wait_for(lambda: all(connection['data_bytes_received'] == received
+            for connection in self.pool.info()['connections'].values())))
+
+    """Test a worker that dies is started again"""
+    def test_restart(self):
+        self.assertTrue(self.wait_for(lambda: len(self.pool.worker_info) == 2))
+        killed = self.pool.workers[0].pid
+        os.kill(killed, signal.SIGKILL)
+        self.assertTrue(self.wait_for(lambda: self.pool.restarts == 1 and self.pool.info()['socket']['workers'] == 2))
+        self.assertNotEqual(self.pool.workers[0].pid, killed)
+        client = RxP(logging.WARNING)
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", self.pool.port)
+        self.assertIsNotNone(connection)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import logging
+import time
+import urllib.request
+from threading import Thread
+from protocol import RxP
+from stats import RxPStats, RxPStatsExporter, render_prometheus
+
+
+class TestStats(unittest.TestCase):
+
+    def test_snapshot_is_a_copy(self):
+        stats = RxPStats(('packets_sent', 'bytes_sent'))
+        stats.add('packets_sent')
+        stats.add('bytes_sent', 100)
+        snapshot = stats.snapshot()
+        stats.add('packets_sent')
+        self.assertEqual(snapshot, {'packets_sent': 1, 'bytes_sent': 100})
+
+    """Test the counters and gauges after a transfer, and their Prometheus rendering"""
+    def test_transfer_info(self):
+        server = RxP(logging.WARNING)
+        server.listen("127.0.0.1", 0)
+        client = RxP(logging.WARNING)
+        accepted = []
+        acceptor = Thread(target=lambda: accepted.append(server.accept()), daemon=True)
+        acceptor.start()
+        connection = client.connect("127.0.0.1", 0, "127.0.0.1", server.port)
+        acceptor.join(5)
+        connection.send("post", bytes(5000))
+        deadline = time.time() + 10
+        while len(accepted[0].receive_buffer) < 5010 and time.time() < deadline:
+            time.sleep(0.01)
+        # the last ACK may still be on its way
+        while connection.info()['in_flight'] and time.time() < deadline:
+            time.sleep(0.01)
+        sent = connection.info()
+        self.assertEqual(sent['data_bytes_sent'], len("post|SEPARATOR|") + 5000)
+        self.assertEqual(sent['data_packets_sent'], 11)
+        self.assertEqual(sent['in_flight'], 0)
+        self.assertEqual(sent['state'], 'ESTABLISHED')
+        self.assertGreater(sent['rtt_samples'], 0)
+        self.assertIsNotNone(sent['srtt'])
+        received = accepted[0].info()
+        self.assertEqual(received['data_bytes_received'], sent['data_bytes_sent'])
+        self.assertEqual(received['receive_buffered'], sent['data_bytes_sent'])
+        self.assertGreater(received['acks_sent'], 0)
+        info = server.info()
+        self.assertGreaterEqual(info['socket']['packets_received'], 12)
+        self.assertEqual(list(info['connections']), ["127.0.0.1:%s" % client.port])
+        text = render_prometheus([server])
+        self.assertIn('# TYPE rxp_socket_packets_received_total counter', text)
+        self.assertIn('rxp_connection_receive_buffered{local="127.0.0.1:%s",peer="127.0.0.1:%s"} %s' % (server.port, client.port, sent['data_bytes_sent']), text)
+
+    def test_exporter_http(self):
+        server = RxP(logging.WARNING)
+        server.listen("127.0.0.1", 0)
+        exporter = RxPStatsExporter([server], port=0)
+        exporter.start()
+        self.addCleanup(exporter.stop)
+        body = urllib.request.urlopen("http://127.0.0.1:%s/metrics" % exporter.port, timeout=5).read().decode('utf-8')
+        self.assertIn('rxp_socket_packets_sent_total{local="127.0.0.1:%s"} 0' % server.port, body)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import unittest
+import time
+from tickets import RxPSession, RxPTicketIssuer, RxPSessionCache
+
+
+class TestTicketIssuer(unittest.TestCase):
+
+    def setUp(self):
+        self.issuer = RxPTicketIssuer()
+        self.session = RxPSession(0.05, 0.01, 40.0, 30.0)
+
+    """Test a ticket gives back the session it was issued for"""
+    def test_redeem(self):
+        session = self.issuer.redeem("10.0.0.1", self.issuer.issue("10.0.0.1", self.session))
+        self.assertAlmostEqual(session.srtt, 0.05)
+        self.assertAlmostEqual(session.rttvar, 0.01)
+        self.assertEqual(session.cwnd, 40.0)
+        self.assertEqual(session.ssthresh, 30.0)
+        # a connection that never measured a round trip has no estimate to resume
+        session = self.issuer.redeem("10.0.0.1", self.issuer.issue("10.0.0.1", RxPSession(None, None, 10.0, float('inf'))))
+        self.assertIsNone(session.srtt)
+        self.assertEqual(session.ssthresh, float('inf'))
+
+    """Test changed tickets, tickets of another address or another server and truncated ones are refused"""
+    def test_refused(self):
+        ticket = self.issuer.issue("10.0.0.1", self.session)
+        changed = bytearray(ticket)
+        changed[12] ^= 1
+        self.assertIsNone(self.issuer.redeem("10.0.0.1", bytes(changed)))
+        self.assertIsNone(self.issuer.redeem("10.0.0.2", ticket))
+        self.assertIsNone(RxPTicketIssuer().redeem("10.0.0.1", ticket))
+        self.assertIsNone(self.issuer.redeem("10.0.0.1", ticket[:-1]))
+        # servers sharing a key take each other's tickets
+        self.assertIsNotNone(RxPTicketIssuer(self.issuer.key).redeem("10.0.0.1", ticket))
+
+    """Test a ticket is only good for its lifetime"""
+    def test_expired(self):
+        issuer = RxPTicketIssuer(lifetime=0.05)
+        ticket = issuer.issue("10.0.0.1", self.session)
+        time.sleep(0.1)
+        self.assertIsNone(issuer.redeem("10.0.0.1", ticket))
+
+
+class TestSessionCache(unittest.TestCase):
+
+    def test_capacity(self):
+        cache = RxPSessionCache(capacity=2)
+        for port in range(3):
+            cache.put(("127.0.0.1", port), RxPSession(None, None, port, port))
+        self.assertIsNone(cache.get(("127.0.0.1", 0)))
+        self.assertEqual(cache.get(("127.0.0.1", 2)).cwnd, 2)
+        # a session put again is the newest
+        cache.put(("127.0.0.1", 1), RxPSession(None, None, 5, 5))
+        cache.put(("127.0.0.1", 3), RxPSession(None, None, 3, 3))
+        self.assertIsNone(cache.get(("127.0.0.1", 2)))
+        self.assertEqual(cache.get(("127.0.0.1", 1)).cwnd, 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import hashlib
+import hmac
+import os
+import struct
+import time
+from threading import Lock
+
+'''
+What a connection learned about the path to a peer, the round trip time estimate and the
+congestion window, so the next connection to the same peer can start from there
+'''
+class RxPSession:
+    def __init__(self, srtt, rttvar, cwnd, ssthresh, ticket=None):
+        # seconds, None when the connection never measured one
+        self.srtt = srtt
+        self.rttvar = rttvar
+        # packets
+        self.cwnd = cwnd
+        self.ssthresh = ssthresh
+        # the server's ticket for resuming, kept by the client
+        self.ticket = ticket
+
+    def __str__(self):
+        return "srtt: %s, rttvar: %s, cwnd: %s, ssthresh: %s" % (self.srtt, self.rttvar, self.cwnd, self.ssthresh)
+
+
+'''
+Issues the resumption tickets a server sends in its FIN and takes them back in a SYN
+A ticket is the session of the connection sealed with an HMAC, the server keeps nothing and the
+client can not read or change it. A ticket is only taken from the address it was issued to and
+for lifetime seconds. Servers sharing a port in an RxPServerPool must share the key
+'''
+class RxPTicketIssuer:
+    VERSION = 1
+    # version, time issued, srtt, rttvar, cwnd, ssthresh
+    TICKET = struct.Struct('!Bdffff')
+    MAC_SIZE = 16
+
+    def __init__(self, key=None, lifetime=600.0):
+        self.key = key if key is not None else os.urandom(32)
+        self.lifetime = lifetime
+
+    def issue(self, ip, session):
+        ticket = self.TICKET.pack(self.VERSION, time.time(), session.srtt or 0.0, session.rttvar or 0.0, session.cwnd, session.ssthresh)
+        return ticket + self.__mac(ip, ticket)
+
+    """The session in a ticket from ip, None when it is not one of ours, was changed or expired"""
+    def redeem(self, ip, ticket):
+        ticket = bytes(ticket)
+        if len(ticket) != self.TICKET.size + self.MAC_SIZE:
+            return None
+        ticket, mac = ticket[:self.TICKET.size], ticket[self.TICKET.size:]
+        if not hmac.compare_digest(mac, self.__mac(ip, ticket)):
+            return None
+        version, issued, srtt, rttvar, cwnd, ssthresh = self.TICKET.unpack(ticket)
+        if version != self.VERSION or not 0 <= time.time() - issued <= self.lifetime:
+            return None
+        return RxPSession(srtt or None, rttvar or None, cwnd, ssthresh)
+
+    def __mac(self, ip, ticket):
+        return hmac.new(self.key, ip.encode('utf-8') + ticket, hashlib.sha256).digest()[:self.MAC_SIZE]
+
+
+'''
+The sessions a client has with servers, keyed by the server's (ip, port)
+Share one cache between the RxP sockets of a client so each new one resumes where the last left off
+'''
+class RxPSessionCache:
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.sessions = {}
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.sessions.get(key)
+
+    def put(self, key, session):
+        with self.lock:
+            self.sessions.pop(key, None)
+            if len(self.sessions) >= self.capacity:
+                # the oldest goes, dicts keep the order keys were added in
+                del self.sessions[next(iter(self.sessions))]
+            self.sessions[key] = session
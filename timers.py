@@ -0,0 +1,71 @@
+import heapq
+import itertools
+from logs import get_logger
+import time
+from threading import Thread, Condition
+
+"""A timer scheduled on a RxPTimerQueue, cancel it before it fires to stop the callback"""
+class RxPTimer:
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+'''
+One thread firing every timer of a socket off a heap ordered by deadline.
+Cancelled timers are left in the heap and skipped when they come up,
+so scheduling and cancelling are O(log n) and O(1)
+'''
+class RxPTimerQueue(Thread):
+    def __init__(self, name="RxPTimerQueue"):
+        super().__init__(name=name)
+        self.daemon = True
+        self.logger = get_logger("TimerQueue")
+        self.heap = []
+        self.condition = Condition()
+        # tie breaker so timers with the same deadline never get compared
+        self.counter = itertools.count()
+        self.closed = False
+
+    """Call callback(*args) after delay seconds, returns the RxPTimer"""
+    def schedule(self, delay, callback, *args):
+        timer = RxPTimer(time.monotonic() + delay, callback, args)
+        with self.condition:
+            if self.closed:
+                # nothing fires any more, the timer is as good as cancelled
+                timer.cancel()
+                return timer
+            if not self.is_alive():
+                self.start()
+            heapq.heappush(self.heap, (timer.deadline, next(self.counter), timer))
+            # wake the thread up if this is the new earliest deadline
+            if self.heap[0][2] is timer:
+                self.condition.notify()
+        return timer
+
+    """Stop the thread, timers that did not fire yet never will"""
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.heap = []
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.closed and (not self.heap or self.heap[0][0] > time.monotonic()):
+                    self.condition.wait(self.heap[0][0] - time.monotonic() if self.heap else None)
+                if self.closed:
+                    return
+                deadline, count, timer = heapq.heappop(self.heap)
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                self.logger.exception("Timer callback %s failed", timer.callback)